@@ -1,28 +1,191 @@
 import json
-from flask import Flask, request
+import math
+import sqlite3
+import threading
+import time
+from functools import wraps
+from flask import Blueprint, Flask, current_app, request
+import cache
+import compression
+import config as venmo_config
+import currency
 import db
+import limits
+import replay
+import velocity
 
-DB = db.DatabaseDriver()
+api = Blueprint("api", __name__)
 
-app = Flask(__name__)
+
+def create_app(config=None):
+    """
+    Build the app. config overrides the VENMO_* settings read from the
+    environment (see config.py). The database isn't opened here but by the
+    first get_db() call
+    """
+    settings = venmo_config.load(config)
+    app = Flask(__name__)
+    app.config.update(settings)
+    # Every worker process has its own buckets, so each gets an equal share
+    # of the limits and together they never let more through. That makes the
+    # per-user limit approximate (see protect_writes)
+    workers = settings["VENMO_WORKERS"]
+    app.extensions["venmo"] = {
+        "db": None,
+        "db_lock": threading.Lock(),
+        "rate_limiter": limits.RateLimiter(
+            user_rate=settings["VENMO_USER_RATE"] / workers,
+            user_burst=max(1.0, settings["VENMO_USER_BURST"] / workers),
+            global_rate=settings["VENMO_GLOBAL_RATE"] / workers,
+            global_burst=max(1.0, settings["VENMO_GLOBAL_BURST"] / workers),
+        ),
+        "admission": limits.AdmissionController(
+            max_in_flight=settings["VENMO_MAX_IN_FLIGHT"],
+            p99_threshold=settings["VENMO_P99_THRESHOLD"],
+        ),
+        "profile_cache": None,
+        "compressor": None,
+        "recorder": None,
+        "velocity": None,
+        "rates": currency.RateTable(settings["VENMO_RATES"]),
+    }
+    if settings["VENMO_WORKERS"] > 1 and settings["VENMO_REPLICA"] not in (None, ":memory:"):
+        # Every worker keeps a replica of its own
+        raise ValueError("with VENMO_WORKERS > 1, VENMO_REPLICA must be :memory:")
+    if settings["VENMO_PROFILE_CACHE"] and settings["VENMO_WORKERS"] <= 1:
+        app.extensions["venmo"]["profile_cache"] = cache.ProfileCache(settings["VENMO_PROFILE_CACHE_SIZE"])
+    if settings["VENMO_COMPRESSION"]:
+        compressor = compression.Compressor(
+            min_size=settings["VENMO_COMPRESS_MIN_SIZE"],
+            gzip_level=settings["VENMO_GZIP_LEVEL"],
+            brotli_quality=settings["VENMO_BROTLI_QUALITY"],
+        )
+        compressor.install(app)
+        app.extensions["venmo"]["compressor"] = compressor
+    if settings["VENMO_VELOCITY_RULES"]:
+        if settings["VENMO_WORKERS"] > 1:
+            # Each worker would only count the transfers it handled itself
+            raise ValueError("velocity rules can only be enforced with VENMO_WORKERS = 1")
+        app.extensions["venmo"]["velocity"] = velocity.VelocityChecker(settings["VENMO_VELOCITY_RULES"])
+    app.register_blueprint(api)
+    if settings["VENMO_RECORD"]:
+        recorder = replay.TrafficRecorder(settings["VENMO_RECORD"])
+        recorder.install(app)
+        app.extensions["venmo"]["recorder"] = recorder
+    return app
+
+
+def get_db(app=None):
+    """
+    The app's database driver (the current app's by default), opened on
+    first use. Opening it also rebuilds the velocity counters from the
+    transfers it holds and starts the exchange rate refresh, so each worker
+    process refreshes its own rates
+    """
+    app = app or current_app
+    state = app.extensions["venmo"]
+    if state["db"] is None:
+        with state["db_lock"]:
+            if state["db"] is None:
+                driver = venmo_config.open_driver(app.config)
+                if app.config["VENMO_RATES"] and app.config["VENMO_RATES_REFRESH"]:
+                    state["rates"].start_refresh(app.config["VENMO_RATES_REFRESH"])
+                checker = state["velocity"]
+                if checker is not None:
+                    rates = state["rates"]
+                    checker.rebuild([
+                        (sender_id, rates.convert(amount, paid_in, currency.BASE_CURRENCY), timestamp)
+                        for sender_id, amount, paid_in, timestamp in driver.recent_transfers(checker.longest_window())
+                        if rates.supports(paid_in)
+                    ])
+                state["db"] = driver
+    return state["db"]
 
 
-@app.route("/")
+@api.route("/")
 def hello_world():
     return "Hello world!"
 
+# Response formats for lists of transactions: "rows" is a list of objects,
+# "columnar" an object of lists, one per field, which repeats no keys
+TRANSACTION_FORMATS = ("rows", "columnar")
+TRANSACTION_FIELDS = (
+    "id", "timestamp", "sender_id", "receiver_id", "amount", "message", "accepted",
+    "currency", "source_currency", "source_amount",
+)
+
+def format_transactions(transactions, fmt):
+    if fmt == "columnar":
+        return {field: [txn[field] for txn in transactions] for field in TRANSACTION_FIELDS}
+    return transactions
+
 def success_response(body, code=200):
     return json.dumps(body), code
 
 def failure_response(message, code=404):
     return json.dumps({'error': message}), code
 
+def retry_later_response(message, code, retry_after):
+    return json.dumps({'error': message}), code, {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+def protect_writes(*user_fields):
+    """
+    Rate limit and admission-control a write route. Requests are limited per
+    value of the first of user_fields in the JSON body (or per client
+    address) and globally, answering 429 when over the limit and 503 when the
+    server is saturated. With VENMO_WORKERS > 1 each worker enforces its
+    1/VENMO_WORKERS share of the limits on the requests it happens to get,
+    so a user whose requests land unevenly may be throttled before reaching
+    VENMO_USER_RATE; the limits are an upper bound, not an exact rate
+    """
+    def decorator(route):
+        @wraps(route)
+        def wrapper(*args, **kwargs):
+            key = None
+            if user_fields:
+                try:
+                    body = json.loads(request.data)
+                    key = next((body[field] for field in user_fields if body.get(field) is not None), None)
+                except (ValueError, AttributeError):
+                    pass
+            if not isinstance(key, (int, str)):
+                key = request.remote_addr
+
+            state = current_app.extensions["venmo"]
+            wait = state["rate_limiter"].check(key)
+            if wait:
+                return retry_later_response("Too many requests", 429, wait)
+            if not state["admission"].admit():
+                return retry_later_response("Server is overloaded, try again later", 503, 1)
+
+            start = time.perf_counter()
+            try:
+                return route(*args, **kwargs)
+            finally:
+                state["admission"].release(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
 # your routes here
-@app.route("/api/users/", methods=["GET"])
+@api.route("/api/users/", methods=["GET"])
 def get_all_users():
-    return success_response({"users": DB.get_all_users()})
+    return success_response({"users": get_db().get_all_users()})
+
+@api.route("/api/users/search/", methods=["GET"])
+def search_users():
+    """
+    Prefix search over user names and usernames
+    """
+    query = request.args.get("q", "")
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return failure_response("bad request - limit must be an integer", 400)
+    if limit <= 0:
+        return failure_response("bad request - limit must be positive", 400)
+    return success_response({"users": get_db().search_users(query, min(limit, 100))})
 
-@app.route("/api/users/", methods=["POST"])
+@api.route("/api/users/", methods=["POST"])
 def create_a_user():
     """
     Create a user
@@ -39,60 +202,184 @@ def create_a_user():
     balance = body["balance"] if "balance" in body else 0
 
     try:
-        user_id = DB.create_a_user(name, username, balance)
-        user = DB.get_user_by_id(user_id)
+        user_id = get_db().create_a_user(name, username, balance)
+        user = get_db().get_user_by_id(user_id)
         if user is None:
             return failure_response("User not found!", 404)
         user["transactions"] = []
         return success_response(user, 201)
+    except sqlite3.IntegrityError:
+        return failure_response("Username is already taken", 409)
     except Exception as e:
         print("❌ Error creating user:", e)
         return failure_response(str(e), 500)
 
 
-@app.route("/api/users/<int:user_id>/", methods=["GET"])
+@api.route("/api/users/<int:user_id>/", methods=["GET"])
 def get_user_by_id(user_id):
     """
-    Get a user with a specific user_id
+    Get a user with a specific user_id. format=columnar returns the
+    transactions as one list per field. With the profile cache on, the
+    response carries an ETag and If-None-Match gets a 304 while the user is
+    unchanged; neither reads the database, and compressed copies are cached
+    along with the JSON
     """
-    user = DB.get_user_by_id(user_id)
+    fmt = request.args.get("format", "rows")
+    if fmt not in TRANSACTION_FORMATS:
+        return failure_response("bad request - format must be rows or columnar", 400)
+
+    state = current_app.extensions["venmo"]
+    profiles = state["profile_cache"]
+    if profiles is None:
+        user = get_db().get_user_by_id(user_id)
+        if user is None:
+            return failure_response("User not found", 404)
+        user["transactions"] = format_transactions(user["transactions"], fmt)
+        return success_response(user)
+
+    # The version is read before the profile, so a write landing in between
+    # leaves the entry already stale rather than wrongly current
+    version = get_db().user_version(user_id)
+    cached = profiles.get((user_id, fmt), version)
+    if cached is None:
+        user = get_db().get_user_by_id(user_id)
+        if user is None:
+            return failure_response("User not found", 404)
+        user["transactions"] = format_transactions(user["transactions"], fmt)
+        cached = profiles.put((user_id, fmt), version, json.dumps(user).encode())
+    etag, body, compressed = cached
+
+    headers = {"ETag": f'"{etag}"'}
+    compressor = state["compressor"]
+    if compressor is not None and len(body) >= compressor.min_size:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = compressor.negotiate()
+        if encoding is not None:
+            if encoding not in compressed:
+                compressed[encoding] = compressor.compress(body, encoding)
+            body = compressed[encoding]
+            headers["Content-Encoding"] = encoding
+            headers["ETag"] = "W/" + headers["ETag"]
+    if request.if_none_match.contains_weak(etag):
+        return "", 304, headers
+    return body, 200, headers
+
+
+@api.route("/api/users/by-username/<username>/", methods=["GET"])
+def get_user_by_username(username):
+    """
+    Get a user by their username
+    """
+    user = get_db().get_user_by_username(username)
     if user is None:
         return failure_response("User not found", 404)
     return success_response(user)
 
 
-@app.route("/api/users/<int:user_id>/", methods=["DELETE"])
+@api.route("/api/users/<int:user_id>/", methods=["DELETE"])
 def delete_specific_user(user_id):
     """
     Delete specific user
     """
     try:
-        user = DB.get_user_by_id(user_id)
+        user = get_db().get_user_by_id(user_id)
         if user is None:
             return failure_response("User not found", 404)
         
         deleted_user = user
-        DB.delete_specific_user(user_id)
+        get_db().delete_specific_user(user_id)
         return success_response(deleted_user, 200)
     except Exception as e:
         print("❌ Error in DELETE route:", e, flush=True)
         return failure_response("Internal server error", 500)
 
-def send_money(sender_id, sender, receiver_id, receiver, amount, message, accepted):
+def supported_currency(code):
+    return isinstance(code, str) and current_app.extensions["venmo"]["rates"].supports(code)
+
+def source_leg(amount, currency_code, source_currency):
+    """
+    The (source_currency, source_amount) charged to a sender who pays amount
+    of currency_code from their source_currency balance, converted at the
+    current rates and rounded up to the cent, or (None, None) if they pay in
+    currency_code itself
+    """
+    if source_currency is None or source_currency == currency_code:
+        return None, None
+    return source_currency, current_app.extensions["venmo"]["rates"].charge(amount, currency_code, source_currency)
+
+def check_velocity(sender_id, amount, currency_code=currency.BASE_CURRENCY, count=1):
+    """
+    Count count transfers totalling amount (of currency_code) from sender_id
+    against the velocity rules, which are in the base currency. Returns a
+    failure response if a rule blocks them, otherwise None and a function
+    that takes them back out again if they then fail or raise
+    """
+    state = current_app.extensions["venmo"]
+    checker = state["velocity"]
+    if checker is None:
+        return None, lambda: None
+    amount = state["rates"].convert(amount, currency_code, currency.BASE_CURRENCY)
+    now = time.time()
+    rule = checker.reserve(sender_id, amount, now, count)
+    if rule is not None:
+        return failure_response(f"Transfer blocked - sender sent {rule.describe()}", 403), None
+    return None, lambda: checker.release(sender_id, amount, now, count)
+
+def send_money(uow, sender_id, receiver_id, amount, message, currency_code=currency.BASE_CURRENCY,
+               source_currency=None, source_amount=None):
     """
     Send amount from sender_id to receiver_id
     """    
-    DB.send_from_sender_to_receiver(
-        sender_id, sender["balance"],
-        amount, receiver_id, receiver["balance"],
-        message 
-    )
-    
-    last_id = DB.get_last_transaction_id()
-    txn = DB.get_transaction_by_id(last_id)
+    txn = uow.send(sender_id, receiver_id, amount, message, currency_code, source_currency, source_amount)
+    if not uow.flush():
+        return failure_response("Sender has insufficient funds to perform this action", 403)
     return success_response(txn, 201)
 
-@app.route("/api/transactions/", methods=["POST"])
+@api.route("/api/transactions/", methods=["GET"])
+def search_transactions():
+    """
+    Search transactions by user, status, date range, amount range and message,
+    newest first, one page at a time. Pass the returned next_cursor as cursor
+    to get the following page. format=columnar returns one list per field
+    """
+    args = request.args
+    status = args.get("status")
+    if status is not None and status not in db.STATUS_FILTERS:
+        return failure_response("bad request - status must be true, false or null", 400)
+    fmt = args.get("format", "rows")
+    if fmt not in TRANSACTION_FORMATS:
+        return failure_response("bad request - format must be rows or columnar", 400)
+
+    try:
+        user_id = args.get("user_id", type=int) if "user_id" in args else None
+        min_amount = float(args["min_amount"]) if "min_amount" in args else None
+        max_amount = float(args["max_amount"]) if "max_amount" in args else None
+        limit = int(args.get("limit", 50))
+        before = None
+        if "cursor" in args:
+            timestamp, last_id = args["cursor"].rsplit("|", 1)
+            before = (timestamp, int(last_id))
+    except ValueError:
+        return failure_response("bad request - malformed query parameter", 400)
+    if "user_id" in args and user_id is None:
+        return failure_response("bad request - user_id must be an integer", 400)
+    if limit <= 0:
+        return failure_response("bad request - limit must be positive", 400)
+    limit = min(limit, 200)
+
+    transactions = get_db().search_transactions(
+        user_id=user_id, status=status, start=args.get("from"), end=args.get("to"),
+        min_amount=min_amount, max_amount=max_amount, message=args.get("q"),
+        before=before, limit=limit,
+    )
+    next_cursor = None
+    if len(transactions) == limit:
+        last = transactions[-1]
+        next_cursor = f"{last['timestamp']}|{last['id']}"
+    return success_response({"transactions": format_transactions(transactions, fmt), "next_cursor": next_cursor})
+
+@api.route("/api/transactions/", methods=["POST"])
+@protect_writes("sender_id")
 def create_transaction():
     """
     Create a transaction by sending or requesting money
@@ -103,6 +390,8 @@ def create_transaction():
     amount = body.get("amount", None)
     message = body.get("message", None)
     accepted = body.get("accepted", None)
+    currency_code = body.get("currency", currency.BASE_CURRENCY)
+    source_currency = body.get("source_currency", None)
 
     if sender_id is None:
         return failure_response("bad request - please put sender id", 400)
@@ -114,27 +403,155 @@ def create_transaction():
         return failure_response("bad request - amount must be a positive number", 400)
     if message is None:
         return failure_response("bad request - please put message", 400)
+    if not supported_currency(currency_code) or not (source_currency is None or supported_currency(source_currency)):
+        return failure_response("bad request - unsupported currency", 400)
     
+    uow = get_db().unit_of_work()
     if accepted is None:
-        DB.add_request_to_transactions(sender_id, receiver_id, amount, accepted, message)
-        last_id = DB.get_last_transaction_id()
-        txn = DB.get_transaction_by_id(last_id)
+        txn = uow.request(sender_id, receiver_id, amount, message, currency_code)
+        uow.flush()
         return success_response(txn, 201)
 
     elif accepted == True:
-        sender = DB.get_user_by_id(sender_id)
-        receiver = DB.get_user_by_id(receiver_id)
+        sender = uow.get_user(sender_id)
+        receiver = uow.get_user(receiver_id)
     
         if sender is None or receiver is None:
             return failure_response("Sender or receiver not found", 404)
     
-        if sender.get("balance") < amount:
+        # Balances in other currencies aren't read here; the debit is guarded
+        source_currency, source_amount = source_leg(amount, currency_code, source_currency)
+        paid_in, paid = (source_currency, source_amount) if source_currency else (currency_code, amount)
+        if paid_in == currency.BASE_CURRENCY and sender.get("balance") < paid:
             return failure_response("Sender has insufficient funds to perform this action", 403)
         
-        send_info = send_money(sender_id, sender, receiver_id, receiver, amount, message, accepted)
+        blocked, release = check_velocity(sender_id, paid, paid_in)
+        if blocked is not None:
+            return blocked
+        try:
+            send_info = send_money(uow, sender_id, receiver_id, amount, message, currency_code, source_currency, source_amount)
+        except Exception:
+            release()
+            raise
+        if send_info[1] != 201:
+            release()
         return send_info
 
-@app.route("/api/transactions/<int:id>/", methods=["POST"])
+# Most people a split can be shared among
+MAX_SPLIT_PARTICIPANTS = 100
+# Largest total or share a split accepts, well below where cents stop being
+# exact in a float
+MAX_SPLIT_AMOUNT = 1_000_000_000
+
+def split_shares(participants, total):
+    """
+    [(user_id, amount)] for a split's participants, which are either objects
+    with a user_id and amount or user ids sharing total evenly to the cent,
+    the first ones taking any cents left over. None if they are malformed
+    """
+    def is_amount(value):
+        # Also false for NaN and infinity, which JSON parsing lets through
+        return isinstance(value, (int, float)) and 0 < value <= MAX_SPLIT_AMOUNT
+
+    if all(isinstance(participant, int) for participant in participants):
+        if not is_amount(total):
+            return None
+        share, extra = divmod(round(total * 100), len(participants))
+        if share == 0:
+            return None
+        return [(user_id, (share + (i < extra)) / 100) for i, user_id in enumerate(participants)]
+
+    shares = []
+    for participant in participants:
+        if not isinstance(participant, dict) or not isinstance(participant.get("user_id"), int):
+            return None
+        if not is_amount(participant.get("amount")):
+            return None
+        shares.append((participant["user_id"], participant["amount"]))
+    return shares
+
+@api.route("/api/transactions/split/", methods=["POST"])
+@protect_writes("sender_id", "receiver_id")
+def split_transaction():
+    """
+    Pay several people, or request money from several people, at once. A
+    payment (accepted true) names its sender_id and a request its receiver_id;
+    participants are the people on the other side. Every transaction is
+    created in one commit, or none is
+    """
+    body = json.loads(request.data)
+    accepted = body.get("accepted", None)
+    message = body.get("message", None)
+    participants = body.get("participants", None)
+    currency_code = body.get("currency", currency.BASE_CURRENCY)
+    source_currency = body.get("source_currency", None)
+
+    if accepted not in (None, True):
+        return failure_response("bad request - accepted must be true or null", 400)
+    side = "sender_id" if accepted else "receiver_id"
+    user_id = body.get(side, None)
+    if user_id is None:
+        return failure_response(f"bad request - please put {side}", 400)
+    if not isinstance(user_id, int):
+        return failure_response(f"bad request - {side} must be a user id", 400)
+    if message is None:
+        return failure_response("bad request - please put message", 400)
+    if not isinstance(participants, list) or not participants:
+        return failure_response("bad request - please put participants", 400)
+    if len(participants) > MAX_SPLIT_PARTICIPANTS:
+        return failure_response(f"bad request - at most {MAX_SPLIT_PARTICIPANTS} participants", 400)
+    if not supported_currency(currency_code) or not (source_currency is None or supported_currency(source_currency)):
+        return failure_response("bad request - unsupported currency", 400)
+    shares = split_shares(participants, body.get("amount", None))
+    if shares is None:
+        return failure_response(
+            "bad request - participants must be user ids sharing a positive amount, "
+            f"or objects with a user_id and positive amount, of at most {MAX_SPLIT_AMOUNT}", 400
+        )
+    participant_ids = [participant_id for participant_id, _ in shares]
+    if len(set(participant_ids)) != len(participant_ids) or user_id in participant_ids:
+        return failure_response(f"bad request - participants must be distinct and not the {side}", 400)
+
+    uow = get_db().unit_of_work()
+    users = uow.get_users([user_id] + participant_ids)
+    if any(user is None for user in users.values()):
+        return failure_response("User not found", 404)
+
+    if accepted is None:
+        transactions = [
+            uow.request(participant_id, user_id, amount, message, currency_code)
+            for participant_id, amount in shares
+        ]
+        uow.flush()
+        return success_response({"transactions": transactions}, 201)
+
+    legs = [source_leg(amount, currency_code, source_currency) for _, amount in shares]
+    if legs[0][0] is None:
+        paid_in, paid = currency_code, db.add_money(*(amount for _, amount in shares))
+    else:
+        paid_in, paid = source_currency, db.add_money(*(source_amount for _, source_amount in legs))
+    if paid_in == currency.BASE_CURRENCY and users[user_id]["balance"] < paid:
+        return failure_response("Sender has insufficient funds to perform this action", 403)
+
+    blocked, release = check_velocity(user_id, paid, paid_in, len(shares))
+    if blocked is not None:
+        return blocked
+    transactions = [
+        uow.send(user_id, participant_id, amount, message, currency_code, *leg)
+        for (participant_id, amount), leg in zip(shares, legs)
+    ]
+    try:
+        flushed = uow.flush()
+    except Exception:
+        release()
+        raise
+    if not flushed:
+        release()
+        return failure_response("Sender has insufficient funds to perform this action", 403)
+    return success_response({"transactions": transactions}, 201)
+
+@api.route("/api/transactions/<int:id>/", methods=["POST"])
+@protect_writes()
 def accept_or_deny_request(id):
     """
     Accept or Deny a payment request
@@ -144,7 +561,11 @@ def accept_or_deny_request(id):
         return failure_response("'accepted' field is required", 400)
     
     new_status = body["accepted"]
-    transaction = DB.get_transaction_by_id(id)
+    source_currency = body.get("source_currency", None)
+    if not (source_currency is None or supported_currency(source_currency)):
+        return failure_response("bad request - unsupported currency", 400)
+    uow = get_db().unit_of_work()
+    transaction = uow.get_transaction(id)
 
     if transaction is None:
         return failure_response("Transaction not found", 404)
@@ -153,22 +574,67 @@ def accept_or_deny_request(id):
         return failure_response("Transaction has already been processed", 403)
 
     if new_status is False:
-        DB.update_accepted_status(id, False)
-        return success_response(DB.get_transaction_by_id(id), 200)
+        denied = uow.deny(transaction)
+        if not uow.flush():
+            return failure_response("Transaction has already been processed", 403)
+        return success_response(denied, 200)
 
     # Handle acceptance
-    sender = DB.get_user_by_id(transaction["sender_id"])
-    receiver = DB.get_user_by_id(transaction["receiver_id"])
+    sender = uow.get_user(transaction["sender_id"])
+    receiver = uow.get_user(transaction["receiver_id"])
     amount = transaction["amount"]
 
     if sender is None or receiver is None:
         return failure_response("Sender or receiver not found", 404)
 
-    if sender["balance"] < amount:
+    source_currency, source_amount = source_leg(amount, transaction["currency"], source_currency)
+    paid_in, paid = (source_currency, source_amount) if source_currency else (transaction["currency"], amount)
+    if paid_in == currency.BASE_CURRENCY and sender["balance"] < paid:
         return failure_response("Sender has insufficient funds", 403)
 
-    DB.accept_transaction_request(id, sender, receiver, amount)
-    return success_response(DB.get_transaction_by_id(id), 200)
+    blocked, release = check_velocity(transaction["sender_id"], paid, paid_in)
+    if blocked is not None:
+        return blocked
+    accepted = uow.accept(transaction, source_currency, source_amount)
+    try:
+        flushed = uow.flush()
+    except Exception:
+        release()
+        raise
+    if not flushed:
+        release()
+        # Another worker processed the request or drained the sender's balance
+        # between our reads and the write
+        return failure_response("Transaction could not be accepted", 403)
+    return success_response(accepted, 200)
+
+@api.route("/api/stats/volume/", methods=["GET"])
+def get_volume():
+    """
+    Transaction count and volume per minute, hour or day. from and to bound
+    the buckets (from inclusive, to exclusive) and default to everything
+    """
+    granularity = request.args.get("granularity", "hour")
+    if granularity not in db.GRANULARITIES:
+        return failure_response("bad request - granularity must be minute, hour or day", 400)
+    start = request.args.get("from", "")
+    end = request.args.get("to", "9999")
+    return success_response({
+        "granularity": granularity,
+        "buckets": get_db().get_volume(granularity, start, end),
+    })
+
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Recover the transfer journal once, before any worker starts, so that
+    # no worker replays a transfer another one is applying
+    venmo_config.recover(app.config)
+    workers = app.config["VENMO_WORKERS"]
+    if workers > 1:
+        # VENMO_WORKERS > 1 pre-forks that many gunicorn workers (see server.py)
+        import server
+        server.Server(app, {"bind": "0.0.0.0:5000", "workers": workers}).run()
+    else:
+        get_db(app)
+        app.run(host="0.0.0.0", port=5000, debug=True)
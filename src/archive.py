@@ -0,0 +1,31 @@
+"""
+Move settled transactions older than a number of days out of venmo.db and
+into the archive database (venmo_archive.db). Archived transactions still
+show up in user histories, lookups and searches.
+
+Usage: python archive.py [--db PATH] <days> [batch-size]
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+import db
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Archive old settled transactions")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("days", type=float)
+    parser.add_argument("batch_size", nargs="?", type=int, default=5000)
+    args = parser.parse_args(argv)
+    cutoff = (datetime.now() - timedelta(days=args.days)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    start = time.perf_counter()
+    moved = db.DatabaseDriver(args.db).archive_transactions(cutoff, args.batch_size)
+    print(f"Archived {moved} transactions from before {cutoff} in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,28 @@
+"""
+Take a consistent online backup of venmo.db without stalling the running app.
+
+Usage: python backup.py [--db PATH] <target.db> [pages-per-step]
+"""
+import argparse
+import sys
+import time
+
+import db
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Back up the database")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("target")
+    parser.add_argument("pages", nargs="?", type=int, default=-1, help="pages per step, -1 for one step")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    driver = db.DatabaseDriver(args.db)
+    driver.backup(args.target, pages=args.pages)
+    print(f"Backed up {driver.path} to {args.target} in {time.perf_counter() - start:.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
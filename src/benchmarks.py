@@ -0,0 +1,194 @@
+"""
+Micro-benchmarks for the database layer. Each one runs against a scratch
+database in a temporary directory, never against venmo.db.
+
+Usage: python benchmarks.py <name>
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import app
+import compression
+import db
+import memory
+import velocity
+
+
+def scratch_driver():
+    """
+    A driver for a fresh database in a temporary directory
+    """
+    return db.DatabaseDriver(os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+
+def bench_recovery(sizes=(1000, 10000, 100000, 1000000), pending_ratio=0.001):
+    """
+    Time the startup recovery pass against journals of increasing size, with
+    a fixed fraction of the entries left pending
+    """
+    driver = scratch_driver()
+    sender = driver.create_a_user("sender", "sender", 0)
+    receiver = driver.create_a_user("receiver", "receiver", 0)
+    every = int(1 / pending_ratio)
+
+    print(f"{'entries':>10} {'pending':>8} {'seconds':>9}")
+    for size in sizes:
+        with driver.write_transaction() as conn:
+            conn.execute("DELETE FROM transfer_journal;")
+            conn.executemany(
+                "INSERT INTO transfer_journal (kind, sender_id, receiver_id, amount, status) VALUES ('send', ?, ?, 1, ?);",
+                ((sender, receiver, "pending" if i % every == 0 else "replayed") for i in range(size))
+            )
+        start = time.perf_counter()
+        recovered = driver.recover_journal()
+        print(f"{size:>10} {recovered:>8} {time.perf_counter() - start:>9.4f}")
+
+
+def bench_backends(users=1000, transfers=20000):
+    """
+    Time the same mix of sends, requests, accepts and reads against the
+    SQLite driver and the in-memory one
+    """
+    print(f"{'backend':>8} {'seconds':>9} {'ops/s':>10}")
+    for name, driver in (("sqlite", scratch_driver()), ("memory", memory.MemoryDriver())):
+        ids = [driver.create_a_user(f"user {i}", f"user_{i}", 1000) for i in range(users)]
+        start = time.perf_counter()
+        for i in range(transfers):
+            sender, receiver = ids[i % users], ids[(i * 7 + 1) % users]
+            if i % 3 == 0:
+                driver.send_from_sender_to_receiver(sender, 1, receiver, "bench")
+            else:
+                request_id = driver.add_request_to_transactions(receiver, sender, 1, None, "bench")
+                driver.accept_transaction_request(request_id, sender, receiver, 1)
+            driver.get_user_row(sender)
+        seconds = time.perf_counter() - start
+        print(f"{name:>8} {seconds:>9.3f} {transfers / seconds:>10.0f}")
+
+
+def bench_profiles(history=200, requests=2000):
+    """
+    Time GET /api/users/<id>/ for a user with a long history with the profile
+    cache off, with it on, and as conditional GETs answered 304
+    """
+    print(f"{'mode':>12} {'seconds':>9} {'requests/s':>11}")
+    for mode in ("uncached", "cached", "conditional"):
+        venmo = app.create_app({
+            "VENMO_DB_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+            "VENMO_PROFILE_CACHE": mode != "uncached",
+        })
+        driver = app.get_db(venmo)
+        user = driver.create_a_user("user", "user", 0)
+        other = driver.create_a_user("other", "other", 0)
+        for i in range(history):
+            driver.add_request_to_transactions(other, user, 1, None, "bench")
+        client = venmo.test_client()
+        etag = client.get(f"/api/users/{user}/").headers.get("ETag")
+        headers = {"If-None-Match": etag} if mode == "conditional" else {}
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(f"/api/users/{user}/", headers=headers)
+        seconds = time.perf_counter() - start
+        print(f"{mode:>12} {seconds:>9.3f} {requests / seconds:>11.0f}")
+
+
+def bench_compression(history=1000, repeat=50):
+    """
+    Bytes on the wire and compression time for one user's full profile, in
+    rows and columnar format, uncompressed and at several gzip levels and
+    brotli qualities
+    """
+    driver = memory.MemoryDriver()
+    user = driver.create_a_user("user", "user", history)
+    others = [driver.create_a_user(f"friend {i}", f"friend_{i}", 0) for i in range(20)]
+    for i in range(history):
+        driver.send_from_sender_to_receiver(user, 1, others[i % 20], ["boba", "rent", "dinner", "coffee"][i % 4])
+    profile = driver.get_user_by_id(user)
+
+    settings = [("identity", None)] + [(f"gzip-{level}", ("gzip", level)) for level in (1, 6, 9)]
+    if "br" in compression.ENCODINGS:
+        settings += [(f"br-{quality}", ("br", quality)) for quality in (1, 5, 11)]
+
+    print(f"{'format':>9} {'encoding':>9} {'bytes':>9} {'ratio':>6} {'ms':>8}")
+    for fmt in app.TRANSACTION_FORMATS:
+        body = json.dumps(dict(profile, transactions=app.format_transactions(profile["transactions"], fmt))).encode()
+        for name, setting in settings:
+            size, seconds = len(body), 0.0
+            if setting is not None:
+                encoding, level = setting
+                compressor = compression.Compressor(gzip_level=level, brotli_quality=level)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    size = len(compressor.compress(body, encoding))
+                seconds = (time.perf_counter() - start) / repeat
+            print(f"{fmt:>9} {name:>9} {size:>9} {len(body) / size:>6.1f} {seconds * 1000:>8.3f}")
+
+
+def bench_velocity(senders=10000, checks=1000000):
+    """
+    Time a velocity check (reserve) per transfer with one and with two rules,
+    spread over many senders
+    """
+    print(f"{'rules':>40} {'checks/s':>11} {'us/check':>9}")
+    for rules in ("3600:amount=1000000", "3600:amount=1000000:count=100000,86400:amount=10000000"):
+        checker = velocity.VelocityChecker(velocity.parse_rules(rules))
+        now = time.time()
+        start = time.perf_counter()
+        for i in range(checks):
+            checker.reserve(i % senders, 1.0, now + i * 0.001)
+        seconds = time.perf_counter() - start
+        print(f"{rules[:40]:>40} {checks / seconds:>11.0f} {seconds / checks * 1e6:>9.3f}")
+
+
+def bench_split(participants=(2, 8, 32), repeat=200):
+    """
+    Time paying several people with one POST /api/transactions/ each against
+    one POST /api/transactions/split/
+    """
+    print(f"{'people':>7} {'separate ms':>12} {'split ms':>9}")
+    for count in participants:
+        venmo = app.create_app({
+            "VENMO_DB_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+            "VENMO_USER_RATE": 1e9, "VENMO_USER_BURST": 1e9,
+            "VENMO_GLOBAL_RATE": 1e9, "VENMO_GLOBAL_BURST": 1e9,
+        })
+        driver = app.get_db(venmo)
+        payer = driver.create_a_user("payer", "payer", 1e9)
+        friends = [driver.create_a_user(f"friend {i}", f"friend_{i}", 0) for i in range(count)]
+        client = venmo.test_client()
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for friend in friends:
+                client.post("/api/transactions/", json={
+                    "sender_id": payer, "receiver_id": friend, "amount": 1, "message": "dinner", "accepted": True,
+                })
+        separate = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            client.post("/api/transactions/split/", json={
+                "sender_id": payer, "participants": friends, "amount": count, "message": "dinner", "accepted": True,
+            })
+        split = (time.perf_counter() - start) / repeat
+        print(f"{count:>7} {separate * 1000:>12.2f} {split * 1000:>9.2f}")
+
+
+BENCHMARKS = {
+    "backends": bench_backends,
+    "compression": bench_compression,
+    "profiles": bench_profiles,
+    "recovery": bench_recovery,
+    "split": bench_split,
+    "velocity": bench_velocity,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in BENCHMARKS:
+        print(__doc__.strip())
+        print("Benchmarks:", ", ".join(BENCHMARKS))
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]]()
@@ -0,0 +1,54 @@
+"""
+Cache of serialized user profiles for GET /api/users/<id>/.
+
+Entries are keyed by user id and response format. Each holds the profile's
+JSON, ready to send, any compressed copies of it made so far, and the user
+version (see db.UserVersions) it was read at. An entry is only served while
+the driver still reports that version, so any transfer, request, accept or
+deny involving the user makes it stale. The ETag is derived from the version too,
+and a per-process epoch keeps a restarted server from matching tags handed
+out before the restart.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class ProfileCache(object):
+    """
+    Least recently used cache of (etag, body, compressed bodies by encoding)
+    per (user id, format)
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def get(self, key, version):
+        """
+        The cached (etag, body, compressed) for key if it is at version,
+        otherwise None. compressed is a dict the caller may add to
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, version, body):
+        """
+        Cache body, the profile for key serialized at version, and return its
+        (etag, body, compressed)
+        """
+        user_id, fmt = key
+        generation, user_version = version
+        entry = (version, f"{self.epoch}-{generation}-{user_version}-{user_id}-{fmt}", body, {})
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry[1:]
@@ -0,0 +1,68 @@
+"""
+Compression of responses, negotiated from the request's Accept-Encoding.
+
+Responses of at least min_size bytes are sent brotli compressed to clients
+that accept "br", gzip compressed to clients that accept "gzip", and as is
+otherwise. Brotli needs the Brotli package; without it only gzip is offered.
+A compressed response's ETag is made weak, since its bytes differ from the
+uncompressed representation's.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# In order of preference
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+class Compressor(object):
+    """
+    Compresses an app's responses once installed with install(app)
+    """
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def install(self, app):
+        app.after_request(self.after_request)
+
+    def negotiate(self):
+        """
+        The encoding to use for the current request, or None
+        """
+        accepted = request.accept_encodings
+        for encoding in ENCODINGS:
+            if accepted[encoding]:
+                return encoding
+        return None
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    def after_request(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or "Content-Encoding" in response.headers):
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        response.set_data(self.compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
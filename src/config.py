@@ -0,0 +1,176 @@
+"""
+Settings for the app and its database.
+
+Every setting is a VENMO_* name. load() takes each one from the overrides
+passed to app.create_app, then from the environment variable of the same
+name, then from DEFAULTS. open_driver() opens the backend a config asks for.
+"""
+import os
+
+import db
+import memory
+import velocity
+
+DEFAULTS = {
+    # "sqlite", or "memory" for memory.MemoryDriver
+    "VENMO_BACKEND": "sqlite",
+    "VENMO_DB_PATH": db.DB_PATH,
+    # Defaults to ARCHIVE_PATH, or <path>_archive.db next to any other database
+    "VENMO_ARCHIVE_PATH": None,
+    # SQLite connections shared by the threads of a process
+    "VENMO_POOL_SIZE": 1,
+    # Extra PRAGMAs run on every connection, e.g. "synchronous=NORMAL,cache_size=-65536"
+    "VENMO_PRAGMAS": {},
+    "VENMO_REPLICA": None,
+    "VENMO_REPLICA_INTERVAL": 5.0,
+    "VENMO_REQUEST_TTL": None,
+    "VENMO_SWEEP_INTERVAL": 60.0,
+    # Seconds between folds of new transactions into the volume rollups
+    "VENMO_ROLLUP_INTERVAL": 60.0,
+    "VENMO_SNAPSHOT": None,
+    "VENMO_SNAPSHOT_INTERVAL": 60.0,
+    "VENMO_WRITE_LOG": None,
+    # Requests per second and bursts, per user and overall, across all
+    # workers; with more than one worker they are approximate (see
+    # app.protect_writes)
+    "VENMO_USER_RATE": 20.0,
+    "VENMO_USER_BURST": 40.0,
+    "VENMO_GLOBAL_RATE": 2000.0,
+    "VENMO_GLOBAL_BURST": 4000.0,
+    "VENMO_MAX_IN_FLIGHT": 64,
+    "VENMO_P99_THRESHOLD": 1.0,
+    "VENMO_RECORD": None,
+    # Processes serving the app. More than one runs pre-forked gunicorn
+    # workers (see server.py), each with its own database connections
+    "VENMO_WORKERS": 1,
+    # Serialized profiles kept for GET /api/users/<id>/. Only used with one
+    # worker, since writes made by other worker processes can't invalidate it
+    "VENMO_PROFILE_CACHE": True,
+    "VENMO_PROFILE_CACHE_SIZE": 10000,
+    # Compress responses of at least VENMO_COMPRESS_MIN_SIZE bytes for
+    # clients that accept it
+    "VENMO_COMPRESSION": True,
+    "VENMO_COMPRESS_MIN_SIZE": 1024,
+    "VENMO_GZIP_LEVEL": 6,
+    "VENMO_BROTLI_QUALITY": 5,
+    # Limits on money leaving an account, e.g. "3600:amount=500:count=20" for
+    # at most $500 and 20 transfers an hour (see velocity.py). The counters
+    # live in the serving process, so rules require VENMO_WORKERS = 1
+    "VENMO_VELOCITY_RULES": [],
+    # JSON file of exchange rates per unit of currency.BASE_CURRENCY, reread
+    # every VENMO_RATES_REFRESH seconds if it changes. Without one, only the
+    # base currency is accepted
+    "VENMO_RATES": None,
+    "VENMO_RATES_REFRESH": 60.0,
+}
+
+
+def parse_pragmas(text):
+    """
+    Parse "name=value,name=value" into a dict
+    """
+    pragmas = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, value = item.partition("=")
+        pragmas[name.strip()] = value.strip()
+    return pragmas
+
+
+def parse_flag(text):
+    return text.strip().lower() not in ("0", "false", "no", "off")
+
+
+# How to read a setting from its environment variable, for settings that
+# aren't strings
+PARSERS = {
+    "VENMO_POOL_SIZE": int,
+    "VENMO_PRAGMAS": parse_pragmas,
+    "VENMO_REPLICA_INTERVAL": float,
+    "VENMO_REQUEST_TTL": float,
+    "VENMO_SWEEP_INTERVAL": float,
+    "VENMO_ROLLUP_INTERVAL": float,
+    "VENMO_SNAPSHOT_INTERVAL": float,
+    "VENMO_USER_RATE": float,
+    "VENMO_USER_BURST": float,
+    "VENMO_GLOBAL_RATE": float,
+    "VENMO_GLOBAL_BURST": float,
+    "VENMO_MAX_IN_FLIGHT": int,
+    "VENMO_P99_THRESHOLD": float,
+    "VENMO_WORKERS": int,
+    "VENMO_PROFILE_CACHE": parse_flag,
+    "VENMO_PROFILE_CACHE_SIZE": int,
+    "VENMO_COMPRESSION": parse_flag,
+    "VENMO_COMPRESS_MIN_SIZE": int,
+    "VENMO_GZIP_LEVEL": int,
+    "VENMO_BROTLI_QUALITY": int,
+    "VENMO_VELOCITY_RULES": velocity.parse_rules,
+    "VENMO_RATES_REFRESH": float,
+}
+
+
+def load(overrides=None):
+    """
+    The full set of settings, from overrides, the environment and DEFAULTS
+    """
+    overrides = overrides or {}
+    unknown = set(overrides) - set(DEFAULTS)
+    if unknown:
+        raise KeyError(f"unknown settings: {', '.join(sorted(unknown))}")
+    config = {}
+    for name, default in DEFAULTS.items():
+        if name in overrides:
+            config[name] = overrides[name]
+        elif os.environ.get(name):
+            config[name] = PARSERS.get(name, str)(os.environ[name])
+        else:
+            config[name] = default
+    return config
+
+
+def recover(config):
+    """
+    Resolve the transfers a crash left half done (see
+    DatabaseDriver.recover_journal). Call once when the server starts,
+    before it or any of its workers serve a request
+    """
+    if config["VENMO_BACKEND"] != "sqlite":
+        return 0
+    driver = db.DatabaseDriver(
+        config["VENMO_DB_PATH"],
+        archive_path=config["VENMO_ARCHIVE_PATH"],
+        pragmas=config["VENMO_PRAGMAS"],
+    )
+    try:
+        recovered = driver.recover_journal()
+        driver.prune_journal()
+        return recovered
+    finally:
+        driver.close()
+
+
+def open_driver(config):
+    """
+    Open the database backend config asks for, with its background jobs
+    """
+    if config["VENMO_BACKEND"] == "memory":
+        return memory.MemoryDriver(
+            snapshot_path=config["VENMO_SNAPSHOT"],
+            snapshot_interval=config["VENMO_SNAPSHOT_INTERVAL"],
+            log_path=config["VENMO_WRITE_LOG"],
+        )
+    if config["VENMO_BACKEND"] != "sqlite":
+        raise ValueError(f"unknown backend {config['VENMO_BACKEND']!r}")
+
+    driver = db.DatabaseDriver(
+        config["VENMO_DB_PATH"],
+        archive_path=config["VENMO_ARCHIVE_PATH"],
+        pool_size=config["VENMO_POOL_SIZE"],
+        pragmas=config["VENMO_PRAGMAS"],
+    )
+    if config["VENMO_REPLICA"]:
+        driver.start_replica(config["VENMO_REPLICA"], config["VENMO_REPLICA_INTERVAL"])
+    if config["VENMO_REQUEST_TTL"]:
+        driver.start_request_sweeper(config["VENMO_REQUEST_TTL"], config["VENMO_SWEEP_INTERVAL"])
+    if config["VENMO_ROLLUP_INTERVAL"]:
+        driver.start_rollup_refresh(config["VENMO_ROLLUP_INTERVAL"])
+    return driver
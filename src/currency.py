@@ -0,0 +1,94 @@
+"""
+Exchange rates for transfers between currencies.
+
+Every user has a balance in BASE_CURRENCY (venmo.balance) and may hold
+balances in other currencies. A transfer credits the receiver in its
+currency; the sender pays in that currency too, unless they pay from
+another one, in which case the amount is converted at the current rates.
+
+Rates are read from a local JSON file of units of each currency per unit of
+BASE_CURRENCY, e.g. {"EUR": 0.92, "GBP": 0.79}, and held in memory, so a
+conversion never touches the database. start_refresh() reloads the file in
+a background thread whenever it changes; threads don't survive fork, so each
+process that converts has to start its own. Each load gets a new version, and a
+conversion reads one (version, rates) pair, so it never mixes two loads.
+"""
+import json
+import math
+import os
+import threading
+import time
+
+BASE_CURRENCY = "USD"
+
+
+class RateTable(object):
+    """
+    Exchange rates loaded from path, or only BASE_CURRENCY without one
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.mtime = None
+        self.refresh_pid = None
+        self.current = (0, {BASE_CURRENCY: 1.0})
+        if path:
+            self.load()
+
+    def load(self):
+        """
+        Read the rates file and make it the current version
+        """
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path) as f:
+            rates = {currency: float(rate) for currency, rate in json.load(f).items()}
+        if any(rate <= 0 for rate in rates.values()):
+            raise ValueError(f"rates in {self.path} must be positive")
+        rates[BASE_CURRENCY] = 1.0
+        self.current = (self.current[0] + 1, rates)
+        self.mtime = mtime
+
+    def start_refresh(self, interval):
+        """
+        Reload the rates file every interval seconds if it has changed, in a
+        thread of this process unless one is already running
+        """
+        if self.refresh_pid == os.getpid():
+            return
+        self.refresh_pid = os.getpid()
+        def refresh_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    if os.stat(self.path).st_mtime != self.mtime:
+                        self.load()
+                        print(f"Loaded exchange rates version {self.current[0]}", flush=True)
+                except Exception as e:
+                    print("Exchange rate refresh failed:", e, flush=True)
+
+        threading.Thread(target=refresh_forever, daemon=True).start()
+
+    def supports(self, currency):
+        return currency in self.current[1]
+
+    def convert(self, amount, source, target):
+        """
+        amount in source currency expressed in target currency, rounded to
+        cents. Raises KeyError for a currency without a rate
+        """
+        if source == target:
+            return amount
+        rates = self.current[1]
+        return round(amount / rates[source] * rates[target], 2)
+
+    def charge(self, amount, source, target):
+        """
+        What paying amount in source currency costs in target currency: the
+        conversion rounded up to the cent, so a converted transfer never pays
+        out more than it takes in
+        """
+        if source == target:
+            return amount
+        rates = self.current[1]
+        # Rounded first so float noise like 50.000000001 doesn't cost a cent
+        return math.ceil(round(amount / rates[source] * rates[target] * 100, 6)) / 100
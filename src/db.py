@@ -1,18 +1,207 @@
+import itertools
+import json
 import os
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
 
-# From: https://goo.gl/YzypOI
-def singleton(cls):
-    instances = {}
+from currency import BASE_CURRENCY
 
-    def getinstance():
-        if cls not in instances:
-            instances[cls] = cls()
-        return instances[cls]
+# Default database for DatabaseDriver()
+DB_PATH = "venmo.db"
+# Settled transactions moved out of venmo.db by archive_transactions; attached
+# to every connection as the "archive" schema
+ARCHIVE_PATH = "venmo_archive.db"
 
-    return getinstance
+# Every statement the driver runs, by name. Going through one registry keeps
+# the SQL text of each statement identical at every call site, so sqlite3's
+# per-connection statement cache (sized to hold all of them) prepares each
+# one once, and lets the query-plan tests check every statement we ship.
+QUERIES = {
+    "all_users": "SELECT id, name, username FROM venmo;",
+    "insert_user": "INSERT INTO venmo (name, username, balance, opening_balance) VALUES (?, ?, ?, ?);",
+    "user_by_id": "SELECT id, name, username, balance FROM venmo WHERE id = ?;",
+    "users_by_ids": "SELECT id, name, username, balance FROM venmo WHERE id IN (SELECT value FROM json_each(?));",
+    "user_id_by_username": "SELECT id FROM venmo WHERE username = ?;",
+    "duplicate_usernames": """
+        SELECT username, COUNT(*) FROM venmo
+        WHERE username IS NOT NULL
+        GROUP BY username HAVING COUNT(*) > 1;
+    """,
+    "user_history": """
+        SELECT id, timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount
+        FROM transactions
+        WHERE sender_id = ? OR receiver_id = ?
+        ORDER BY timestamp DESC;
+    """,
+    "user_history_with_archive": """
+        SELECT id, timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount
+        FROM transactions
+        WHERE sender_id = ? OR receiver_id = ?
+        UNION
+        SELECT id, timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount
+        FROM archive.transactions
+        WHERE sender_id = ? OR receiver_id = ?
+        ORDER BY timestamp DESC;
+    """,
+    "archived_count": "SELECT count FROM archived_counts WHERE user_id = ?;",
+    "delete_user": "DELETE FROM venmo WHERE id = ?;",
+    "delete_user_balances": "DELETE FROM balances WHERE user_id = ?;",
+    "load_user": "INSERT INTO venmo (id, name, username, balance, opening_balance) VALUES (?, ?, ?, ?, ?);",
+    "load_transaction": "INSERT INTO transactions (timestamp, sender_id, receiver_id, amount, message, accepted) VALUES (?, ?, ?, ?, ?, ?);",
+    "user_count": "SELECT COUNT(*) FROM venmo;",
+    "search_users": """
+        SELECT venmo.id, venmo.name, venmo.username
+        FROM venmo_search JOIN venmo ON venmo.id = venmo_search.rowid
+        WHERE venmo_search MATCH ?
+        ORDER BY venmo_search.rank
+        LIMIT ?;
+    """,
+    "debit_balance": "UPDATE venmo SET balance = balance - ? WHERE id = ? AND balance >= ?;",
+    "credit_balance": "UPDATE venmo SET balance = balance + ? WHERE id = ?;",
+    "debit_currency_balance": "UPDATE balances SET amount = amount - ? WHERE user_id = ? AND currency = ? AND amount >= ?;",
+    "credit_currency_balance": """
+        INSERT INTO balances (user_id, currency, amount) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, currency) DO UPDATE SET amount = amount + excluded.amount;
+    """,
+    "currency_balances": "SELECT currency, amount FROM balances WHERE user_id = ? ORDER BY currency;",
+    "insert_transaction": """
+        INSERT INTO transactions (timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """,
+    "transaction_by_id": "SELECT id, timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount FROM transactions WHERE id = ?;",
+    "archived_transaction_by_id": "SELECT id, timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount FROM archive.transactions WHERE id = ?;",
+    "transaction_status": "SELECT accepted, currency FROM transactions WHERE id = ?;",
+    "update_accepted": "UPDATE transactions SET accepted = ?, timestamp = ? WHERE id = ?;",
+    "accept_request": "UPDATE transactions SET accepted = 1, timestamp = ?, source_currency = ?, source_amount = ? WHERE id = ?;",
+    "deny_request": "UPDATE transactions SET accepted = 0, timestamp = ? WHERE id = ? AND accepted IS NULL;",
+    "last_insert_id": "SELECT last_insert_rowid();",
+    "expire_requests": """
+        UPDATE transactions SET accepted = 0, timestamp = ?
+        WHERE id IN (
+            SELECT id FROM transactions
+            WHERE accepted IS NULL AND timestamp < ?
+            ORDER BY timestamp
+            LIMIT ?
+        );
+    """,
+    "max_transaction_id": "SELECT COALESCE(MAX(id), 0) FROM transactions;",
+    "max_user_id": "SELECT COALESCE(MAX(id), 0) FROM venmo;",
+    # Accepted transfers as (sender, receiver, amount sent, amount received),
+    # with 0 in place of a party whose leg isn't in BASE_CURRENCY
+    "accepted_transfers": f"""
+        SELECT
+            CASE WHEN COALESCE(source_currency, currency) = '{BASE_CURRENCY}' THEN sender_id ELSE 0 END,
+            CASE WHEN currency = '{BASE_CURRENCY}' THEN receiver_id ELSE 0 END,
+            COALESCE(source_amount, amount), amount
+        FROM (
+            SELECT sender_id, receiver_id, amount, currency, source_currency, source_amount
+            FROM transactions WHERE accepted = 1
+            UNION ALL
+            SELECT sender_id, receiver_id, amount, currency, source_currency, source_amount
+            FROM archive.transactions AS archived
+            WHERE accepted = 1
+            AND NOT EXISTS (SELECT 1 FROM main.transactions WHERE id = archived.id)
+        );
+    """,
+    "recent_transfers": """
+        SELECT sender_id, COALESCE(source_amount, amount), COALESCE(source_currency, currency), timestamp
+        FROM transactions
+        WHERE accepted = 1 AND timestamp >= ?
+        ORDER BY timestamp;
+    """,
+    "archived_before": "SELECT archived_before FROM archive_state;",
+    "select_archive_batch": """
+        SELECT id FROM transactions
+        WHERE accepted IS NOT NULL AND timestamp < ? AND id <= ?
+        ORDER BY timestamp
+        LIMIT ?;
+    """,
+    "clear_archive_batch": "DELETE FROM archive_batch;",
+    "add_to_archive_batch": "INSERT INTO archive_batch (id) VALUES (?);",
+    "archive_batch_size": "SELECT COUNT(*) FROM archive_batch;",
+    "copy_to_archive": """
+        INSERT OR IGNORE INTO archive.transactions
+        SELECT id, timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount
+        FROM main.transactions WHERE id IN (SELECT id FROM archive_batch);
+    """,
+    "count_archived": """
+        INSERT INTO archived_counts (user_id, count)
+        SELECT user_id, COUNT(*) FROM (
+            SELECT sender_id AS user_id FROM transactions
+            WHERE id IN (SELECT id FROM archive_batch)
+            UNION ALL
+            SELECT receiver_id FROM transactions
+            WHERE id IN (SELECT id FROM archive_batch) AND receiver_id != sender_id
+        )
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET count = count + excluded.count;
+    """,
+    "delete_archived": "DELETE FROM transactions WHERE id IN (SELECT id FROM archive_batch);",
+    "set_archived_before": "UPDATE archive_state SET archived_before = MAX(archived_before, ?);",
+    "user_balances": "SELECT id, opening_balance, balance FROM venmo;",
+    "rollup_high_water_mark": "SELECT last_id FROM rollup_state WHERE name = 'volume';",
+    "set_rollup_high_water_mark": "INSERT OR REPLACE INTO rollup_state (name, last_id) VALUES ('volume', ?);",
+    "fold_volume_rollup": """
+        INSERT INTO volume_rollups (granularity, bucket, count, volume)
+        SELECT ?, STRFTIME(?, timestamp), COUNT(*), SUM(amount)
+        FROM transactions
+        WHERE id > ? AND id <= ?
+        GROUP BY 2
+        ON CONFLICT (granularity, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            volume = volume + excluded.volume;
+    """,
+    # The rollups plus the transactions not folded into them yet, in one
+    # statement so both are read from the same snapshot
+    "volume_rollups": """
+        SELECT bucket, SUM(count), SUM(volume) FROM (
+            SELECT bucket, count, volume FROM volume_rollups
+            WHERE granularity = ? AND bucket >= ? AND bucket < ?
+            UNION ALL
+            SELECT STRFTIME(?, timestamp) AS bucket, 1, amount FROM transactions
+            WHERE id > COALESCE((SELECT last_id FROM rollup_state WHERE name = 'volume'), 0)
+        )
+        WHERE bucket >= ? AND bucket < ?
+        GROUP BY bucket
+        ORDER BY bucket;
+    """,
+    "insert_journal": """
+        INSERT INTO transfer_journal (created_at, kind, transaction_id, sender_id, receiver_id, amount, currency, source_currency, source_amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """,
+    "pending_journal": """
+        SELECT id, kind, transaction_id, sender_id, receiver_id, amount, source_currency, source_amount
+        FROM transfer_journal WHERE status = 'pending';
+    """,
+    "set_journal_status": "UPDATE transfer_journal SET status = ? WHERE id = ?;",
+    "delete_journal": "DELETE FROM transfer_journal WHERE id = ?;",
+    "prune_journal": "DELETE FROM transfer_journal WHERE status != 'pending' AND created_at < ?;",
+}
+
+TRANSACTION_COLUMNS = "id, timestamp, sender_id, receiver_id, amount, message, accepted, currency, source_currency, source_amount"
+
+# Bucket formats for each rollup granularity, applied to transaction timestamps
+GRANULARITIES = {
+    "minute": "%Y-%m-%d %H:%M",
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+}
+
+# SQL for each value of the status filter in search_transactions
+STATUS_FILTERS = {
+    "true": "accepted = 1",
+    "false": "accepted = 0",
+    "null": "accepted IS NULL",
+}
 
+# Lookups on the request path that must always be served from an index
+HOT_QUERIES = ("user_by_id", "user_id_by_username", "user_history", "transaction_by_id", "transaction_status")
 
 class DatabaseDriver(object):
     """
@@ -20,14 +209,187 @@ class DatabaseDriver(object):
     Handles with reading and writing data with the database.
     """
 
-    def __init__(self):
-        self.conn = sqlite3.connect("venmo.db", check_same_thread=False)
+    def __init__(self, path=None, archive_path=None, pool_size=1, pragmas=None):
+        """
+        Open the database at path (DB_PATH by default) and its archive, with
+        pool_size connections shared among threads and extra pragmas on each
+        """
+        self.path = path or DB_PATH
+        # Every connection to ":memory:" is a separate database
+        self.pool_size = 1 if self.path == ":memory:" else max(1, pool_size)
+        self.pragmas = dict(pragmas or {})
+        for name, value in self.pragmas.items():
+            if not re.fullmatch(r"\w+", name) or not re.fullmatch(r"-?[\w.]+", str(value)):
+                raise ValueError(f"bad pragma {name}={value}")
+        if archive_path is None:
+            if path is None:
+                archive_path = ARCHIVE_PATH
+            elif path == ":memory:":
+                archive_path = ":memory:"
+            else:
+                archive_path = os.path.splitext(path)[0] + "_archive.db"
+        self.archive_path = archive_path
+        self._connect()
         self.create_venmo_table()
+        self.create_username_index()
+        self.create_user_search_index()
         self.create_transactions_table()
+        self.add_opening_balances()
+        self.create_indexes()
+        self.create_transfer_journal_table()
+        self.create_rollup_tables()
+        self.create_archive_tables()
+        self.add_currency_columns()
+        self.create_balances_table()
+        self.replica = None
+        self.versions = UserVersions()
+
+    def close(self):
+        for conn in self.pool:
+            conn.close()
+
+    def _connect(self):
+        self.pool = [self._open_connection() for _ in range(self.pool_size)]
+        self.assigned = itertools.count()
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def _open_connection(self):
+        # timeout doubles as SQLite's busy timeout, so a worker waits for the
+        # write lock held by another process instead of failing straight away
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, timeout=30, cached_statements=len(QUERIES) + 32
+        )
+        # WAL lets readers in every worker process run alongside the writer
+        conn.execute("PRAGMA journal_mode=WAL;")
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value};")
+        conn.execute("ATTACH DATABASE ? AS archive;", (self.archive_path,))
+        # Ids of the transactions archive_transactions is moving right now
+        conn.execute("CREATE TEMP TABLE archive_batch (id INTEGER PRIMARY KEY);")
+        return conn
+
+    @property
+    def conn(self):
+        """
+        The current thread's connection from the pool, reopened after fork()
+        """
+        if self.pid != os.getpid():
+            self._connect()
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self.pool[next(self.assigned) % self.pool_size]
+        return conn
+
+    @contextmanager
+    def write_transaction(self):
+        """
+        Run a block of writes as one transaction. The thread lock serializes
+        this driver's writers across its connections and BEGIN IMMEDIATE takes SQLite's
+        write lock up front, so writers in other processes queue behind it
+        """
+        with self.write_lock:
+            self.conn.execute("BEGIN IMMEDIATE;")
+            try:
+                yield self.conn
+            except Exception:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def backup(self, target, pages=-1, sleep=0.005):
+        """
+        Copy the live database into target (a path or sqlite3 connection),
+        pages at a time, without blocking writers
+        """
+        # An in-memory database can only be read through its own connection
+        in_memory = self.path == ":memory:"
+        source = self.conn if in_memory else sqlite3.connect(self.path, timeout=30)
+        dest = sqlite3.connect(target) if isinstance(target, str) else target
+        try:
+            source.backup(dest, pages=pages, sleep=sleep)
+        finally:
+            if not in_memory:
+                source.close()
+            if dest is not target:
+                dest.close()
+
+    def start_replica(self, path, interval):
+        """
+        Keep a read-only copy of the database at path, refreshed every interval
+        seconds, for the reads that can lag the primary
+        """
+        self.replica_path = path
+        self.replica_lock = threading.Lock()
+        self.replica_readers = {}
+        self.refresh_replica()
+
+        def refresh_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh_replica()
+                except Exception as e:
+                    print("Replica refresh failed:", e, flush=True)
+
+        threading.Thread(target=refresh_forever, daemon=True).start()
+
+    def refresh_replica(self):
+        """
+        Copy the primary into a standby database and swap it in as the replica
+        """
+        in_memory = self.replica_path == ":memory:"
+        standby_path = self.replica_path if in_memory else self.replica_path + ".standby"
+        standby = sqlite3.connect(standby_path, check_same_thread=False)
+        try:
+            self.backup(standby)
+        except Exception:
+            standby.close()
+            raise
+        if not in_memory:
+            # Readers of the old file keep it open under its old inode
+            standby.close()
+            os.replace(standby_path, self.replica_path)
+            standby = sqlite3.connect(self.replica_path, check_same_thread=False)
+        standby.execute("ATTACH DATABASE ? AS archive;", (self.archive_path,))
+        if self.archive_path == ":memory:":
+            standby.execute("CREATE TABLE archive.transactions AS SELECT * FROM main.transactions WHERE 0;")
+        with self.replica_lock:
+            old, self.replica = self.replica, standby
+            retire = old is not None and not self.replica_readers.get(old)
+        if retire:
+            old.close()
+
+    @contextmanager
+    def read_replica(self):
+        """
+        Yield the connection that read-only scans should use: the replica if
+        one is running in this process, otherwise the primary
+        """
+        if self.replica is None or self.pid != os.getpid():
+            yield self.conn
+            return
+        # Readers share the current replica; a replaced one is closed by its
+        # last reader
+        with self.replica_lock:
+            conn = self.replica
+            self.replica_readers[conn] = self.replica_readers.get(conn, 0) + 1
+        try:
+            yield conn
+        finally:
+            with self.replica_lock:
+                self.replica_readers[conn] -= 1
+                retire = conn is not self.replica and not self.replica_readers[conn]
+                if not self.replica_readers[conn]:
+                    del self.replica_readers[conn]
+            if retire:
+                conn.close()
 
     def create_venmo_table(self):
         """
-        Create a table with user id, name, username and balance
+        Create a table with user id, name, username, balance and the balance
+        the user opened their account with
         """
         try:
             self.conn.execute("""
@@ -35,19 +397,102 @@ class DatabaseDriver(object):
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL,
                 username TEXT,
-                balance REAL DEFAULT 0
+                balance REAL DEFAULT 0,
+                opening_balance REAL DEFAULT 0
                 );
         """)
         except Exception as e:
             print(e, flush=True)
 
+    def add_opening_balances(self):
+        """
+        Add opening_balance to venmo tables created before it existed. It is
+        backfilled as the current balance minus the user's net accepted
+        transfers, i.e. assuming today's balances are correct
+        """
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(venmo);")]
+        if "opening_balance" in columns:
+            return
+        with self.write_transaction() as conn:
+            conn.execute("ALTER TABLE venmo ADD COLUMN opening_balance REAL DEFAULT 0;")
+            conn.execute("""
+                UPDATE venmo SET opening_balance = balance
+                    - COALESCE((SELECT SUM(amount) FROM transactions
+                                WHERE receiver_id = venmo.id AND accepted = 1), 0)
+                    + COALESCE((SELECT SUM(amount) FROM transactions
+                                WHERE sender_id = venmo.id AND accepted = 1), 0);
+            """)
+
+    def find_duplicate_usernames(self):
+        """
+        Return {username: count} for every username held by more than one user
+        """
+        return dict(self.conn.execute(QUERIES["duplicate_usernames"]).fetchall())
+
+    def create_username_index(self):
+        """
+        Make usernames unique. Databases created before usernames were unique
+        may already hold duplicates; those are reported and the index is left
+        out until they are resolved, since SQLite can't build it over them
+        """
+        duplicates = self.find_duplicate_usernames()
+        if duplicates:
+            print(f"Not enforcing unique usernames, {len(duplicates)} are taken more than once:", flush=True)
+            for username, count in sorted(duplicates.items()):
+                print(f"  {username!r} x{count}", flush=True)
+            return
+        try:
+            self.conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_venmo_username
+                ON venmo (username);
+            """)
+        except Exception as e:
+            print(e, flush=True)
+
+    def create_user_search_index(self):
+        """
+        Create an FTS5 index over user names and usernames, kept in sync with
+        the venmo table by triggers. Prefix indexes on 2 and 3 characters make
+        typeahead queries cheap. Balance updates don't fire the triggers
+        """
+        try:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'venmo_search';"
+            ).fetchone()
+            self.conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS venmo_search USING fts5(
+                    name, username, content='venmo', content_rowid='id', prefix='2 3'
+                );
+                CREATE TRIGGER IF NOT EXISTS venmo_search_insert AFTER INSERT ON venmo BEGIN
+                    INSERT INTO venmo_search (rowid, name, username)
+                    VALUES (new.id, new.name, new.username);
+                END;
+                CREATE TRIGGER IF NOT EXISTS venmo_search_delete AFTER DELETE ON venmo BEGIN
+                    INSERT INTO venmo_search (venmo_search, rowid, name, username)
+                    VALUES ('delete', old.id, old.name, old.username);
+                END;
+                CREATE TRIGGER IF NOT EXISTS venmo_search_update AFTER UPDATE OF name, username ON venmo BEGIN
+                    INSERT INTO venmo_search (venmo_search, rowid, name, username)
+                    VALUES ('delete', old.id, old.name, old.username);
+                    INSERT INTO venmo_search (rowid, name, username)
+                    VALUES (new.id, new.name, new.username);
+                END;
+            """)
+            if exists is None:
+                # Index users created before the search index existed
+                self.conn.execute("INSERT INTO venmo_search (venmo_search) VALUES ('rebuild');")
+                self.conn.commit()
+        except Exception as e:
+            print(e, flush=True)
+
     def create_transactions_table(self):
         """
         Create a table with transaction id, timestamp, sender_id, receiver_id, and 
-        accepted fields
+        accepted fields. amount is in currency; source_currency and
+        source_amount are what the sender paid when it was converted
         """
         try:
-            self.conn.execute("""
+            self.conn.execute(f"""
                 CREATE TABLE IF NOT EXISTS transactions (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     timestamp TEXT DEFAULT (STRFTIME('%Y-%m-%d %H:%M:%f', 'now')),
@@ -56,6 +501,9 @@ class DatabaseDriver(object):
                     amount REAL,
                     message TEXT,
                     accepted BOOLEAN DEFAULT NULL,
+                    currency TEXT NOT NULL DEFAULT '{BASE_CURRENCY}',
+                    source_currency TEXT,
+                    source_amount REAL,
                     FOREIGN KEY (sender_id) REFERENCES venmo(id),
                     FOREIGN KEY (receiver_id) REFERENCES venmo(id)
                 );
@@ -63,30 +511,271 @@ class DatabaseDriver(object):
         except Exception as e:
             print(e, flush=True)
 
+    def create_indexes(self):
+        """
+        Create the transaction indexes. Each OR branch of the history query
+        gets its own index, already ordered by timestamp; every index ends in
+        timestamp so searches can walk it in (timestamp, id) order
+        """
+        try:
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_transactions_sender
+                ON transactions (sender_id, timestamp);
+            """)
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_transactions_receiver
+                ON transactions (receiver_id, timestamp);
+            """)
+            # Serve transaction searches filtered by status or by date alone.
+            # The status index also lists open requests (accepted IS NULL)
+            # oldest first for the expiry sweeper
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_transactions_status
+                ON transactions (accepted, timestamp);
+            """)
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_transactions_timestamp
+                ON transactions (timestamp);
+            """)
+        except Exception as e:
+            print(e, flush=True)
+
+    def drop_bulk_load_indexes(self):
+        """
+        Drop the transaction indexes and the user search index, so a bulk
+        load doesn't maintain them row by row. create_indexes and
+        create_user_search_index build them again afterwards
+        """
+        self.conn.executescript("""
+            DROP INDEX IF EXISTS idx_transactions_sender;
+            DROP INDEX IF EXISTS idx_transactions_receiver;
+            DROP INDEX IF EXISTS idx_transactions_status;
+            DROP INDEX IF EXISTS idx_transactions_timestamp;
+            DROP TRIGGER IF EXISTS venmo_search_insert;
+            DROP TRIGGER IF EXISTS venmo_search_delete;
+            DROP TRIGGER IF EXISTS venmo_search_update;
+            DROP TABLE IF EXISTS venmo_search;
+        """)
+
+    def explain(self, name):
+        """
+        Return the EXPLAIN QUERY PLAN detail lines for a registered query,
+        binding NULL to every parameter
+        """
+        sql = QUERIES[name]
+        cursor = self.conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count("?"))
+        return [row[3] for row in cursor]
+
+    def create_transfer_journal_table(self):
+        """
+        Create a table recording every money movement before it is applied.
+        Intents are deleted once applied or rejected
+        """
+        try:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS transfer_journal (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TEXT,
+                    kind TEXT NOT NULL,
+                    transaction_id INTEGER,
+                    sender_id INTEGER,
+                    receiver_id INTEGER,
+                    amount REAL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    currency TEXT NOT NULL DEFAULT '{BASE_CURRENCY}',
+                    source_currency TEXT,
+                    source_amount REAL
+                );
+            """)
+            # Recovery only looks at pending intents, so it stays proportional
+            # to the work in flight rather than to the size of the journal
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_transfer_journal_pending
+                ON transfer_journal (id) WHERE status = 'pending';
+            """)
+        except Exception as e:
+            print(e, flush=True)
+
+    def create_rollup_tables(self):
+        """
+        Create the transaction volume rollups: count and summed amount of the
+        transactions in each time bucket, for every granularity, plus the
+        id of the last transaction folded into them
+        """
+        try:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS volume_rollups (
+                    granularity TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    volume REAL NOT NULL,
+                    PRIMARY KEY (granularity, bucket)
+                ) WITHOUT ROWID;
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_state (
+                    name TEXT PRIMARY KEY,
+                    last_id INTEGER NOT NULL
+                );
+            """)
+        except Exception as e:
+            print(e, flush=True)
+
+    def create_archive_tables(self):
+        """
+        Create the archive's transactions table and the per-user counts of
+        archived transactions
+        """
+        try:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS archive.transactions (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT,
+                    sender_id INTEGER,
+                    receiver_id INTEGER,
+                    amount REAL,
+                    message TEXT,
+                    accepted BOOLEAN,
+                    currency TEXT NOT NULL DEFAULT '{BASE_CURRENCY}',
+                    source_currency TEXT,
+                    source_amount REAL
+                );
+            """)
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS archive.idx_archive_sender
+                ON transactions (sender_id, timestamp);
+            """)
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS archive.idx_archive_receiver
+                ON transactions (receiver_id, timestamp);
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived_counts (
+                    user_id INTEGER PRIMARY KEY,
+                    count INTEGER NOT NULL
+                );
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS archive_state (
+                    archived_before TEXT NOT NULL
+                );
+            """)
+            self.conn.execute("""
+                INSERT INTO archive_state (archived_before)
+                SELECT '' WHERE NOT EXISTS (SELECT 1 FROM archive_state);
+            """)
+            self.conn.commit()
+        except Exception as e:
+            print(e, flush=True)
+
+    def add_currency_columns(self):
+        """
+        Add the currency columns to transaction and journal tables created
+        before they existed. Everything already in them is in BASE_CURRENCY
+        """
+        for table in ("main.transactions", "archive.transactions", "main.transfer_journal"):
+            schema, name = table.split(".")
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA {schema}.table_info({name});")]
+            if "currency" in columns:
+                continue
+            with self.write_transaction() as conn:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN currency TEXT NOT NULL DEFAULT '{BASE_CURRENCY}';")
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN source_currency TEXT;")
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN source_amount REAL;")
+
+    def create_balances_table(self):
+        """
+        Create a table of balances in currencies other than BASE_CURRENCY,
+        which stays in venmo.balance. A row appears the first time a user is
+        paid in a currency
+        """
+        try:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS balances (
+                    user_id INTEGER NOT NULL,
+                    currency TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    PRIMARY KEY (user_id, currency)
+                ) WITHOUT ROWID;
+            """)
+        except Exception as e:
+            print(e, flush=True)
+
+    def journal_intents(self, moves):
+        """
+        Durably record, in one commit, that each (kind, transaction) money
+        movement is about to be applied, and return the journal entry ids
+        """
+        created_at = self.current_timestamp()
+        with self.write_transaction() as conn:
+            conn.executemany(QUERIES["insert_journal"], [(
+                created_at, kind, txn["id"] if kind == "accept" else None, txn["sender_id"], txn["receiver_id"],
+                txn["amount"], txn["currency"], txn["source_currency"], txn["source_amount"],
+            ) for kind, txn in moves])
+            last_id = conn.execute(QUERIES["last_insert_id"]).fetchone()[0]
+        # Nothing else can insert while the write lock is held, so the
+        # entries got consecutive ids
+        return list(range(last_id - len(moves) + 1, last_id + 1))
+
+    def recover_journal(self):
+        """
+        Resolve intents left pending by a crash and return how many there were.
+        Only safe at startup, before anything else writes (see config.recover)
+        """
+        start = time.perf_counter()
+        pending = self.conn.execute(QUERIES["pending_journal"]).fetchall()
+        for journal_id, kind, transaction_id, sender_id, receiver_id, amount, source_currency, source_amount in pending:
+            # Replaying an accept is idempotent (accepted IS NULL guard); a
+            # send's client never got an id and may have retried, so roll it back
+            if kind == "accept":
+                txn = {
+                    "id": transaction_id, "timestamp": None, "sender_id": sender_id, "receiver_id": receiver_id,
+                    "amount": amount, "source_currency": source_currency, "source_amount": source_amount,
+                }
+                with self.write_transaction() as conn:
+                    applied = self._apply_accept(conn, txn)
+                    conn.execute(
+                        QUERIES["set_journal_status"],
+                        ("replayed" if applied else "rolled_back", journal_id)
+                    )
+            else:
+                with self.write_transaction() as conn:
+                    conn.execute(QUERIES["set_journal_status"], ("rolled_back", journal_id))
+        if pending:
+            print(f"Recovered {len(pending)} journal entries in {time.perf_counter() - start:.3f}s", flush=True)
+        return len(pending)
+
+    def prune_journal(self, days=30):
+        """
+        Delete resolved journal entries older than days days
+        """
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        with self.write_transaction() as conn:
+            return conn.execute(QUERIES["prune_journal"], (cutoff,)).rowcount
+
     def get_all_users(self):
         """
         Get all users from database. Exclude the user balance
         """
-        cursor = self.conn.execute("SELECT * FROM venmo;")
         users = []
-        for row in cursor:
-            users.append({"id": row[0], "name": row[1], "username": row[2]})
+        with self.read_replica() as conn:
+            for row in conn.execute(QUERIES["all_users"]):
+                users.append({"id": row[0], "name": row[1], "username": row[2]})
         return users
     
     def create_a_user(self, name, username, balance):
         """
         Create a user
         """
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT INTO venmo (name, username, balance) values (?, ?, ?);", (name, username, balance))
-        self.conn.commit()
+        with self.write_transaction() as conn:
+            cursor = conn.execute(QUERIES["insert_user"], (name, username, balance, balance))
         return cursor.lastrowid
     
     def get_user_by_id(self, user_id):
         """
         Get a user with a specific user_id
         """
-        cursor = self.conn.execute("SELECT * FROM venmo WHERE id = ?;", (user_id,))
+        cursor = self.conn.execute(QUERIES["user_by_id"], (user_id,))
         row = cursor.fetchone()
 
         if row is None:
@@ -94,124 +783,646 @@ class DatabaseDriver(object):
             
         user = {"id": row[0], "name": row[1], "username": row[2], "balance": row[3]}
 
-        cursor = self.conn.execute("""
-            SELECT * FROM transactions 
-            WHERE sender_id = ? OR receiver_id = ?
-            ORDER BY timestamp DESC;
-        """, (user_id, user_id,))
+        archived = self.conn.execute(QUERIES["archived_count"], (user_id,)).fetchone()
+        if archived is None:
+            cursor = self.conn.execute(QUERIES["user_history"], (user_id, user_id,))
+        else:
+            cursor = self.conn.execute(QUERIES["user_history_with_archive"], (user_id,) * 4)
 
         transactions = []
         for transaction in cursor.fetchall():
-            transactions.append({
-                "id": transaction[0],
-                "timestamp": transaction[1],
-                "sender_id": transaction[2],
-                "receiver_id": transaction[3],
-                "amount": transaction[4],
-                "message": transaction[5],  
-                "accepted": transaction[6]
-            })
+            transactions.append(transaction_to_dict(transaction))
 
+        user["balances"] = self.get_balances(user_id, row[3])
         user["transactions"] = transactions
         return user
 
 
+    def get_user_row(self, user_id):
+        """
+        Get a user's id, name, username and balance without their history
+        """
+        row = self.conn.execute(QUERIES["user_by_id"], (user_id,)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "name": row[1], "username": row[2], "balance": row[3]}
+
+    def get_balances(self, user_id, balance):
+        """
+        A user's balance in every currency they hold, given their
+        BASE_CURRENCY balance
+        """
+        balances = {BASE_CURRENCY: balance}
+        balances.update(self.conn.execute(QUERIES["currency_balances"], (user_id,)).fetchall())
+        return balances
+
+    def get_user_rows(self, user_ids):
+        """
+        get_user_row for several users in one query, as {user_id: row}, with
+        None for users that don't exist
+        """
+        rows = {user_id: None for user_id in user_ids}
+        for row in self.conn.execute(QUERIES["users_by_ids"], (json.dumps(list(rows)),)):
+            rows[row[0]] = {"id": row[0], "name": row[1], "username": row[2], "balance": row[3]}
+        return rows
+
+    def get_user_by_username(self, username):
+        """
+        Get a user by their username
+        """
+        row = self.conn.execute(QUERIES["user_id_by_username"], (username,)).fetchone()
+        if row is None:
+            return None
+        return self.get_user_by_id(row[0])
+
+    def search_users(self, query, limit):
+        """
+        Find users whose name or username has words starting with every word
+        in query, best matches first. Excludes the user balance
+        """
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        match = " ".join('"%s"*' % term for term in terms)
+        with self.read_replica() as conn:
+            rows = conn.execute(QUERIES["search_users"], (match, limit)).fetchall()
+        return [{"id": row[0], "name": row[1], "username": row[2]} for row in rows]
+
     def delete_specific_user(self, user_id):
         """
         Delete a specific user from the database
         """
-        self.conn.execute("DELETE FROM venmo WHERE id = ?;", (user_id,))
-        self.conn.commit()
+        with self.write_transaction() as conn:
+            conn.execute(QUERIES["delete_user"], (user_id,))
+            conn.execute(QUERIES["delete_user_balances"], (user_id,))
+        self.versions.bump(user_id)
 
     def current_timestamp(self):
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
 
-    def send_from_sender_to_receiver(self, sender_id, sender_amt, amount, receiver_id, receiver_amt, message):
+    def new_transaction(self, sender_id, receiver_id, amount, message, accepted,
+                        currency=BASE_CURRENCY, source_currency=None, source_amount=None):
+        """
+        Build the dict for a transaction that hasn't been written yet. apply_unit
+        fills in its id. Values are stored the way SQLite hands them back, so
+        the dict matches what get_transaction_by_id would return
+        """
+        return {
+            "id": None,
+            "timestamp": self.current_timestamp(),
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "amount": float(amount),
+            "message": message,
+            "accepted": None if accepted is None else int(accepted),
+            "currency": currency,
+            "source_currency": source_currency,
+            "source_amount": None if source_amount is None else float(source_amount),
+        }
+
+    def send_from_sender_to_receiver(self, sender_id, amount, receiver_id, message):
         """
-        Send money from sender_id to receiver_id
+        Send money from sender_id to receiver_id. Returns the new transaction
+        id, or None if the sender doesn't have enough funds
         """
-        self.conn.execute("UPDATE venmo SET balance = ? WHERE id = ?;", (sender_amt-amount, sender_id))
-        self.conn.execute("UPDATE venmo SET balance = ? WHERE id = ?;", (receiver_amt+amount, receiver_id))
-        self.conn.execute("INSERT INTO transactions (timestamp, sender_id, receiver_id, amount, message, accepted) VALUES (?, ?, ?, ?, ?, ?)", 
-                          (
-                              self.current_timestamp(),
-                              sender_id, 
-                              receiver_id, 
-                              amount,
-                              message,
-                              True,
-                          ))
-        self.conn.commit()
+        txn = self.new_transaction(sender_id, receiver_id, amount, message, True)
+        if not self.apply_unit([("send", txn)]):
+            return None
+        return txn["id"]
 
     def add_request_to_transactions(self, sender_id, receiver_id, amount, accepted, message):
         """
-        Add a request into the transactions table
+        Add a request into the transactions table and return its id
         """
-        self.conn.execute("INSERT INTO transactions (timestamp, sender_id, receiver_id, amount, message, accepted) VALUES (?, ?, ?, ?, ?, ?)",
-                          (
-                              self.current_timestamp(),
-                              sender_id, 
-                              receiver_id,
-                              amount,
-                              message,
-                              accepted,
-                          ))
-        self.conn.commit()
+        txn = self.new_transaction(sender_id, receiver_id, amount, message, accepted)
+        self.apply_unit([("request", txn)])
+        return txn["id"]
 
     def update_accepted_status(self,id, status):
         """
         Update the status of transaction with ID id
         """
-        self.conn.execute("UPDATE transactions SET accepted = ?, timestamp = ? WHERE id = ?;", (status, self.current_timestamp(), id,))
-        self.conn.commit()
+        with self.write_transaction() as conn:
+            conn.execute(QUERIES["update_accepted"], (status, self.current_timestamp(), id,))
+        self.versions.invalidate_all()
+
+    def apply_unit(self, ops):
+        """
+        Apply a list of (kind, transaction) writes, kind being "send",
+        "request", "accept" or "deny", in one write transaction. Returns False,
+        with nothing applied, if any of them can't be
+        """
+        moves = [(kind, txn) for kind, txn in ops if kind in ("send", "accept")]
+        journal_ids = self.journal_intents(moves) if moves else []
+        try:
+            with self.write_transaction() as conn:
+                senders = {txn["sender_id"] for kind, txn in ops if kind == "send"}
+                if all(kind in ("send", "request") for kind, txn in ops) and not any(
+                        kind == "send" and txn["receiver_id"] in senders for kind, txn in ops):
+                    if not self._apply_new(conn, ops):
+                        raise _Rejected()
+                else:
+                    for kind, txn in ops:
+                        if not self._apply(conn, kind, txn):
+                            raise _Rejected()
+                # Applied intents have nothing left to recover
+                conn.executemany(QUERIES["delete_journal"], [(j,) for j in journal_ids])
+        except _Rejected:
+            for (kind, txn) in ops:
+                if kind in ("send", "request"):
+                    txn["id"] = None
+            if journal_ids:
+                with self.write_transaction() as conn:
+                    conn.executemany(QUERIES["delete_journal"], [(j,) for j in journal_ids])
+            return False
+        except Exception:
+            # Nothing was applied and the caller sees the error, so the intents
+            # must not be left pending for the next recovery to replay
+            for (kind, txn) in ops:
+                if kind in ("send", "request"):
+                    txn["id"] = None
+            try:
+                with self.write_transaction() as conn:
+                    conn.executemany(QUERIES["set_journal_status"], [("failed", j) for j in journal_ids])
+            except Exception as e:
+                print(e, flush=True)
+            raise
+        # Only after the commit, so that anything cached under the old version
+        # was read before the change and anything read since gets the new one
+        self.versions.bump(*{user_id for kind, txn in ops for user_id in (txn["sender_id"], txn["receiver_id"])})
+        return True
+
+    def _apply(self, conn, kind, txn):
+        if kind == "send" and not self._transfer(conn, txn):
+            return False
+        if kind in ("send", "request"):
+            cursor = conn.execute(QUERIES["insert_transaction"], transaction_params(txn))
+            txn["id"] = cursor.lastrowid
+            return True
+        if kind == "accept":
+            return self._apply_accept(conn, txn)
+        if kind == "deny":
+            return conn.execute(QUERIES["deny_request"], (txn["timestamp"], txn["id"])).rowcount == 1
+        raise ValueError(f"unknown write {kind!r}")
+
+    def unit_of_work(self):
+        return UnitOfWork(self)
 
     def get_transaction_by_id(self, id):
         """
         Get transaction by id
         """
-        cursor = self.conn.execute("SELECT * FROM transactions WHERE id = ?;", (id,))
+        cursor = self.conn.execute(QUERIES["transaction_by_id"], (id,))
         row = cursor.fetchone()
+        if row is None:
+            row = self.conn.execute(QUERIES["archived_transaction_by_id"], (id,)).fetchone()
         if row is None:
             return None
 
-        # assuming your transactions table schema is:
-        # id, timestamp, sender_id, receiver_id, amount, accepted
+        return transaction_to_dict(row)
+
+    def search_transactions(self, user_id=None, status=None, start=None, end=None,
+                            min_amount=None, max_amount=None, message=None,
+                            before=None, limit=50):
+        """
+        Search transactions, newest first, paging by the (timestamp, id) of the
+        last row of the previous page. Every filter is optional
+        """
+        filters, params = [], []
+        if status is not None:
+            filters.append(STATUS_FILTERS[status])
+        if start is not None:
+            filters.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            filters.append("timestamp < ?")
+            params.append(end)
+        if min_amount is not None:
+            filters.append("amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            filters.append("amount <= ?")
+            params.append(max_amount)
+        if message is not None:
+            escaped = message.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            filters.append("message LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if before is not None:
+            filters.append("(timestamp, id) < (?, ?)")
+            params.extend(before)
+
+        order = "ORDER BY timestamp DESC, id DESC LIMIT ?"
+        if user_id is None:
+            where = " AND ".join(filters) or "1"
+            sql = f"SELECT {TRANSACTION_COLUMNS} FROM %s WHERE {where} {order};"
+            params.append(limit)
+        else:
+            branch = f"SELECT * FROM (SELECT {TRANSACTION_COLUMNS} FROM %%s WHERE %s {order})"
+            sql = " UNION ".join([
+                branch % " AND ".join(["sender_id = ?"] + filters),
+                branch % " AND ".join(["receiver_id = ?"] + filters),
+            ]) + f" {order};"
+            sql = sql.replace("%%s", "%s")
+            params = [user_id] + params + [limit] + [user_id] + params + [limit, limit]
+
+        tables = sql.count("%s")
+        with self.read_replica() as conn:
+            rows = conn.execute(sql % (("transactions",) * tables), params).fetchall()
+
+            # Every archived transaction is older than archived_before, so the
+            # archive can only add to this page if the page isn't full or
+            # reaches back past that point
+            archived_before = conn.execute(QUERIES["archived_before"]).fetchone()[0]
+            if archived_before and (len(rows) < limit or rows[-1][1] < archived_before):
+                rows += conn.execute(sql % (("archive.transactions",) * tables), params).fetchall()
+                rows = sorted(set(rows), key=lambda row: (row[1], row[0]), reverse=True)[:limit]
+
+        return [transaction_to_dict(row) for row in rows]
+
+    def expire_requests(self, ttl, batch_size=500):
+        """
+        Deny requests open for more than ttl seconds, batch_size per write
+        transaction. Returns the number expired, batches, longest hold and time taken
+        """
+        start = time.perf_counter()
+        cutoff = (datetime.now() - timedelta(seconds=ttl)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        expired = batches = 0
+        longest_hold = 0.0
+        while True:
+            with self.write_transaction() as conn:
+                held = time.perf_counter()
+                cursor = conn.execute(QUERIES["expire_requests"], (self.current_timestamp(), cutoff, batch_size))
+            longest_hold = max(longest_hold, time.perf_counter() - held)
+            batches += 1
+            expired += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        if expired:
+            self.versions.invalidate_all()
         return {
-            "id": row[0],
-            "timestamp": row[1],
-            "sender_id": row[2],
-            "receiver_id": row[3],
-            "amount": row[4],
-            "message": row[5],
-            "accepted": row[6]
+            "expired": expired,
+            "batches": batches,
+            "max_lock_seconds": longest_hold,
+            "seconds": time.perf_counter() - start,
         }
-    
+
+    def start_request_sweeper(self, ttl, interval, batch_size=500):
+        """
+        Expire requests older than ttl seconds every interval seconds in a
+        background thread, logging throughput and lock hold time
+        """
+        def sweep_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    stats = self.expire_requests(ttl, batch_size)
+                except Exception as e:
+                    print("Request sweep failed:", e, flush=True)
+                    continue
+                if stats["expired"]:
+                    print(
+                        f"Expired {stats['expired']} requests in {stats['batches']} batches, "
+                        f"{stats['expired'] / stats['seconds']:.0f}/s, "
+                        f"longest lock hold {stats['max_lock_seconds'] * 1000:.1f}ms",
+                        flush=True,
+                    )
+
+        threading.Thread(target=sweep_forever, daemon=True).start()
+
+    def archive_transactions(self, cutoff, batch_size=5000):
+        """
+        Move settled transactions older than cutoff into the archive database,
+        batch_size at a time, and return how many moved
+        """
+        self.refresh_rollups()
+        row = self.conn.execute(QUERIES["rollup_high_water_mark"]).fetchone()
+        high_water_mark = row[0] if row else 0
+
+        moved = 0
+        while True:
+            with self.write_transaction() as conn:
+                conn.execute(QUERIES["clear_archive_batch"])
+                conn.executemany(
+                    QUERIES["add_to_archive_batch"],
+                    conn.execute(QUERIES["select_archive_batch"], (cutoff, high_water_mark, batch_size)).fetchall()
+                )
+                count = conn.execute(QUERIES["archive_batch_size"]).fetchone()[0]
+                if count == 0:
+                    return moved
+                # Not atomic across the attached database: the copy is INSERT OR
+                # IGNORE so a crash after it is finished by the next run
+                conn.execute(QUERIES["copy_to_archive"])
+                conn.execute(QUERIES["count_archived"])
+                conn.execute(QUERIES["delete_archived"])
+                conn.execute(QUERIES["set_archived_before"], (cutoff,))
+            moved += count
+
+    def refresh_rollups(self, batch_size=50000):
+        """
+        Fold transactions created since the last refresh into the volume
+        rollups and return how many were folded
+        """
+        folded = 0
+        while True:
+            # Only take the write lock when there is something to fold
+            row = self.conn.execute(QUERIES["rollup_high_water_mark"]).fetchone()
+            if (row[0] if row else 0) >= self.conn.execute(QUERIES["max_transaction_id"]).fetchone()[0]:
+                return folded
+            with self.write_transaction() as conn:
+                # Read the mark under the write lock so concurrent refreshes
+                # can't fold the same ids twice
+                row = conn.execute(QUERIES["rollup_high_water_mark"]).fetchone()
+                last_id = row[0] if row else 0
+                target = conn.execute(QUERIES["max_transaction_id"]).fetchone()[0]
+                if last_id >= target:
+                    return folded
+                upto = min(last_id + batch_size, target)
+                for granularity, bucket_format in GRANULARITIES.items():
+                    conn.execute(QUERIES["fold_volume_rollup"], (granularity, bucket_format, last_id, upto))
+                conn.execute(QUERIES["set_rollup_high_water_mark"], (upto,))
+            folded += upto - last_id
+
+    def start_rollup_refresh(self, interval):
+        """
+        Fold new transactions into the volume rollups every interval seconds
+        in a background thread
+        """
+        def refresh_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh_rollups()
+                except Exception as e:
+                    print("Rollup refresh failed:", e, flush=True)
+
+        threading.Thread(target=refresh_forever, daemon=True).start()
+
+    def get_volume(self, granularity, start, end):
+        """
+        Transaction count and volume per bucket of granularity in [start, end)
+        """
+        params = (granularity, start, end, GRANULARITIES[granularity], start, end)
+        with self.read_replica() as conn:
+            rows = conn.execute(QUERIES["volume_rollups"], params).fetchall()
+        return [{"bucket": row[0], "count": row[1], "volume": row[2]} for row in rows]
+
+    def recent_transfers(self, seconds):
+        """
+        (sender_id, amount, currency, timestamp) of every transfer settled in
+        the last seconds seconds, oldest first, with the amount and currency
+        the sender paid in
+        """
+        cutoff = (datetime.now() - timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        return self.conn.execute(QUERIES["recent_transfers"], (cutoff,)).fetchall()
+
+    def user_version(self, user_id):
+        """
+        The current version of a user's profile (see UserVersions)
+        """
+        return self.versions.get(user_id)
+
     def get_last_transaction_id(self):
-        cursor = self.conn.execute("SELECT last_insert_rowid();")
+        cursor = self.conn.execute(QUERIES["last_insert_id"])
         return cursor.fetchone()[0]
     
-    def accept_transaction_request(self, transaction_id, sender, receiver, amount):
+    def accept_transaction_request(self, transaction_id, sender_id, receiver_id, amount):
         """
         Accepts a pending transaction: updates balances and marks as accepted.
+        Returns False if the request was already processed or the sender can
+        no longer cover it, in which case nothing is changed.
         """
-        # Update sender and receiver balances
-        self.conn.execute(
-            "UPDATE venmo SET balance = ? WHERE id = ?;",
-            (sender["balance"] - amount, sender["id"])
-        )
-        self.conn.execute(
-            "UPDATE venmo SET balance = ? WHERE id = ?;",
-            (receiver["balance"] + amount, receiver["id"])
-        )
-        
+        txn = self.new_transaction(sender_id, receiver_id, amount, None, True)
+        txn["id"] = transaction_id
+        return self.apply_unit([("accept", txn)])
+
+    def _apply_new(self, conn, ops):
+        """
+        Apply a unit of sends and requests whose senders aren't paid within
+        it: every sender is debited once for all they send in a currency,
+        then the credits and the inserts each go through one executemany.
+        Returns False if a sender can't cover their total
+        """
+        debits, credits = {}, []
+        for kind, txn in ops:
+            if kind == "send":
+                (sender_id, debit_currency, debit), credit = transfer_legs(txn)
+                debits[sender_id, debit_currency] = add_money(debits.get((sender_id, debit_currency), 0.0), -debit)
+                credits.append(credit)
+        for (sender_id, debit_currency), amount in debits.items():
+            if not self._debit(conn, sender_id, debit_currency, amount):
+                return False
+        conn.executemany(QUERIES["credit_balance"], [
+            (amount, user_id) for user_id, currency, amount in credits if currency == BASE_CURRENCY
+        ])
+        conn.executemany(QUERIES["credit_currency_balance"], [
+            (user_id, currency, amount) for user_id, currency, amount in credits if currency != BASE_CURRENCY
+        ])
+        conn.executemany(QUERIES["insert_transaction"], [transaction_params(txn) for kind, txn in ops])
+        # The write lock is held, so the rows got consecutive ids
+        last_id = conn.execute(QUERIES["last_insert_id"]).fetchone()[0]
+        for transaction_id, (kind, txn) in enumerate(ops, last_id - len(ops) + 1):
+            txn["id"] = transaction_id
+        return True
+
+    def _debit(self, conn, user_id, currency, amount):
+        if currency == BASE_CURRENCY:
+            cursor = conn.execute(QUERIES["debit_balance"], (amount, user_id, amount))
+        else:
+            cursor = conn.execute(QUERIES["debit_currency_balance"], (amount, user_id, currency, amount))
+        return cursor.rowcount == 1
+
+    def _transfer(self, conn, txn):
+        """
+        Move the money for txn inside the caller's write transaction: both
+        legs, each in its own currency, or neither. Returns False if the
+        sender can't cover their leg
+        """
+        (sender_id, debit_currency, debit), (receiver_id, currency, credit) = transfer_legs(txn)
+        if not self._debit(conn, sender_id, debit_currency, -debit):
+            return False
+        if currency == BASE_CURRENCY:
+            conn.execute(QUERIES["credit_balance"], (credit, receiver_id))
+        else:
+            conn.execute(QUERIES["credit_currency_balance"], (receiver_id, currency, credit))
+        return True
+
+    def _apply_accept(self, conn, txn):
+        """
+        Move the money for an accepted request inside the caller's write
+        transaction. Returns False, leaving nothing changed, if the request was
+        already processed or the sender can't cover it
+        """
+        # The caller holds the write lock, so nothing can change between this
+        # check and the updates below
+        row = conn.execute(QUERIES["transaction_status"], (txn["id"],)).fetchone()
+        if row is None or row[0] is not None:
+            return False
+
+        # The request's currency is the one on record, whatever the caller has
+        if not self._transfer(conn, dict(txn, currency=row[1])):
+            return False
+
         # Update the transaction's accepted status
-        self.conn.execute(
-            "UPDATE transactions SET accepted = ?, timestamp = ? WHERE id = ?;",
-            (True, self.current_timestamp(), transaction_id)
-        )
-        self.conn.commit()
+        conn.execute(QUERIES["accept_request"], (
+            txn["timestamp"] or self.current_timestamp(), txn["source_currency"], txn["source_amount"], txn["id"]
+        ))
+        return True
+
+
+class UserVersions(object):
+    """
+    Version numbers for each user's data, for caches built on top of a
+    driver. bump() gives users a new version once a write to them has
+    committed; invalidate_all() gives every user a new one. Versions come from
+    one counter, so two bumps never produce the same version
+    """
+
+    def __init__(self):
+        self.counter = itertools.count(1)
+        self.generation = 0
+        self.users = {}
+
+    def get(self, user_id):
+        return (self.generation, self.users.get(user_id, 0))
+
+    def bump(self, *user_ids):
+        for user_id in user_ids:
+            self.users[user_id] = next(self.counter)
+
+    def invalidate_all(self):
+        self.generation = next(self.counter)
+
+
+class _Rejected(Exception):
+    """
+    Raised inside apply_unit to roll back a unit one of whose writes failed
+    """
 
 
-# Only <=1 instance of the database driver
-# exists within the app at all times
-DatabaseDriver = singleton(DatabaseDriver)
+class UnitOfWork(object):
+    """
+    Request-scoped identity map and write buffer over a driver. Each user and
+    transaction is read at most once per unit (users without their history,
+    which only GET /api/users/<id>/ needs), writes are staged against the
+    objects already read, and flush() applies them all in one commit. The
+    staged objects are updated in place, so responses can be built from them
+    without reading the rows back
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.users = {}
+        self.transactions = {}
+        self.ops = []
+
+    def get_user(self, user_id):
+        """
+        The user's id, name, username and balance, or None
+        """
+        if user_id not in self.users:
+            self.users[user_id] = self.driver.get_user_row(user_id)
+        return self.users[user_id]
+
+    def get_users(self, user_ids):
+        """
+        get_user for several users, reading the ones not yet read in one go
+        """
+        missing = [user_id for user_id in user_ids if user_id not in self.users]
+        if missing:
+            self.users.update(self.driver.get_user_rows(missing))
+        return {user_id: self.users[user_id] for user_id in user_ids}
+
+    def get_transaction(self, transaction_id):
+        if transaction_id not in self.transactions:
+            self.transactions[transaction_id] = self.driver.get_transaction_by_id(transaction_id)
+        return self.transactions[transaction_id]
+
+    def _stage(self, kind, txn):
+        self.ops.append((kind, txn))
+        return txn
+
+    def send(self, sender_id, receiver_id, amount, message, currency=BASE_CURRENCY,
+             source_currency=None, source_amount=None):
+        return self._stage("send", self.driver.new_transaction(
+            sender_id, receiver_id, amount, message, True, currency, source_currency, source_amount
+        ))
+
+    def request(self, sender_id, receiver_id, amount, message, currency=BASE_CURRENCY):
+        return self._stage("request", self.driver.new_transaction(sender_id, receiver_id, amount, message, None, currency))
+
+    def accept(self, txn, source_currency=None, source_amount=None):
+        return self._stage("accept", dict(
+            txn, accepted=1, timestamp=self.driver.current_timestamp(),
+            source_currency=source_currency,
+            source_amount=None if source_amount is None else float(source_amount),
+        ))
+
+    def deny(self, txn):
+        return self._stage("deny", dict(txn, accepted=0, timestamp=self.driver.current_timestamp()))
+
+    def flush(self):
+        """
+        Apply every staged write in one commit. Returns False, with nothing
+        applied, if any of them can't be
+        """
+        ops, self.ops = self.ops, []
+        if not ops:
+            return True
+        if not self.driver.apply_unit(ops):
+            return False
+        for kind, txn in ops:
+            self.transactions[txn["id"]] = txn
+            if kind in ("send", "accept"):
+                for user_id, currency, delta in transfer_legs(txn):
+                    if currency == BASE_CURRENCY and self.users.get(user_id) is not None:
+                        self.users[user_id]["balance"] = add_money(self.users[user_id]["balance"], delta)
+        return True
+
+
+def add_money(*amounts):
+    """
+    Sum amounts as the decimals they're written as, so 0.1 + 0.2 is 0.3
+    """
+    return float(sum(Decimal(repr(amount)) for amount in amounts))
+
+
+def transfer_legs(txn):
+    """
+    The (user_id, currency, change in balance) of each leg of a transfer:
+    the sender pays source_amount of source_currency if it was converted,
+    otherwise amount of currency, and the receiver gets amount of currency
+    """
+    currency = txn.get("currency", BASE_CURRENCY)
+    if txn.get("source_currency") is None:
+        debit = (txn["sender_id"], currency, -txn["amount"])
+    else:
+        debit = (txn["sender_id"], txn["source_currency"], -txn["source_amount"])
+    return debit, (txn["receiver_id"], currency, txn["amount"])
+
+
+def transaction_params(txn):
+    """
+    The insert_transaction parameters for a new transaction
+    """
+    return (
+        txn["timestamp"], txn["sender_id"], txn["receiver_id"], txn["amount"], txn["message"],
+        txn["accepted"], txn["currency"], txn["source_currency"], txn["source_amount"],
+    )
+
+
+def transaction_to_dict(row):
+    """
+    Convert a row selected as TRANSACTION_COLUMNS into its JSON shape
+    """
+    return {
+        "id": row[0],
+        "timestamp": row[1],
+        "sender_id": row[2],
+        "receiver_id": row[3],
+        "amount": row[4],
+        "message": row[5],
+        "accepted": row[6],
+        "currency": row[7],
+        "source_currency": row[8],
+        "source_amount": row[9],
+    }
@@ -0,0 +1,149 @@
+"""
+Generate a large, realistic venmo.db for performance work.
+
+Activity follows a Zipf distribution: a few users send and receive most of
+the money, most users rarely do anything. Payments and requests are spread
+over the --days days before --end, and requests end up accepted, denied or
+still open in the given proportions. The same --seed and --end always
+produce the same database. Opening balances are chosen so that nobody ever overdraws, so the
+result passes reconcile.py.
+
+Rows are bulk inserted with indexes dropped and PRAGMAs tuned for loading;
+the indexes are built once at the end.
+
+Usage: python generate.py [--db PATH] [--users N] [--transactions N] ...
+"""
+import argparse
+import itertools
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import db
+
+MESSAGES = ["boba", "rent", "dinner", "coffee", "tickets", "groceries", "uber", "drinks", "gift", "utilities"]
+
+
+def zipf_weights(n, s):
+    """
+    Cumulative Zipf weights for ranks 1..n, for random.choices(cum_weights=)
+    """
+    return list(itertools.accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def generate_transactions(rng, users, count, end, days, zipf, request_ratio, accept_ratio, deny_ratio,
+                          batch_size, net, lowest):
+    """
+    Yield batches of transaction rows in timestamp order, all within the days
+    days before end (a datetime), tracking every
+    user's net flow and lowest running balance in net and lowest (lists
+    indexed by user id) along the way
+    """
+    # Rank users by activity in a seeded random order, so heavy users aren't
+    # simply the lowest ids
+    by_rank = list(range(1, users + 1))
+    rng.shuffle(by_rank)
+    ranks = range(users)
+    cum_weights = zipf_weights(users, zipf)
+
+    clock = end - timedelta(days=days)
+    mean_gap = days * 86400 / max(count, 1)
+
+    remaining = count
+    while remaining:
+        size = min(batch_size, remaining)
+        remaining -= size
+        senders = rng.choices(ranks, cum_weights=cum_weights, k=size)
+        receivers = rng.choices(ranks, cum_weights=cum_weights, k=size)
+        rows = []
+        for sender, receiver in zip(senders, receivers):
+            if sender == receiver:
+                receiver = (receiver + 1) % users
+            sender, receiver = by_rank[sender], by_rank[receiver]
+            clock += timedelta(seconds=rng.expovariate(1 / mean_gap))
+            amount = round(rng.lognormvariate(2.5, 1.0), 2)
+            if rng.random() < request_ratio:
+                roll = rng.random()
+                accepted = True if roll < accept_ratio else False if roll < accept_ratio + deny_ratio else None
+            else:
+                accepted = True
+            if accepted:
+                net[sender] -= amount
+                net[receiver] += amount
+                lowest[sender] = min(lowest[sender], net[sender])
+            rows.append((
+                min(clock, end).strftime("%Y-%m-%d %H:%M:%S.%f"),
+                sender, receiver, amount, rng.choice(MESSAGES), accepted,
+            ))
+        yield rows
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Generate a synthetic venmo.db")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of user activity")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=datetime(2026, 1, 1),
+                        help="timestamp of the end of the generated history, e.g. 2026-01-01")
+    parser.add_argument("--days", type=float, default=365)
+    parser.add_argument("--request-ratio", type=float, default=0.3, help="share of transactions that are requests")
+    parser.add_argument("--accept-ratio", type=float, default=0.7, help="share of requests accepted")
+    parser.add_argument("--deny-ratio", type=float, default=0.2, help="share of requests denied")
+    parser.add_argument("--opening-balance", type=float, default=100.0)
+    parser.add_argument("--batch-size", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    driver = db.DatabaseDriver(args.db)
+    if driver.conn.execute(db.QUERIES["user_count"]).fetchone()[0]:
+        print(f"{args.db} already has users; generate into a fresh database")
+        return 1
+
+    start = time.perf_counter()
+    driver.drop_bulk_load_indexes()
+    driver.conn.executescript("""
+        PRAGMA synchronous = OFF;
+        PRAGMA cache_size = -262144;
+        PRAGMA temp_store = MEMORY;
+    """)
+
+    rng = random.Random(args.seed)
+    net = [0.0] * (args.users + 1)
+    lowest = [0.0] * (args.users + 1)
+    loaded = 0
+    for rows in generate_transactions(
+        rng, args.users, args.transactions, args.end, args.days, args.zipf,
+        args.request_ratio, args.accept_ratio, args.deny_ratio, args.batch_size,
+        net, lowest,
+    ):
+        with driver.write_transaction() as conn:
+            conn.executemany(db.QUERIES["load_transaction"], rows)
+        loaded += len(rows)
+        print(f"\r{loaded} transactions", end="", flush=True)
+    print()
+
+    # Users are written last, once we know how much each needs to open with
+    # to never go below zero
+    with driver.write_transaction() as conn:
+        conn.executemany(db.QUERIES["load_user"], (
+            (
+                user_id, f"User {user_id}", f"user{user_id}",
+                round(args.opening_balance - lowest[user_id] + net[user_id], 2),
+                round(args.opening_balance - lowest[user_id], 2),
+            )
+            for user_id in range(1, args.users + 1)
+        ))
+
+    print("Building indexes", flush=True)
+    driver.create_indexes()
+    driver.create_user_search_index()
+    driver.conn.execute("PRAGMA synchronous = FULL;")
+    driver.conn.execute("ANALYZE;")
+    print(f"Generated {args.users} users and {loaded} transactions in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,114 @@
+"""
+Load protection for the write routes: token-bucket rate limits per user and
+globally, and an admission controller that sheds work once too much is in
+flight or recent tail latency is too high.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average with bursts of up to capacity
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """
+        Take one token. Returns 0 on success, otherwise the number of seconds
+        until a token will be available
+        """
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    """
+    One token bucket per user plus one shared by everybody. Only the
+    max_users most recently seen users keep a bucket; a user whose bucket was
+    dropped starts again with a full one
+    """
+
+    def __init__(self, user_rate, user_burst, global_rate, global_burst, max_users=10000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_users = max_users
+        self.users = OrderedDict()
+        self.everyone = TokenBucket(global_rate, global_burst)
+        self.lock = threading.Lock()
+
+    def check(self, key):
+        """
+        Returns 0 if the request may go ahead, otherwise seconds to wait
+        """
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.users.get(key)
+            if bucket is None:
+                bucket = self.users[key] = TokenBucket(self.user_rate, self.user_burst)
+                if len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            else:
+                self.users.move_to_end(key)
+            wait = bucket.take(now)
+            if wait:
+                return wait
+            return self.everyone.take(now)
+
+
+class AdmissionController(object):
+    """
+    Bounds the number of write requests in flight and refuses new ones while
+    the p99 latency of requests finished in the last window seconds is above
+    p99_threshold. Old samples age out, so shedding stops on its own once the
+    backlog has drained
+    """
+
+    def __init__(self, max_in_flight, p99_threshold, window=10.0):
+        self.max_in_flight = max_in_flight
+        self.p99_threshold = p99_threshold
+        self.window = window
+        self.in_flight = 0
+        self.samples = deque(maxlen=1000)
+        self.p99 = 0.0
+        self.p99_at = 0.0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """
+        Returns True and counts the request as in flight if it may run
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.in_flight >= self.max_in_flight:
+                return False
+            if now - self.p99_at > 1.0:
+                self._update_p99(now)
+            if self.p99 > self.p99_threshold:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, elapsed):
+        with self.lock:
+            self.in_flight -= 1
+            self.samples.append((time.monotonic(), elapsed))
+
+    def _update_p99(self, now):
+        # Recomputed at most once a second to keep admit() cheap
+        while self.samples and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        latencies = sorted(elapsed for _, elapsed in self.samples)
+        self.p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+        self.p99_at = now
@@ -0,0 +1,438 @@
+"""
+In-memory storage backend for simulations and load tests.
+
+MemoryDriver answers the same calls as db.DatabaseDriver that the app, the
+unit of work and the simulators make, with the same results, but keeps
+everything in Python structures: users in a list indexed by id, a hash map
+of transactions by id and a list of transaction ids per user. Nothing
+touches the disk unless asked to: snapshot_path gets a JSON snapshot of the
+whole ledger every snapshot_interval seconds, and log_path gets every write
+appended as it happens so that a restart can replay the writes made since
+the last snapshot. Log entries are numbered and a snapshot records the last
+number it includes, so entries it already holds are skipped on replay even
+if the log wasn't truncated after it.
+
+Select it with VENMO_BACKEND=memory. Operational features that only make
+sense for SQLite (backups, replicas, archiving, the transfer journal, query
+plans) aren't available.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+from currency import BASE_CURRENCY
+
+
+class MemoryDriver(object):
+    """
+    Ledger held entirely in memory, optionally snapshotted and write-logged
+    """
+
+    def __init__(self, snapshot_path=None, snapshot_interval=60, log_path=None):
+        self.lock = threading.RLock()
+        self.users = [None]
+        self.usernames = {}
+        self.transactions = {}
+        self.user_transactions = [None]
+        self.next_transaction_id = 1
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.log = None
+        self.log_seq = 0
+        self.versions = db.UserVersions()
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+        if log_path:
+            if os.path.exists(log_path):
+                self.replay_log(log_path)
+            self.log = open(log_path, "a", buffering=1)
+        if snapshot_path:
+            self.start_snapshots(snapshot_interval)
+
+    def current_timestamp(self):
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    # ---- persistence --------------------------------------------------------
+
+    def _log(self, *entry):
+        self.log_seq += 1
+        if self.log is not None:
+            self.log.write(json.dumps([self.log_seq, *entry]) + "\n")
+
+    def snapshot(self):
+        """
+        Write the whole ledger to snapshot_path and start a fresh write log
+        """
+        with self.lock:
+            state = json.dumps({
+                "users": self.users,
+                "transactions": list(self.transactions.values()),
+                "next_transaction_id": self.next_transaction_id,
+                "log_seq": self.log_seq,
+            })
+            tmp = self.snapshot_path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(state)
+            os.replace(tmp, self.snapshot_path)
+            if self.log is not None:
+                self.log.close()
+                self.log = open(self.log_path, "w", buffering=1)
+
+    def load_snapshot(self, path):
+        with open(path) as f:
+            state = json.load(f)
+        self.users = state["users"]
+        self.user_transactions = [[] if user is not None else None for user in self.users]
+        self.usernames = {user["username"]: user["id"] for user in self.users if user is not None}
+        for txn in state["transactions"]:
+            self._add_transaction(txn)
+        self.next_transaction_id = state["next_transaction_id"]
+        self.log_seq = state.get("log_seq", 0)
+
+    def replay_log(self, path):
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                kind, *args = json.loads(line)
+                # Unnumbered entries come from logs written before numbering
+                if isinstance(kind, int):
+                    if kind <= self.log_seq:
+                        continue
+                    self.log_seq = kind
+                    kind, *args = args
+                if kind == "user":
+                    self._insert_user(*args)
+                elif kind == "delete":
+                    self._delete_user(*args)
+                elif kind == "status":
+                    txn_id, accepted, timestamp = args
+                    self.transactions[txn_id].update(accepted=accepted, timestamp=timestamp)
+                elif kind == "unit":
+                    self._apply_ops([tuple(op) for op in args[0]])
+
+    def start_snapshots(self, interval):
+        def snapshot_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    print("Snapshot failed:", e, flush=True)
+
+        threading.Thread(target=snapshot_forever, daemon=True).start()
+
+    def close(self):
+        """
+        Close the write log. The ledger itself needs no cleanup
+        """
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    # ---- users --------------------------------------------------------------
+
+    def _insert_user(self, user):
+        self.users.append(user)
+        self.user_transactions.append([])
+        self.usernames[user["username"]] = user["id"]
+
+    def _delete_user(self, user_id):
+        user = self.users[user_id]
+        del self.usernames[user["username"]]
+        self.users[user_id] = None
+
+    def _user(self, user_id):
+        if isinstance(user_id, int) and 0 < user_id < len(self.users):
+            return self.users[user_id]
+        return None
+
+    def get_all_users(self):
+        with self.lock:
+            return [
+                {"id": user["id"], "name": user["name"], "username": user["username"]}
+                for user in self.users if user is not None
+            ]
+
+    def create_a_user(self, name, username, balance):
+        with self.lock:
+            if username in self.usernames:
+                # Same error the SQLite backend's unique index raises
+                raise sqlite3.IntegrityError("UNIQUE constraint failed: venmo.username")
+            # balance is in BASE_CURRENCY, balances holds any other currency
+            user = {
+                "id": len(self.users), "name": name, "username": username,
+                "balance": float(balance), "opening_balance": float(balance), "balances": {},
+            }
+            self._insert_user(user)
+            self._log("user", user)
+            return user["id"]
+
+    def get_user_row(self, user_id):
+        with self.lock:
+            user = self._user(user_id)
+            if user is None:
+                return None
+            return {"id": user["id"], "name": user["name"], "username": user["username"], "balance": user["balance"]}
+
+    def get_user_rows(self, user_ids):
+        with self.lock:
+            return {user_id: self.get_user_row(user_id) for user_id in user_ids}
+
+    def get_user_by_id(self, user_id):
+        with self.lock:
+            user = self.get_user_row(user_id)
+            if user is None:
+                return None
+            history = [dict(self.transactions[i]) for i in self.user_transactions[user_id]]
+            held = dict(self.users[user_id].get("balances", {}))
+        history.sort(key=lambda txn: txn["timestamp"], reverse=True)
+        user["balances"] = {BASE_CURRENCY: user["balance"], **{currency: held[currency] for currency in sorted(held)}}
+        user["transactions"] = history
+        return user
+
+    def get_user_by_username(self, username):
+        with self.lock:
+            user_id = self.usernames.get(username)
+            return None if user_id is None else self.get_user_by_id(user_id)
+
+    def search_users(self, query, limit):
+        terms = [term.lower() for term in re.findall(r"\w+", query)]
+        if not terms:
+            return []
+        with self.lock:
+            users = [user for user in self.users if user is not None]
+        results = []
+        for user in users:
+            words = re.findall(r"\w+", f"{user['name']} {user['username']}".lower())
+            if all(any(word.startswith(term) for word in words) for term in terms):
+                results.append({"id": user["id"], "name": user["name"], "username": user["username"]})
+                if len(results) == limit:
+                    break
+        return results
+
+    def delete_specific_user(self, user_id):
+        with self.lock:
+            if self._user(user_id) is not None:
+                self._delete_user(user_id)
+                self._log("delete", user_id)
+        self.versions.bump(user_id)
+
+    # ---- transactions -------------------------------------------------------
+
+    def _add_transaction(self, txn):
+        # Snapshots and logs written before transactions had currencies
+        txn.setdefault("currency", BASE_CURRENCY)
+        txn.setdefault("source_currency", None)
+        txn.setdefault("source_amount", None)
+        self.transactions[txn["id"]] = txn
+        for user_id in {txn["sender_id"], txn["receiver_id"]}:
+            if self._user(user_id) is not None:
+                self.user_transactions[user_id].append(txn["id"])
+
+    def new_transaction(self, sender_id, receiver_id, amount, message, accepted,
+                        currency=BASE_CURRENCY, source_currency=None, source_amount=None):
+        return {
+            "id": None,
+            "timestamp": self.current_timestamp(),
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "amount": float(amount),
+            "message": message,
+            "accepted": None if accepted is None else int(accepted),
+            "currency": currency,
+            "source_currency": source_currency,
+            "source_amount": None if source_amount is None else float(source_amount),
+        }
+
+    def get_transaction_by_id(self, id):
+        with self.lock:
+            txn = self.transactions.get(id)
+            return None if txn is None else dict(txn)
+
+    def send_from_sender_to_receiver(self, sender_id, amount, receiver_id, message):
+        txn = self.new_transaction(sender_id, receiver_id, amount, message, True)
+        if not self.apply_unit([("send", txn)]):
+            return None
+        return txn["id"]
+
+    def add_request_to_transactions(self, sender_id, receiver_id, amount, accepted, message):
+        txn = self.new_transaction(sender_id, receiver_id, amount, message, accepted)
+        self.apply_unit([("request", txn)])
+        return txn["id"]
+
+    def accept_transaction_request(self, transaction_id, sender_id, receiver_id, amount):
+        txn = self.new_transaction(sender_id, receiver_id, amount, None, True)
+        txn["id"] = transaction_id
+        return self.apply_unit([("accept", txn)])
+
+    def apply_unit(self, ops):
+        """
+        Same contract as DatabaseDriver.apply_unit: every write applies, or
+        none does and the result is False
+        """
+        with self.lock:
+            # Check everything first so a rejected unit leaves nothing behind
+            balances = {}
+            settled = set()
+            for kind, txn in ops:
+                if kind in ("accept", "deny"):
+                    current = self.transactions.get(txn["id"])
+                    if current is None or current["accepted"] is not None or txn["id"] in settled:
+                        return False
+                    settled.add(txn["id"])
+                if kind in ("send", "accept"):
+                    if self._user(txn["sender_id"]) is None:
+                        return False
+                    debit, credit = self._legs(kind, txn)
+                    for user_id, currency, delta in (debit, credit):
+                        key = (user_id, currency)
+                        balances[key] = db.add_money(balances.get(key, self._balance(user_id, currency)), delta)
+                        if delta < 0 and balances[key] < 0:
+                            return False
+            for kind, txn in ops:
+                if kind in ("send", "request"):
+                    txn["id"] = self.next_transaction_id
+                    self.next_transaction_id += 1
+            self._apply_ops(ops)
+            self._log("unit", ops)
+        self.versions.bump(*{user_id for kind, txn in ops for user_id in (txn["sender_id"], txn["receiver_id"])})
+        return True
+
+    def _balance(self, user_id, currency=BASE_CURRENCY):
+        user = self._user(user_id)
+        if user is None:
+            return 0.0
+        if currency == BASE_CURRENCY:
+            return user["balance"]
+        return user.setdefault("balances", {}).get(currency, 0.0)
+
+    def _legs(self, kind, txn):
+        # An accept moves money in the request's currency, as recorded
+        if kind == "accept":
+            txn = dict(txn, currency=self.transactions[txn["id"]]["currency"])
+        return db.transfer_legs(txn)
+
+    def _apply_ops(self, ops):
+        for kind, txn in ops:
+            if kind in ("send", "accept"):
+                for user_id, currency, delta in self._legs(kind, txn):
+                    user = self._user(user_id)
+                    if user is None:
+                        continue
+                    if currency == BASE_CURRENCY:
+                        user["balance"] = db.add_money(user["balance"], delta)
+                    else:
+                        held = user.setdefault("balances", {})
+                        held[currency] = db.add_money(held.get(currency, 0.0), delta)
+            if kind in ("send", "request"):
+                self._add_transaction(dict(txn))
+                # Keeps replayed writes from reusing ids
+                self.next_transaction_id = max(self.next_transaction_id, txn["id"] + 1)
+            else:
+                stored = self.transactions[txn["id"]]
+                stored["accepted"] = 1 if kind == "accept" else 0
+                stored["timestamp"] = txn["timestamp"]
+                if kind == "accept":
+                    stored["source_currency"] = txn.get("source_currency")
+                    stored["source_amount"] = txn.get("source_amount")
+
+    def update_accepted_status(self, id, status):
+        with self.lock:
+            txn = self.transactions[id]
+            txn["accepted"] = None if status is None else int(status)
+            txn["timestamp"] = self.current_timestamp()
+            self._log("status", id, txn["accepted"], txn["timestamp"])
+        self.versions.bump(txn["sender_id"], txn["receiver_id"])
+
+    def user_version(self, user_id):
+        return self.versions.get(user_id)
+
+    def get_last_transaction_id(self):
+        return self.next_transaction_id - 1
+
+    def unit_of_work(self):
+        return db.UnitOfWork(self)
+
+    def search_transactions(self, user_id=None, status=None, start=None, end=None,
+                            min_amount=None, max_amount=None, message=None,
+                            before=None, limit=50):
+        wanted = {"true": 1, "false": 0, "null": None}.get(status)
+        with self.lock:
+            if user_id is None:
+                candidates = self.transactions.values()
+            elif self._user(user_id) is not None:
+                candidates = (self.transactions[i] for i in self.user_transactions[user_id])
+            else:
+                candidates = (txn for txn in self.transactions.values() if user_id in (txn["sender_id"], txn["receiver_id"]))
+            results = [
+                dict(txn) for txn in candidates
+                if (status is None or txn["accepted"] == wanted)
+                and (start is None or txn["timestamp"] >= start)
+                and (end is None or txn["timestamp"] < end)
+                and (min_amount is None or txn["amount"] >= min_amount)
+                and (max_amount is None or txn["amount"] <= max_amount)
+                and (message is None or message in (txn["message"] or ""))
+                and (before is None or (txn["timestamp"], txn["id"]) < tuple(before))
+            ]
+        results.sort(key=lambda txn: (txn["timestamp"], txn["id"]), reverse=True)
+        return results[:limit]
+
+    def expire_requests(self, ttl, batch_size=500):
+        start = time.perf_counter()
+        cutoff = (datetime.now() - timedelta(seconds=ttl)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        with self.lock:
+            stale = [
+                dict(txn) for txn in self.transactions.values()
+                if txn["accepted"] is None and txn["timestamp"] < cutoff
+            ]
+        now = self.current_timestamp()
+        expired = 0
+        for txn in stale:
+            if self.apply_unit([("deny", dict(txn, timestamp=now))]):
+                expired += 1
+        return {
+            "expired": expired,
+            "batches": 1,
+            "max_lock_seconds": 0.0,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def recent_transfers(self, seconds):
+        cutoff = (datetime.now() - timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        recent = []
+        with self.lock:
+            for txn in self.transactions.values():
+                if txn["accepted"] == 1 and txn["timestamp"] >= cutoff:
+                    (sender_id, currency, debit), _ = db.transfer_legs(txn)
+                    recent.append((sender_id, -debit, currency, txn["timestamp"]))
+        recent.sort(key=lambda transfer: transfer[3])
+        return recent
+
+    def get_volume(self, granularity, start, end):
+        # Prefixes of the stored timestamp, equal to formatting it with
+        # db.GRANULARITIES but without parsing every row
+        bucket_of = {
+            "minute": lambda ts: ts[:16],
+            "hour": lambda ts: ts[:13] + ":00",
+            "day": lambda ts: ts[:10],
+        }[granularity]
+        with self.lock:
+            transfers = [(txn["timestamp"], txn["amount"]) for txn in self.transactions.values()]
+        buckets = {}
+        for timestamp, amount in transfers:
+            bucket = bucket_of(timestamp)
+            if start <= bucket < end:
+                count, volume = buckets.get(bucket, (0, 0.0))
+                buckets[bucket] = (count + 1, volume + amount)
+        return [
+            {"bucket": bucket, "count": count, "volume": volume}
+            for bucket, (count, volume) in sorted(buckets.items())
+        ]
@@ -1,26 +1,52 @@
+import argparse
+import contextlib
+import gzip
+import io
+import itertools
 import json
+import logging
+import os
 from re import L
 import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import threading
 from threading import Thread
-from time import sleep
 import unittest
 from datetime import datetime
 
-from app import app
-import requests
-
-# NOTE: Make sure you run 'pip3 install requests' in your virtualenv
+from app import create_app, get_db
+import config as venmo_config
+import db
+import generate
+import limits
+import memory
+import reconcile
+import replay
+import simulate
+import sqlite3
+import sweep
+import velocity
+import tempfile
+
+# Requests are served in process by the Flask test client, so no server has to
+# be running. Run with --workers N to shard the tests across N processes
 
 # Flag to run extra credit tests (if applicable)
 EXTRA_CREDIT = False
 
-# URL pointing to your local dev host
+# Base URL of the requests the tests make
 LOCAL_URL = "http://localhost:5000"
 
 # Sample testing data
 SAMPLE_USER = {"name": "Cornell AppDev", "username": "cornellappdev"}
 SAMPLE_TRANSACTION = {"amount": 5, "message": "boba"}
 
+# Usernames are unique, so every user the tests create gets its own
+RUN_ID = uuid.uuid4().hex[:8]
+USERNAME_SUFFIXES = itertools.count()
+
 # Request endpoint generators
 USER_ROUTE = "/api/users"
 TRANSACTION_ROUTE = "/api/transactions"
@@ -91,6 +117,11 @@ def wrong_value_error(
     return error_str(err)
 
 
+# User body generator
+def gen_user_body(username=SAMPLE_USER["username"], name=SAMPLE_USER["name"]):
+    return {"name": name, "username": f"{username}_{RUN_ID}_{next(USERNAME_SUFFIXES)}"}
+
+
 # Transaction body generator
 def gen_transaction_body(sender_id, receiver_id, accepted):
     return {
@@ -101,7 +132,55 @@ def gen_transaction_body(sender_id, receiver_id, accepted):
     }
 
 
-class TestRoutes(unittest.TestCase):
+class Response(object):
+    """
+    A test client response with the parts of the requests API the tests use
+    """
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.get_data()
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Client(object):
+    """
+    Makes the tests' requests against app in process, through its Flask
+    test client
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, url, params=None, headers=None):
+        return Response(self.client.get(url, query_string=params, headers=headers))
+
+    def post(self, url, data=None):
+        return Response(self.client.post(url, data=data))
+
+    def delete(self, url):
+        return Response(self.client.delete(url))
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Gives every test an app of its own on a fresh in-memory database
+    """
+
+    def setUp(self):
+        self.app = create_app({"VENMO_DB_PATH": ":memory:"})
+        self.db = get_db(self.app)
+        self.client = Client(self.app)
+
+
+class TestRoutes(AppTestCase):
     def jsonable_test(self, res, req_type, route, status_code, body=None):
         jsonable, error = is_jsonable(res, req_type, route, body)
         self.assertTrue(jsonable, error)
@@ -116,7 +195,7 @@ class TestRoutes(unittest.TestCase):
     def test_get_initial_users(self):
         req_type = "GET"
         route = gen_users_route()
-        res = requests.get(gen_users_path())
+        res = self.client.get(gen_users_path())
         self.jsonable_test(res, req_type, route, 200)
 
         users = res.json().get("users")
@@ -129,29 +208,30 @@ class TestRoutes(unittest.TestCase):
         )
 
     def test_create_user(self):
+        sample_user = gen_user_body()
         req_type = "POST"
         route = gen_users_route()
-        res = requests.post(gen_users_path(), data=json.dumps(SAMPLE_USER))
-        self.jsonable_test(res, req_type, route, 201, SAMPLE_USER)
+        res = self.client.post(gen_users_path(), data=json.dumps(sample_user))
+        self.jsonable_test(res, req_type, route, 201, sample_user)
         user = res.json()
-        for key in SAMPLE_USER.keys():
+        for key in sample_user.keys():
             self.assertEqual(
                 user.get(key),
-                SAMPLE_USER[key],
+                sample_user[key],
                 wrong_value_error(
                     req_type,
                     route,
                     user.get(key),
-                    SAMPLE_USER[key],
+                    sample_user[key],
                     key,
-                    SAMPLE_USER,
+                    sample_user,
                 ),
             )
         self.assertEqual(
             user.get("balance"),
             0,
             wrong_value_error(
-                req_type, route, user.get("balance"), 0, "balance", SAMPLE_USER
+                req_type, route, user.get("balance"), 0, "balance", sample_user
             ),
         )
         self.assertEqual(
@@ -164,10 +244,11 @@ class TestRoutes(unittest.TestCase):
         )
 
     def test_get_user(self):
+        sample_user = gen_user_body()
         req_type = "POST"
         route = gen_users_route()
-        res = requests.post(gen_users_path(), data=json.dumps(SAMPLE_USER))
-        jsonable, error = is_jsonable(res, req_type, route, SAMPLE_USER)
+        res = self.client.post(gen_users_path(), data=json.dumps(sample_user))
+        jsonable, error = is_jsonable(res, req_type, route, sample_user)
         self.assertTrue(
             jsonable,
             error_str(
@@ -184,7 +265,7 @@ class TestRoutes(unittest.TestCase):
 
         req_type = "GET"
         route = gen_users_route(user["id"])
-        res = requests.get(gen_users_path(user["id"]))
+        res = self.client.get(gen_users_path(user["id"]))
         self.jsonable_test(res, req_type, route, 200)
         user = res.json()
         self.assertTrue(
@@ -193,12 +274,12 @@ class TestRoutes(unittest.TestCase):
                 f"Returned user from GET request to {route} does not have an 'id' field!"
             ),
         )
-        for key in SAMPLE_USER.keys():
+        for key in sample_user.keys():
             self.assertEqual(
                 user.get(key),
-                SAMPLE_USER[key],
+                sample_user[key],
                 wrong_value_error(
-                    req_type, route, user.get(key), SAMPLE_USER[key], key
+                    req_type, route, user.get(key), sample_user[key], key
                 ),
             )
         self.assertEqual(
@@ -219,10 +300,11 @@ class TestRoutes(unittest.TestCase):
         )
 
     def test_delete_user(self):
+        sample_user = gen_user_body()
         req_type = "POST"
         route = gen_users_route()
-        res = requests.post(gen_users_path(), data=json.dumps(SAMPLE_USER))
-        jsonable, error = is_jsonable(res, req_type, route, SAMPLE_USER)
+        res = self.client.post(gen_users_path(), data=json.dumps(sample_user))
+        jsonable, error = is_jsonable(res, req_type, route, sample_user)
         self.assertTrue(
             jsonable,
             error_str(
@@ -240,15 +322,15 @@ class TestRoutes(unittest.TestCase):
         user_id = user["id"]
         req_type = "DELETE"
         route = gen_users_path(user_id)
-        res = requests.delete(gen_users_path(user_id))
+        res = self.client.delete(gen_users_path(user_id))
         self.jsonable_test(res, req_type, route, 200)
         user = res.json()
-        for key in SAMPLE_USER:
+        for key in sample_user:
             self.assertEqual(
                 user.get(key),
-                SAMPLE_USER[key],
+                sample_user[key],
                 wrong_value_error(
-                    req_type, route, user.get(key), SAMPLE_USER[key], key
+                    req_type, route, user.get(key), sample_user[key], key
                 ),
             )
         self.assertIsNotNone(
@@ -265,7 +347,7 @@ class TestRoutes(unittest.TestCase):
 
         req_type = "GET"
         route = gen_users_path(user_id)
-        res = requests.get(gen_users_path(user_id))
+        res = self.client.get(gen_users_path(user_id))
         jsonable, error = is_jsonable(res, req_type, route)
         self.assertTrue(
             jsonable,
@@ -284,22 +366,127 @@ class TestRoutes(unittest.TestCase):
     def test_get_invalid_user(self):
         req_type = "GET"
         route = gen_users_path(1000)
-        res = requests.get(gen_users_path(1000))
+        res = self.client.get(gen_users_path(1000))
         self.jsonable_test(res, req_type, route, 404)
 
     def test_delete_invalid_user(self):
         req_type = "DELETE"
         route = gen_users_path(1000)
-        res = requests.delete(gen_users_path(1000))
+        res = self.client.delete(gen_users_path(1000))
         self.jsonable_test(res, req_type, route, 404)
 
+    def test_duplicate_username(self):
+        body = gen_user_body()
+        res = self.client.post(gen_users_path(), data=json.dumps(body))
+        self.jsonable_test(res, "POST", gen_users_route(), 201, body)
+        res = self.client.post(gen_users_path(), data=json.dumps(body))
+        self.jsonable_test(res, "POST", gen_users_route(), 409, body)
+
+    def test_user_profile_etag(self):
+        if self.app.extensions["venmo"]["profile_cache"] is None:
+            self.skipTest("profile cache is off")
+        user = self.create_user_and_assert_balance(10)
+        other = self.create_user_and_assert_balance(0)
+        first = self.client.get(gen_users_path(user["id"]))
+        etag = first.headers["ETag"]
+        self.assertEqual(first.json()["balance"], 10)
+
+        unchanged = self.client.get(gen_users_path(user["id"]), headers={"If-None-Match": etag})
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged.text, "")
+
+        # Sending money changes both profiles
+        self.client.post(gen_transactions_path(), data=json.dumps(
+            {**gen_transaction_body(user["id"], other["id"], True), "amount": 4}))
+        changed = self.client.get(gen_users_path(user["id"]), headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["balance"], 6)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        self.assertEqual(len(changed.json()["transactions"]), 1)
+
+        self.client.delete(gen_users_path(user["id"]))
+        self.assertEqual(self.client.get(gen_users_path(user["id"])).status_code, 404)
+
+    def test_compressed_profile(self):
+        user = self.create_user_and_assert_balance(100)
+        other = self.create_user_and_assert_balance(0)
+        for _ in range(20):
+            self.client.post(gen_transactions_path(), data=json.dumps(
+                gen_transaction_body(user["id"], other["id"], True)))
+        plain = self.client.get(gen_users_path(user["id"]))
+        self.assertNotIn("Content-Encoding", plain.headers)
+
+        zipped = self.client.get(gen_users_path(user["id"]), headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(zipped.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", zipped.headers["Vary"])
+        self.assertLess(len(zipped.content), len(plain.content))
+        self.assertEqual(json.loads(gzip.decompress(zipped.content)), plain.json())
+
+        if self.app.extensions["venmo"]["profile_cache"] is not None:
+            unchanged = self.client.get(gen_users_path(user["id"]), headers={
+                "Accept-Encoding": "gzip", "If-None-Match": zipped.headers["ETag"]})
+            self.assertEqual(unchanged.status_code, 304)
+
+    def test_columnar_transactions(self):
+        user = self.create_user_and_assert_balance(10)
+        other = self.create_user_and_assert_balance(0)
+        for amount in (1, 2, 3):
+            self.client.post(gen_transactions_path(), data=json.dumps(
+                {**gen_transaction_body(user["id"], other["id"], None), "amount": amount}))
+        rows = self.client.get(gen_transactions_path(), params={"user_id": user["id"]}).json()["transactions"]
+        columns = self.client.get(gen_transactions_path(), params={
+            "user_id": user["id"], "format": "columnar"}).json()["transactions"]
+        self.assertEqual(columns["amount"], [row["amount"] for row in rows])
+        self.assertEqual(columns["id"], [row["id"] for row in rows])
+        profile = self.client.get(gen_users_path(user["id"]), params={"format": "columnar"}).json()
+        self.assertEqual(profile["transactions"]["id"], columns["id"])
+        res = self.client.get(gen_transactions_path(), params={"format": "csv"})
+        self.jsonable_test(res, "GET", gen_transactions_route(), 400)
+
+    def test_get_user_by_username(self):
+        body = gen_user_body()
+        user = self.client.post(gen_users_path(), data=json.dumps(body)).json()
+
+        req_type = "GET"
+        route = gen_users_route() + f"by-username/{body['username']}/"
+        res = self.client.get(gen_users_path() + f"by-username/{body['username']}/")
+        self.jsonable_test(res, req_type, route, 200)
+        self.assertEqual(
+            res.json().get("id"),
+            user["id"],
+            wrong_value_error(req_type, route, res.json().get("id"), user["id"], "id"),
+        )
+
+        route = gen_users_route() + "by-username/nobody-has-this-name/"
+        res = self.client.get(gen_users_path() + "by-username/nobody-has-this-name/")
+        self.jsonable_test(res, req_type, route, 404)
+
+    def test_search_users(self):
+        searchable = gen_user_body("typeaheadtester", "Typeahead Tester")
+        user = self.client.post(
+            gen_users_path(), data=json.dumps(searchable)).json()
+
+        req_type = "GET"
+        route = gen_users_route() + "search/"
+        res = self.client.get(gen_users_path() + "search/?q=typeah")
+        self.jsonable_test(res, req_type, route, 200)
+        ids = [u.get("id") for u in res.json().get("users")]
+        self.assertIn(
+            user["id"],
+            ids,
+            wrong_value_error(req_type, route, ids, user["id"], "matching ids"),
+        )
+
+        res = self.client.get(gen_users_path() + "search/?q=typeah&limit=0")
+        self.jsonable_test(res, req_type, route, 400)
+
     # ---- TRANSACTIONS  ---------------------------------------------------
 
     def create_user_and_assert_balance(self, balance, extra=False):
-        user_with_balance = {**SAMPLE_USER, "balance": balance}
+        user_with_balance = {**gen_user_body(), "balance": balance}
         req_type = "POST"
         route = gen_users_route(extra=extra)
-        res = requests.post(
+        res = self.client.post(
             gen_users_path(extra=extra), data=json.dumps(user_with_balance)
         )
         self.jsonable_test(res, req_type, route, 201, user_with_balance)
@@ -340,7 +527,7 @@ class TestRoutes(unittest.TestCase):
         transaction_body = gen_transaction_body(user1, user2, True)
 
         # Test if transaction body is right
-        res = requests.post(gen_transactions_path(),
+        res = self.client.post(gen_transactions_path(),
                             data=json.dumps(transaction_body))
         self.jsonable_test(res, req_type, route, 201, transaction_body)
         transaction = res.json()
@@ -367,7 +554,7 @@ class TestRoutes(unittest.TestCase):
         )
 
         # Test if sender balance is updated and if transaction outputs correctly in get_user
-        res1 = requests.get(gen_users_path(user1)).json()
+        res1 = self.client.get(gen_users_path(user1)).json()
         balance = 10 - transaction_body.get("amount")
         self.assertEqual(
             res1.get("balance"),
@@ -408,7 +595,7 @@ class TestRoutes(unittest.TestCase):
             )
 
         # Test if receiver balance is updated and if transaction outputs correctly in get_user
-        res2 = requests.get(gen_users_path(user2)).json()
+        res2 = self.client.get(gen_users_path(user2)).json()
         balance = 10 + transaction_body.get("amount")
         self.assertEqual(
             res2.get("balance"),
@@ -456,7 +643,7 @@ class TestRoutes(unittest.TestCase):
         user2 = self.create_user_and_assert_balance(10).get("id")
         transaction_body = gen_transaction_body(user1, user2, None)
 
-        res = requests.post(gen_transactions_path(),
+        res = self.client.post(gen_transactions_path(),
                             data=json.dumps(transaction_body))
         self.jsonable_test(res, req_type, route, 201, transaction_body)
         transaction = res.json()
@@ -484,7 +671,7 @@ class TestRoutes(unittest.TestCase):
         )
 
         # Tests if requester balance stays the same and get user outputs correctly
-        res1 = requests.get(gen_users_path(user1)).json()
+        res1 = self.client.get(gen_users_path(user1)).json()
         self.assertEqual(
             res1.get("balance"),
             10,
@@ -524,7 +711,7 @@ class TestRoutes(unittest.TestCase):
             )
 
         # Tests if requestee balance is correct and if get user outputs correctly
-        res2 = requests.get(gen_users_path(user2)).json()
+        res2 = self.client.get(gen_users_path(user2)).json()
         self.assertEqual(
             res2.get("balance"),
             10,
@@ -569,7 +756,7 @@ class TestRoutes(unittest.TestCase):
         user2 = self.create_user_and_assert_balance(10).get("id")
         transaction_body = gen_transaction_body(user1, user2, None)
 
-        create_res = requests.post(
+        create_res = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body))
         self.assertEqual(create_res.status_code, 201)
 
@@ -577,7 +764,7 @@ class TestRoutes(unittest.TestCase):
         route = gen_transactions_route(tr)
         transaction_body["accepted"] = True
 
-        res = requests.post(gen_transactions_path(
+        res = self.client.post(gen_transactions_path(
             tr), data=json.dumps({"accepted": True}))
         self.jsonable_test(res, req_type, route, 200, transaction_body)
         transaction = res.json()
@@ -603,7 +790,7 @@ class TestRoutes(unittest.TestCase):
             ),
         )
 
-        res1 = requests.get(gen_users_path(user1)).json()
+        res1 = self.client.get(gen_users_path(user1)).json()
         balance = 10 - transaction_body.get("amount")
         self.assertEqual(
             res1.get("balance"),
@@ -643,7 +830,7 @@ class TestRoutes(unittest.TestCase):
                 ),
             )
 
-        res2 = requests.get(gen_users_path(user2)).json()
+        res2 = self.client.get(gen_users_path(user2)).json()
         balance = 10 + transaction_body.get("amount")
         self.assertEqual(
             res2.get("balance"),
@@ -689,7 +876,7 @@ class TestRoutes(unittest.TestCase):
         user2 = self.create_user_and_assert_balance(10).get("id")
         transaction_body = gen_transaction_body(user1, user2, None)
 
-        create_res = requests.post(
+        create_res = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body))
         self.assertEqual(create_res.status_code, 201)
 
@@ -697,7 +884,7 @@ class TestRoutes(unittest.TestCase):
         route = gen_transactions_route(tr)
         transaction_body["accepted"] = False
 
-        res = requests.post(gen_transactions_path(
+        res = self.client.post(gen_transactions_path(
             tr), data=json.dumps({"accepted": False}))
         self.jsonable_test(res, req_type, route, 200, transaction_body)
         transaction = res.json()
@@ -723,7 +910,7 @@ class TestRoutes(unittest.TestCase):
             ),
         )
 
-        res1 = requests.get(gen_users_path(user1)).json()
+        res1 = self.client.get(gen_users_path(user1)).json()
         self.assertEqual(
             res1.get("balance"),
             10,
@@ -762,7 +949,7 @@ class TestRoutes(unittest.TestCase):
                 ),
             )
 
-        res2 = requests.get(gen_users_path(user2)).json()
+        res2 = self.client.get(gen_users_path(user2)).json()
         self.assertEqual(
             res2.get("balance"),
             10,
@@ -808,26 +995,26 @@ class TestRoutes(unittest.TestCase):
         user2 = self.create_user_and_assert_balance(10).get("id")
         transaction_body = gen_transaction_body(user1, user2, None)
 
-        create_res1 = requests.post(
+        create_res1 = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body))
         self.assertEqual(create_res1.status_code, 201)
 
         transaction_body2 = gen_transaction_body(user2, user1, True)
-        create_res2 = requests.post(
+        create_res2 = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body2))
         self.assertEqual(create_res2.status_code, 201)
 
         transaction_body3 = gen_transaction_body(user1, user2, None)
-        create_res3 = requests.post(
+        create_res3 = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body3))
         self.assertEqual(create_res3.status_code, 201)
-        create_res3 = requests.post(gen_transactions_path(
+        create_res3 = self.client.post(gen_transactions_path(
             create_res3.json()["id"]), data=json.dumps({"accepted": False})).json()
 
         expected = [create_res1.json(), create_res2.json(), create_res3]
 
         route = gen_users_route(user2)
-        res = requests.get(gen_users_path(user2))
+        res = self.client.get(gen_users_path(user2))
         self.jsonable_test(res, req_type, route, 200)
         res = res.json()
         self.assertEqual(
@@ -869,7 +1056,7 @@ class TestRoutes(unittest.TestCase):
         transaction_body = gen_transaction_body(user1, user2, True)
         route = gen_transactions_route()
 
-        res = requests.post(gen_transactions_path(),
+        res = self.client.post(gen_transactions_path(),
                             data=json.dumps(transaction_body))
         self.assertEqual(
             res.status_code,
@@ -879,11 +1066,11 @@ class TestRoutes(unittest.TestCase):
         transaction_body = gen_transaction_body(user1, user2, True)
         route = gen_transactions_route()
 
-        res = requests.post(gen_transactions_path(),
+        res = self.client.post(gen_transactions_path(),
                             data=json.dumps(transaction_body))
         self.jsonable_test(res, req_type, route, 403, transaction_body)
 
-        res1 = requests.get(gen_users_path(user1)).json()
+        res1 = self.client.get(gen_users_path(user1)).json()
         self.assertEqual(
             res1.get("balance"),
             0,
@@ -900,7 +1087,7 @@ class TestRoutes(unittest.TestCase):
             )
         )
 
-        res2 = requests.get(gen_users_path(user2)).json()
+        res2 = self.client.get(gen_users_path(user2)).json()
         self.assertEqual(
             res2.get("balance"),
             10,
@@ -923,7 +1110,7 @@ class TestRoutes(unittest.TestCase):
         user2 = self.create_user_and_assert_balance(20).get("id")
         transaction_body = gen_transaction_body(user1, user2, None)
 
-        create_res = requests.post(
+        create_res = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body))
         self.assertEqual(create_res.status_code, 201)
 
@@ -931,11 +1118,11 @@ class TestRoutes(unittest.TestCase):
         route = gen_transactions_route(tr)
         transaction_body["accepted"] = True
 
-        res = requests.post(gen_transactions_path(
+        res = self.client.post(gen_transactions_path(
             tr), data=json.dumps({"accepted": True}))
         self.jsonable_test(res, req_type, route, 403, transaction_body)
 
-        res1 = requests.get(gen_users_path(user1)).json()
+        res1 = self.client.get(gen_users_path(user1)).json()
         self.assertEqual(
             res1.get("balance"),
             0,
@@ -952,7 +1139,7 @@ class TestRoutes(unittest.TestCase):
             )
         )
 
-        res2 = requests.get(gen_users_path(user2)).json()
+        res2 = self.client.get(gen_users_path(user2)).json()
         self.assertEqual(
             res2.get("balance"),
             20,
@@ -969,20 +1156,241 @@ class TestRoutes(unittest.TestCase):
             )
         )
 
+    def test_search_transactions(self):
+        user1 = self.create_user_and_assert_balance(10)["id"]
+        user2 = self.create_user_and_assert_balance(0)["id"]
+        sent = self.client.post(gen_transactions_path(), data=json.dumps(
+            gen_transaction_body(user1, user2, True))).json()
+        requested = self.client.post(gen_transactions_path(), data=json.dumps(
+            gen_transaction_body(user2, user1, None))).json()
+
+        req_type = "GET"
+        route = gen_transactions_route()
+        res = self.client.get(gen_transactions_path(), params={"user_id": user2})
+        self.jsonable_test(res, req_type, route, 200)
+        ids = [t.get("id") for t in res.json().get("transactions")]
+        self.assertEqual(ids, [requested["id"], sent["id"]], wrong_value_error(
+            req_type, route, ids, [requested["id"], sent["id"]], "transaction ids"))
+
+        res = self.client.get(gen_transactions_path(), params={
+            "user_id": user2, "status": "null"})
+        ids = [t.get("id") for t in res.json().get("transactions")]
+        self.assertEqual(ids, [requested["id"]], wrong_value_error(
+            req_type, route, ids, [requested["id"]], "pending transaction ids"))
+
+        # Page through one transaction at a time
+        first = self.client.get(gen_transactions_path(), params={
+            "user_id": user2, "limit": 1}).json()
+        second = self.client.get(gen_transactions_path(), params={
+            "user_id": user2, "limit": 1, "cursor": first["next_cursor"]}).json()
+        ids = [t.get("id") for t in first["transactions"] + second["transactions"]]
+        self.assertEqual(ids, [requested["id"], sent["id"]], wrong_value_error(
+            req_type, route, ids, [requested["id"], sent["id"]], "paged transaction ids"))
+
+        res = self.client.get(gen_transactions_path(), params={"status": "maybe"})
+        self.jsonable_test(res, req_type, route, 400)
+
+    def test_volume_stats(self):
+        req_type = "GET"
+        route = "/api/stats/volume/"
+        before = self.client.get(LOCAL_URL + route, params={"granularity": "day"})
+        self.jsonable_test(before, req_type, route, 200)
+        before = sum(b["count"] for b in before.json().get("buckets"))
+
+        user_id = self.create_user_and_assert_balance(10)["id"]
+        self.client.post(gen_transactions_path(), data=json.dumps(
+            gen_transaction_body(user_id, user_id, True)))
+
+        for granularity in ("minute", "hour", "day"):
+            res = self.client.get(LOCAL_URL + route, params={"granularity": granularity})
+            self.jsonable_test(res, req_type, route, 200)
+            after = sum(b["count"] for b in res.json().get("buckets"))
+            self.assertEqual(after, before + 1, wrong_value_error(
+                req_type, route, after, before + 1, f"{granularity} transaction count"))
+
+        res = self.client.get(LOCAL_URL + route, params={"granularity": "week"})
+        self.jsonable_test(res, req_type, route, 400)
+
+    def test_expire_requests(self):
+        user_id = self.create_user_and_assert_balance(10)["id"]
+        stale = self.client.post(gen_transactions_path(), data=json.dumps(
+            gen_transaction_body(user_id, user_id, None))).json()
+        fresh = self.client.post(gen_transactions_path(), data=json.dumps(
+            gen_transaction_body(user_id, user_id, None))).json()
+        if isinstance(self.db, memory.MemoryDriver):
+            self.db.transactions[stale["id"]]["timestamp"] = "2000-01-01 00:00:00.000000"
+        else:
+            with self.db.write_transaction() as conn:
+                conn.execute(
+                    "UPDATE transactions SET timestamp = '2000-01-01 00:00:00.000000' WHERE id = ?;",
+                    (stale["id"],))
+
+        stats = self.db.expire_requests(ttl=3600, batch_size=1)
+        self.assertGreaterEqual(stats["expired"], 1)
+        self.assertEqual(self.db.get_transaction_by_id(stale["id"])["accepted"], False)
+        self.assertIsNone(self.db.get_transaction_by_id(fresh["id"])["accepted"])
+
+    def test_rate_limited_send(self):
+        user_id = self.create_user_and_assert_balance(10)["id"]
+        state = self.app.extensions["venmo"]
+        original = state["rate_limiter"]
+        state["rate_limiter"] = limits.RateLimiter(0.01, 1, 1000, 1000)
+        try:
+            body = gen_transaction_body(user_id, user_id, None)
+            first = self.client.post(gen_transactions_path(), data=json.dumps(body))
+            second = self.client.post(gen_transactions_path(), data=json.dumps(body))
+        finally:
+            state["rate_limiter"] = original
+
+        route = gen_transactions_route()
+        self.jsonable_test(first, "POST", route, 201, body)
+        self.jsonable_test(second, "POST", route, 429, body)
+        self.assertTrue(
+            int(second.headers.get("Retry-After", 0)) >= 1,
+            error_str("429 response is missing a Retry-After header"),
+        )
+
+    def test_velocity_blocked_send(self):
+        user_id = self.create_user_and_assert_balance(100)["id"]
+        state = self.app.extensions["venmo"]
+        state["velocity"] = velocity.VelocityChecker(velocity.parse_rules("3600:amount=15"))
+        body = gen_transaction_body(user_id, user_id, True)
+        body["amount"] = 10
+        first = self.client.post(gen_transactions_path(), data=json.dumps(body))
+        second = self.client.post(gen_transactions_path(), data=json.dumps(body))
+        body["amount"] = 5
+        third = self.client.post(gen_transactions_path(), data=json.dumps(body))
+
+        route = gen_transactions_route()
+        self.jsonable_test(first, "POST", route, 201, body)
+        self.jsonable_test(second, "POST", route, 403, body)
+        self.jsonable_test(third, "POST", route, 201, body)
+
+    def test_split_payment(self):
+        payer = self.create_user_and_assert_balance(10)["id"]
+        friends = [self.create_user_and_assert_balance(0)["id"] for _ in range(3)]
+        route = gen_transactions_route() + "split/"
+        body = {"sender_id": payer, "participants": friends, "amount": 10, "message": "dinner", "accepted": True}
+        res = self.client.post(gen_transactions_path() + "split/", data=json.dumps(body))
+        self.jsonable_test(res, "POST", route, 201, body)
+        transactions = res.json()["transactions"]
+        self.assertEqual([txn["amount"] for txn in transactions], [3.34, 3.33, 3.33])
+        for txn, friend in zip(transactions, friends):
+            self.assertEqual(txn["receiver_id"], friend)
+            self.assertEqual(self.db.get_transaction_by_id(txn["id"])["receiver_id"], friend)
+        self.assertAlmostEqual(self.client.get(gen_users_path(payer)).json()["balance"], 0)
+
+        # Nothing is created unless everything can be
+        body["participants"] = [{"user_id": friends[0], "amount": 1}, {"user_id": friends[1], "amount": 1}]
+        res = self.client.post(gen_transactions_path() + "split/", data=json.dumps(body))
+        self.jsonable_test(res, "POST", route, 403, body)
+        self.assertEqual(len(self.client.get(gen_users_path(payer)).json()["transactions"]), 3)
+
+    def test_split_request(self):
+        requester = self.create_user_and_assert_balance(0)["id"]
+        friends = [self.create_user_and_assert_balance(5)["id"] for _ in range(2)]
+        route = gen_transactions_route() + "split/"
+        body = {
+            "receiver_id": requester, "message": "rent",
+            "participants": [{"user_id": friends[0], "amount": 4}, {"user_id": friends[1], "amount": 2.5}],
+        }
+        res = self.client.post(gen_transactions_path() + "split/", data=json.dumps(body))
+        self.jsonable_test(res, "POST", route, 201, body)
+        transactions = res.json()["transactions"]
+        self.assertEqual([(txn["sender_id"], txn["accepted"]) for txn in transactions], [(friends[0], None), (friends[1], None)])
+
+        body["participants"].append({"user_id": 1000, "amount": 1})
+        res = self.client.post(gen_transactions_path() + "split/", data=json.dumps(body))
+        self.jsonable_test(res, "POST", route, 404, body)
+
+    def test_split_rejects_bad_values(self):
+        payer = self.create_user_and_assert_balance(10)["id"]
+        friends = [self.create_user_and_assert_balance(0)["id"] for _ in range(2)]
+        route = gen_transactions_route() + "split/"
+        for changes in (
+            {"amount": 1e308},
+            {"amount": float("inf")},
+            {"participants": [{"user_id": friends[0], "amount": float("nan")}]},
+            {"sender_id": [payer]},
+            {"sender_id": "1"},
+        ):
+            body = dict({"sender_id": payer, "participants": friends, "amount": 2, "message": "x", "accepted": True}, **changes)
+            res = self.client.post(gen_transactions_path() + "split/", data=json.dumps(body))
+            self.jsonable_test(res, "POST", route, 400, body)
+
+    def test_split_exact_balance(self):
+        route = gen_transactions_route() + "split/"
+        for participants in (3, [0.1, 0.1, 0.1]):
+            payer = self.create_user_and_assert_balance(0.3)["id"]
+            friends = [self.create_user_and_assert_balance(0)["id"] for _ in range(3)]
+            if participants == 3:
+                body = {"sender_id": payer, "participants": friends, "amount": 0.3, "message": "x", "accepted": True}
+            else:
+                shares = [{"user_id": friend, "amount": amount} for friend, amount in zip(friends, participants)]
+                body = {"sender_id": payer, "participants": shares, "message": "x", "accepted": True}
+            res = self.client.post(gen_transactions_path() + "split/", data=json.dumps(body))
+            self.jsonable_test(res, "POST", route, 201, body)
+            self.assertEqual(self.client.get(gen_users_path(payer)).json()["balance"], 0)
+
+    def test_admission_control(self):
+        admission = limits.AdmissionController(max_in_flight=2, p99_threshold=1.0)
+        self.assertTrue(admission.admit())
+        self.assertTrue(admission.admit())
+        self.assertFalse(admission.admit())
+        admission.release(0.01)
+        self.assertTrue(admission.admit())
+
+    def test_overloaded_send(self):
+        user_id = self.create_user_and_assert_balance(10)["id"]
+        admission = self.app.extensions["venmo"]["admission"]
+        body = gen_transaction_body(user_id, user_id, None)
+        route = gen_transactions_route()
+        for _ in range(admission.max_in_flight):
+            self.assertTrue(admission.admit())
+        res = self.client.post(gen_transactions_path(), data=json.dumps(body))
+        self.jsonable_test(res, "POST", route, 503, body)
+        self.assertEqual(res.headers["Retry-After"], "1")
+
+        admission.release(0.01)
+        res = self.client.post(gen_transactions_path(), data=json.dumps(body))
+        self.jsonable_test(res, "POST", route, 201, body)
+        self.assertEqual(admission.in_flight, admission.max_in_flight - 1)
+
+    def test_admission_released_when_handler_raises(self):
+        admission = self.app.extensions["venmo"]["admission"]
+        with self.assertLogs(self.app.logger, "ERROR"):
+            res = self.client.post(gen_transactions_path(), data="not json")
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(admission.in_flight, 0)
+
+    def test_rate_limiter_keeps_recent_users(self):
+        limiter = limits.RateLimiter(0.01, 1, 1000, 1000, max_users=2)
+        self.assertEqual(limiter.check(1), 0)
+        self.assertEqual(limiter.check(2), 0)
+        self.assertGreater(limiter.check(1), 0)
+        for key in range(3, 100):
+            limiter.check(key)
+        self.assertEqual(list(limiter.users), [98, 99])
+
+    def test_rate_limits_shared_among_workers(self):
+        limiter = create_app({"VENMO_DB_PATH": ":memory:", "VENMO_WORKERS": 4}).extensions["venmo"]["rate_limiter"]
+        self.assertEqual(limiter.user_rate, self.app.config["VENMO_USER_RATE"] / 4)
+        self.assertEqual(limiter.everyone.rate, self.app.config["VENMO_GLOBAL_RATE"] / 4)
+
     def test_change_accepted_transaction(self):
         req_type = "POST"
         user1 = self.create_user_and_assert_balance(10).get("id")
         user2 = self.create_user_and_assert_balance(20).get("id")
         transaction_body = gen_transaction_body(user1, user2, True)
 
-        create_res = requests.post(
+        create_res = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body))
         self.assertEqual(create_res.status_code, 201)
 
         tr = create_res.json().get("id")
         route = gen_transactions_route(tr)
 
-        res = requests.post(gen_transactions_path(
+        res = self.client.post(gen_transactions_path(
             tr), data=json.dumps({"accepted": False}))
         self.jsonable_test(res, req_type, route, 403, transaction_body)
 
@@ -992,26 +1400,26 @@ class TestRoutes(unittest.TestCase):
         user2 = self.create_user_and_assert_balance(20).get("id")
         transaction_body = gen_transaction_body(user1, user2, None)
 
-        create_res = requests.post(
+        create_res = self.client.post(
             gen_transactions_path(), data=json.dumps(transaction_body))
         self.assertEqual(create_res.status_code, 201)
 
         tr = create_res.json().get("id")
         route = gen_transactions_route(tr)
-        res = requests.post(gen_transactions_path(
+        res = self.client.post(gen_transactions_path(
             tr), data=json.dumps({"accepted": False}))
         self.assertEqual(
             res.status_code,
             200
         )
 
-        res = requests.post(gen_transactions_path(
+        res = self.client.post(gen_transactions_path(
             tr), data=json.dumps({"accepted": True}))
         self.jsonable_test(res, req_type, route, 403, transaction_body)
 
         transaction_body["accepted"] = False
 
-        res1 = requests.get(gen_users_path(user1)).json()
+        res1 = self.client.get(gen_users_path(user1)).json()
         self.assertEqual(
             res1.get("balance"),
             0,
@@ -1042,7 +1450,7 @@ class TestRoutes(unittest.TestCase):
             )
         )
 
-        res2 = requests.get(gen_users_path(user2)).json()
+        res2 = self.client.get(gen_users_path(user2)).json()
         self.assertEqual(
             res2.get("balance"),
             20,
@@ -1076,16 +1484,16 @@ class TestRoutes(unittest.TestCase):
     def test_extra_create_friends(self):
         if not EXTRA_CREDIT:
             return
-        user1 = requests.post(gen_users_path(), data=json.dumps(
-            SAMPLE_USER)).json().get("id")
-        user2 = requests.post(gen_users_path(), data=json.dumps(
-            SAMPLE_USER)).json().get("id")
+        user1 = self.client.post(gen_users_path(), data=json.dumps(
+            gen_user_body())).json().get("id")
+        user2 = self.client.post(gen_users_path(), data=json.dumps(
+            gen_user_body())).json().get("id")
         route = gen_users_route(user1, True) + f"friends/{user2}/"
         req_type = "POST"
         path = gen_users_path(user1, True) + f"friends/{user2}/"
-        res = requests.post(path, data=None)
+        res = self.client.post(path, data=None)
         self.assertEqual(res.status_code, 201)
-        res2 = requests.get(gen_users_path(user1, True) +
+        res2 = self.client.get(gen_users_path(user1, True) +
                             "friends/").json().get("friends")
         for f in res2:
             self.assertEqual(
@@ -1094,7 +1502,7 @@ class TestRoutes(unittest.TestCase):
             )
         self.assertEqual(len(res2), 1, wrong_value_error(
             req_type, route, len(res2), 1, "length of friends"))
-        res3 = requests.get(gen_users_path(user2, True) +
+        res3 = self.client.get(gen_users_path(user2, True) +
                             "friends/").json().get("friends")
         for f in res3:
             self.assertEqual(
@@ -1107,11 +1515,11 @@ class TestRoutes(unittest.TestCase):
     def test_extra_get_friends(self):
         if not EXTRA_CREDIT:
             return
-        user1 = requests.post(gen_users_path(), data=json.dumps(
-            SAMPLE_USER)).json().get("id")
+        user1 = self.client.post(gen_users_path(), data=json.dumps(
+            gen_user_body())).json().get("id")
         route = gen_users_route(user1, True) + f"friends/"
         req_type = "GET"
-        res = requests.get(gen_users_path(user1, True) + "friends/")
+        res = self.client.get(gen_users_path(user1, True) + "friends/")
         self.jsonable_test(res, req_type, route, 200)
         res = res.json()
         self.assertEqual(type(res.get("friends")), list, wrong_value_error(
@@ -1123,15 +1531,15 @@ class TestRoutes(unittest.TestCase):
         user1 = self.create_user_and_assert_balance(10).get("id")
         user2 = self.create_user_and_assert_balance(10).get("id")
         txn1 = gen_transaction_body(user1, user2, True)
-        txn1_response = requests.post(
+        txn1_response = self.client.post(
             gen_transactions_path(), data=json.dumps(txn1)).json()
         txn2 = gen_transaction_body(user1, user2, None)
-        txn2_response = requests.post(
+        txn2_response = self.client.post(
             gen_transactions_path(), data=json.dumps(txn2)).json()
         txn3 = gen_transaction_body(user1, user2, None)
-        txn3_response = requests.post(
+        txn3_response = self.client.post(
             gen_transactions_path(), data=json.dumps(txn3)).json()
-        requests.post(gen_transactions_path(
+        self.client.post(gen_transactions_path(
             txn3_response["id"]), data=json.dumps({"accepted": False}))
         txn3["accepted"] = False
         expected = [{
@@ -1154,7 +1562,7 @@ class TestRoutes(unittest.TestCase):
 
         route = gen_users_route(user1, True) + "join/"
         req_type = "GET"
-        res = requests.get(gen_users_path(user1, True) + "join/")
+        res = self.client.get(gen_users_path(user1, True) + "join/")
         self.jsonable_test(res, req_type, route, 200)
         res = res.json().get("transactions")
         self.assertEqual(len(res), 3, wrong_value_error(
@@ -1175,15 +1583,674 @@ class TestRoutes(unittest.TestCase):
                 )
 
 
-def run_tests():
-    sleep(1.5)
-    sys.argv = sys.argv[:1]
-    unittest.main()
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Seed enough rows and statistics for the planner to make real choices
+        cls.db = db.DatabaseDriver(":memory:")
+        users = [cls.db.create_a_user(f"Seed {i}", f"seed_{RUN_ID}_{i}", 100) for i in range(50)]
+        for i in range(500):
+            cls.db.add_request_to_transactions(
+                users[i % 50], users[(i * 7) % 50], 1, None, "seed")
+        cls.db.conn.execute("ANALYZE;")
+
+    def test_registered_queries_plan(self):
+        for name in db.QUERIES:
+            self.assertIsInstance(self.db.explain(name), list)
+
+    def test_hot_queries_use_indexes(self):
+        for name in db.HOT_QUERIES:
+            plan = self.db.explain(name)
+            scans = [step for step in plan if step.startswith("SCAN")]
+            self.assertEqual(
+                scans,
+                [],
+                error_str(f"Hot query '{name}' regressed to a full scan: {plan}"),
+            )
+
+
+class TestMemoryDriver(unittest.TestCase):
+    def test_snapshot_and_write_log_recovery(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {
+                "snapshot_path": os.path.join(tmp, "ledger.json"),
+                "log_path": os.path.join(tmp, "ledger.log"),
+                "snapshot_interval": 3600,
+            }
+            ledger = memory.MemoryDriver(**paths)
+            alice = ledger.create_a_user("Alice", "alice", 10)
+            bob = ledger.create_a_user("Bob", "bob", 0)
+            ledger.send_from_sender_to_receiver(alice, 4, bob, "lunch")
+            ledger.snapshot()
+            request_id = ledger.add_request_to_transactions(bob, alice, 1, None, "coffee")
+            self.assertTrue(ledger.accept_transaction_request(request_id, alice, bob, 1))
+            self.assertIsNone(ledger.send_from_sender_to_receiver(alice, 100, bob, "too much"))
+            ledger.close()
+
+            # Snapshot plus the writes logged after it
+            restored = memory.MemoryDriver(**paths)
+            self.assertEqual(restored.get_user_by_id(alice), ledger.get_user_by_id(alice))
+            self.assertEqual(restored.get_user_by_id(bob)["balance"], 5)
+            self.assertEqual(restored.get_last_transaction_id(), 2)
+            with self.assertRaises(sqlite3.IntegrityError):
+                restored.create_a_user("Alice", "alice", 0)
+            restored.close()
+
+    def test_crash_after_snapshot_before_log_truncated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {
+                "snapshot_path": os.path.join(tmp, "ledger.json"),
+                "log_path": os.path.join(tmp, "ledger.log"),
+                "snapshot_interval": 3600,
+            }
+            ledger = memory.MemoryDriver(**paths)
+            alice = ledger.create_a_user("Alice", "alice", 10)
+            bob = ledger.create_a_user("Bob", "bob", 0)
+            ledger.send_from_sender_to_receiver(alice, 4, bob, "lunch")
+            with open(paths["log_path"]) as f:
+                log = f.read()
+            ledger.snapshot()
+            ledger.close()
+            # As if the process died between writing the snapshot and
+            # truncating the log
+            with open(paths["log_path"], "w") as f:
+                f.write(log)
+
+            restored = memory.MemoryDriver(**paths)
+            self.assertEqual(restored.get_user_row(alice)["balance"], 6)
+            self.assertEqual(restored.get_user_row(bob)["balance"], 4)
+            self.assertEqual(len(restored.get_user_by_id(alice)["transactions"]), 1)
+            restored.send_from_sender_to_receiver(bob, 1, alice, "coffee")
+            restored.close()
+
+            again = memory.MemoryDriver(**paths)
+            self.assertEqual(again.get_user_row(bob)["balance"], 3)
+            again.close()
+
+
+class TestSimulation(unittest.TestCase):
+    def test_simulation_is_reproducible_and_conserves_money(self):
+        runs = [simulate.simulate(7, steps=5, events=200, agents=50) for _ in range(2)]
+        for run in runs:
+            self.assertLess(run["drift"], 1e-6)
+            for row in run["series"]:
+                self.assertAlmostEqual(row["total_balance"], 50 * 100.0, places=2)
+                del row["events_per_second"]
+        self.assertEqual(runs[0]["series"], runs[1]["series"])
+
+    def test_sweep_merges_scenarios(self):
+        grid = {"agents": [20], "events": [50], "overdraft": ["decline", "ledger"]}
+        swept = sweep.run_sweep(grid, range(2), 2, backend="sqlite", steps=3)
+        self.assertEqual([scenario for scenario, _ in swept], sweep.scenarios(grid))
+        for scenario, results in swept:
+            row = sweep.summarize(scenario, results)
+            self.assertEqual(row["runs"], 2)
+            self.assertLess(row["max_drift"], 1e-6)
+
+
+class TestCurrencies(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rates = os.path.join(self.tmp.name, "rates.json")
+        with open(rates, "w") as f:
+            json.dump({"EUR": 0.8}, f)
+        self.app = create_app({"VENMO_DB_PATH": ":memory:", "VENMO_RATES": rates})
+        self.client = Client(self.app)
+        self.alice = get_db(self.app).create_a_user("Alice", "alice", 100)
+        self.bob = get_db(self.app).create_a_user("Bob", "bob", 0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def pay(self, sender_id, receiver_id, amount, **fields):
+        body = dict(sender_id=sender_id, receiver_id=receiver_id, amount=amount, message="fx", accepted=True, **fields)
+        return self.client.post(gen_transactions_path(), data=json.dumps(body))
+
+    def balances(self, user_id):
+        return self.client.get(gen_users_path(user_id)).json()["balances"]
+
+    def test_converted_payment(self):
+        res = self.pay(self.alice, self.bob, 40, currency="EUR", source_currency="USD")
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()["source_amount"], 50.0)
+        self.assertEqual(self.balances(self.alice), {"USD": 50.0})
+        self.assertEqual(self.balances(self.bob), {"USD": 0.0, "EUR": 40.0})
+
+        self.assertEqual(self.pay(self.bob, self.alice, 30, currency="EUR").status_code, 201)
+        self.assertEqual(self.pay(self.bob, self.alice, 30, currency="EUR").status_code, 403)
+        self.assertEqual(self.balances(self.bob), {"USD": 0.0, "EUR": 10.0})
+        self.assertEqual(self.pay(self.bob, self.alice, 1, currency="JPY").status_code, 400)
+
+    def test_conversion_rounds_the_charge_up(self):
+        broke = get_db(self.app).create_a_user("Broke", "broke", 0)
+        self.assertEqual(self.pay(broke, self.bob, 0.003, currency="EUR", source_currency="USD").status_code, 403)
+        self.assertEqual(self.balances(self.bob), {"USD": 0.0})
+        res = self.pay(self.alice, self.bob, 0.003, currency="EUR", source_currency="USD")
+        self.assertEqual(res.json()["source_amount"], 0.01)
+
+    def test_request_accepted_from_another_currency(self):
+        body = dict(sender_id=self.alice, receiver_id=self.bob, amount=8, message="fx", currency="EUR")
+        request_id = self.client.post(gen_transactions_path(), data=json.dumps(body)).json()["id"]
+        res = self.client.post(gen_transactions_path(request_id), data=json.dumps({"accepted": True, "source_currency": "USD"}))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.balances(self.alice), {"USD": 90.0})
+        self.assertEqual(self.balances(self.bob), {"USD": 0.0, "EUR": 8.0})
+
+    def test_rates_refresh_in_forked_worker(self):
+        path = os.path.join(self.tmp.name, "forked.json")
+        with open(path, "w") as f:
+            json.dump({"EUR": 0.8}, f)
+        app = create_app({"VENMO_DB_PATH": ":memory:", "VENMO_RATES": path, "VENMO_RATES_REFRESH": 0.01})
+        rates = app.extensions["venmo"]["rates"]
+        # Like gunicorn's master, which forks before any request
+        self.assertIsNone(rates.refresh_pid)
+        pid = os.fork()
+        if pid == 0:
+            get_db(app)
+            with open(path, "w") as f:
+                json.dump({"EUR": 0.5}, f)
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            deadline = time.time() + 5
+            while rates.convert(10, "USD", "EUR") != 5.0 and time.time() < deadline:
+                time.sleep(0.01)
+            os._exit(0 if rates.convert(10, "USD", "EUR") == 5.0 else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class TestVelocity(unittest.TestCase):
+    def test_window_slides(self):
+        checker = velocity.VelocityChecker(velocity.parse_rules("60:amount=100:count=2"))
+        self.assertIsNone(checker.reserve(1, 60, 1000.0))
+        self.assertIsNotNone(checker.reserve(1, 60, 1010.0))
+        self.assertIsNone(checker.reserve(1, 40, 1020.0))
+        self.assertIsNotNone(checker.reserve(1, 1, 1030.0))
+        self.assertIsNone(checker.reserve(2, 1, 1030.0))
+        checker.release(1, 40, 1020.0)
+        self.assertIsNone(checker.reserve(1, 40, 1030.0))
+        self.assertIsNone(checker.reserve(1, 100, 1100.0))
+
+    def test_rules_need_a_single_worker(self):
+        with self.assertRaises(ValueError):
+            create_app({"VENMO_DB_PATH": ":memory:", "VENMO_VELOCITY_RULES": velocity.parse_rules("3600:amount=50"), "VENMO_WORKERS": 2})
+
+    def test_rebuilt_from_recent_transfers(self):
+        driver = memory.MemoryDriver()
+        sender = driver.create_a_user("Sender", "sender", 100)
+        receiver = driver.create_a_user("Receiver", "receiver", 0)
+        driver.send_from_sender_to_receiver(sender, 30, receiver, "rent")
+        driver.add_request_to_transactions(receiver, sender, 50, None, "unpaid")
+        checker = velocity.VelocityChecker(velocity.parse_rules("3600:amount=50"))
+        checker.rebuild((sender_id, amount, timestamp) for sender_id, amount, _, timestamp
+                        in driver.recent_transfers(checker.longest_window()))
+        self.assertIsNotNone(checker.reserve(sender, 25, time.time()))
+        self.assertIsNone(checker.reserve(sender, 20, time.time()))
+
+    def test_failed_transfer_releases_reservation(self):
+        app = create_app({"VENMO_DB_PATH": ":memory:", "VENMO_VELOCITY_RULES": velocity.parse_rules("3600:amount=50")})
+        driver = get_db(app)
+        sender = driver.create_a_user("Sender", "sender", 100)
+        receiver = driver.create_a_user("Receiver", "receiver", 0)
+        body = {"sender_id": sender, "receiver_id": receiver, "amount": 40, "message": "rent", "accepted": True}
+        client = app.test_client()
+
+        def broken(ops):
+            raise sqlite3.OperationalError("database is locked")
+        driver.apply_unit = broken
+        with self.assertLogs(app.logger, "ERROR"):
+            self.assertEqual(client.post(gen_transactions_path(), data=json.dumps(body)).status_code, 500)
+        del driver.apply_unit
+        self.assertEqual(client.post(gen_transactions_path(), data=json.dumps(body)).status_code, 201)
+        self.assertEqual(driver.get_user_row(sender)["balance"], 60)
+
+
+
+class TestJournal(unittest.TestCase):
+    def test_recovery_after_crash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "journal.db")
+            driver = db.DatabaseDriver(path)
+            alice = driver.create_a_user("Alice", "alice", 100)
+            bob = driver.create_a_user("Bob", "bob", 0)
+            request_id = driver.add_request_to_transactions(alice, bob, 10, None, "rent")
+            # Crash after journaling both intents but before applying them
+            send = driver.new_transaction(alice, bob, 25, "lunch", True)
+            accept = dict(driver.get_transaction_by_id(request_id), accepted=1)
+            driver.journal_intents([("send", send), ("accept", accept)])
+            driver.close()
+
+            # Opening the database, as the tools do, leaves the intents alone
+            reopened = db.DatabaseDriver(path)
+            self.assertIsNone(reopened.get_transaction_by_id(request_id)["accepted"])
+            self.assertEqual(reopened.get_user_row(alice)["balance"], 100)
+            reopened.close()
+
+            self.assertEqual(venmo_config.recover({
+                "VENMO_BACKEND": "sqlite", "VENMO_DB_PATH": path,
+                "VENMO_ARCHIVE_PATH": None, "VENMO_PRAGMAS": {},
+            }), 2)
+            recovered = db.DatabaseDriver(path)
+            statuses = recovered.conn.execute("SELECT kind, status FROM transfer_journal ORDER BY id;").fetchall()
+            self.assertEqual(statuses, [("send", "rolled_back"), ("accept", "replayed")])
+            self.assertEqual(recovered.get_transaction_by_id(request_id)["accepted"], 1)
+            self.assertEqual(recovered.get_user_row(alice)["balance"], 90)
+            self.assertEqual(recovered.get_user_row(bob)["balance"], 10)
+            self.assertEqual(len(recovered.get_user_by_id(alice)["transactions"]), 1)
+            self.assertEqual(recovered.recover_journal(), 0)
+            recovered.close()
+
+    def test_applied_and_rejected_intents_deleted(self):
+        driver = db.DatabaseDriver(":memory:")
+        alice = driver.create_a_user("Alice", "alice", 100)
+        bob = driver.create_a_user("Bob", "bob", 0)
+        self.assertIsNotNone(driver.send_from_sender_to_receiver(alice, 25, bob, "lunch"))
+        self.assertIsNone(driver.send_from_sender_to_receiver(bob, 500, alice, "too much"))
+        self.assertEqual(driver.conn.execute("SELECT COUNT(*) FROM transfer_journal;").fetchone()[0], 0)
+        driver.close()
+
+    def test_failed_apply_not_replayed(self):
+        driver = db.DatabaseDriver(":memory:")
+        alice = driver.create_a_user("Alice", "alice", 100)
+        bob = driver.create_a_user("Bob", "bob", 0)
+
+        def broken(conn, ops):
+            raise sqlite3.OperationalError("disk I/O error")
+        driver._apply_new = broken
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(sqlite3.OperationalError):
+                driver.send_from_sender_to_receiver(alice, 25, bob, "lunch")
+        del driver._apply_new
+
+        statuses = driver.conn.execute("SELECT status FROM transfer_journal;").fetchall()
+        self.assertEqual(statuses, [("failed",)])
+        self.assertEqual(driver.recover_journal(), 0)
+        self.assertEqual(driver.get_user_row(alice)["balance"], 100)
+        self.assertEqual(driver.get_user_row(bob)["balance"], 0)
+        driver.close()
+
+    def test_prune_resolved_entries(self):
+        driver = db.DatabaseDriver(":memory:")
+        with driver.write_transaction() as conn:
+            conn.executemany(
+                "INSERT INTO transfer_journal (created_at, kind, sender_id, receiver_id, amount, status) VALUES (?, 'send', 1, 2, 1, ?);",
+                [("2020-01-01 00:00:00.000000", "rolled_back"), ("2020-01-01 00:00:00.000000", "pending"),
+                 (driver.current_timestamp(), "failed")]
+            )
+        self.assertEqual(driver.prune_journal(days=30), 1)
+        statuses = driver.conn.execute("SELECT status FROM transfer_journal ORDER BY id;").fetchall()
+        self.assertEqual(statuses, [("pending",), ("failed",)])
+        driver.close()
+
+
+class TestGenerate(unittest.TestCase):
+    def test_same_seed_same_database(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dumps = []
+            for name in ("a.db", "b.db"):
+                path = os.path.join(tmp, name)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    generate.main(["--db", path, "--users", "50", "--transactions", "500", "--end", "2025-06-01"])
+                conn = sqlite3.connect(path)
+                dumps.append(conn.execute("SELECT * FROM transactions ORDER BY id;").fetchall())
+                conn.close()
+        self.assertEqual(dumps[0], dumps[1])
+        self.assertLessEqual(dumps[0][-1][1], "2025-06-01 00:00:00.000000")
+
+
+class TestRecording(unittest.TestCase):
+    def test_records_compressed_response(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "traffic.ndjson")
+            app = create_app({"VENMO_DB_PATH": ":memory:", "VENMO_RECORD": path, "VENMO_COMPRESS_MIN_SIZE": 0})
+            user_id = get_db(app).create_a_user("Alice", "alice", 10)
+            res = app.test_client().get(gen_users_path(user_id), headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.headers["Content-Encoding"], "gzip")
+            app.extensions["venmo"]["recorder"].file.close()
+
+            entry, = replay.load(path)
+            self.assertEqual(entry["headers"], {"Accept-Encoding": "gzip"})
+            self.assertEqual(json.loads(entry["response"])["username"], "alice")
+
+
+class TestReplay(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from werkzeug.serving import make_server
+        # Quiet the per-request access log
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.server = make_server("127.0.0.1", 0, create_app({"VENMO_DB_PATH": os.path.join(cls.tmp.name, "replay.db")}), threaded=True)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.tmp.cleanup()
+
+    def entry(self, t, path="/", status=200, response="Hello world!"):
+        return {"t": t, "method": "GET", "path": path, "body": "", "status": status, "response": response, "ms": 1.0}
+
+    def test_timing_starts_at_first_request(self):
+        # Recorded an hour after the app started
+        entries = [self.entry(3600 + i * 0.2) for i in range(3)]
+        results, elapsed = replay.replay(entries, self.url, 1.0, 1)
+        self.assertGreaterEqual(elapsed, 0.4)
+        self.assertLess(elapsed, 5)
+        self.assertEqual([status for _, status, _, _ in results], [200] * 3)
+
+    def test_speed_scaling(self):
+        entries = [self.entry(3600 + i * 0.2) for i in range(3)]
+        _, elapsed = replay.replay(entries, self.url, 4.0, 1)
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertLess(elapsed, 0.4)
+        _, elapsed = replay.replay(entries, self.url, None, 1)
+        self.assertLess(elapsed, 0.1)
+
+    def test_mismatches_reported(self):
+        entries = [
+            self.entry(0),
+            self.entry(0, status=404),
+            self.entry(0, response="Goodbye"),
+            self.entry(0, path="/api/users/12345/", status=404,
+                       response=json.dumps({"error": "User not found", "timestamp": "then"})),
+        ]
+        results, elapsed = replay.replay(entries, self.url, None, 1)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(replay.report(results, elapsed, 1.0), 2)
+        self.assertIn("status GET /: recorded 404, got 200", output.getvalue())
+        self.assertIn("body GET /: responses differ", output.getvalue())
+        self.assertIn("1 status mismatches, 1 body mismatches", output.getvalue())
+
+
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.driver = db.DatabaseDriver(os.path.join(self.tmp.name, "reconcile.db"))
+        alice, bob, carol = (self.driver.create_a_user(name, name.lower(), 100) for name in ("Alice", "Bob", "Carol"))
+        self.driver.send_from_sender_to_receiver(alice, 10, bob, "rent")
+        self.driver.send_from_sender_to_receiver(bob, 5, carol, "boba")
+        self.driver.send_from_sender_to_receiver(carol, 2, alice, "coffee")
+        request_id = self.driver.add_request_to_transactions(bob, alice, 4, None, "dinner")
+        self.driver.accept_transaction_request(request_id, bob, alice, 4)
+        self.driver.add_request_to_transactions(alice, bob, 50, None, "open")
+        # Transfers with a missing party move no balance
+        with self.driver.write_transaction() as conn:
+            conn.execute(db.QUERIES["load_transaction"], (self.driver.current_timestamp(), None, alice, 7, "gift", True))
+            conn.execute(db.QUERIES["load_transaction"], (self.driver.current_timestamp(), bob, None, 3, "gift", True))
+        # Carol has the highest id, so her transfers point past max_user_id
+        self.driver.delete_specific_user(carol)
+        self.bob = bob
+
+    def tearDown(self):
+        self.driver.close()
+        self.tmp.cleanup()
+
+    def test_ledger_matches(self):
+        self.assertEqual(reconcile.reconcile(self.driver, chunk_size=2), ([], 6))
+
+    def test_tampered_balance(self):
+        with self.driver.write_transaction() as conn:
+            conn.execute("UPDATE venmo SET balance = balance + 1 WHERE id = ?;", (self.bob,))
+        mismatches, _ = reconcile.reconcile(self.driver, chunk_size=2)
+        self.assertEqual(mismatches, [(self.bob, 101.0, 102.0)])
+
+
+class TestVolume(unittest.TestCase):
+    def test_volume_reads_take_no_write_lock(self):
+        driver = db.DatabaseDriver(":memory:")
+        alice = driver.create_a_user("Alice", "alice", 100)
+        bob = driver.create_a_user("Bob", "bob", 0)
+        driver.send_from_sender_to_receiver(alice, 10, bob, "rent")
+        driver.refresh_rollups()
+        driver.send_from_sender_to_receiver(alice, 5, bob, "boba")
+        mark = driver.conn.execute(db.QUERIES["rollup_high_water_mark"]).fetchone()
+
+        results = []
+        with driver.write_lock:
+            reader = Thread(target=lambda: results.append(driver.get_volume("day", "0", "9")))
+            reader.start()
+            reader.join(timeout=5)
+            self.assertFalse(reader.is_alive())
+        buckets, = results
+        self.assertEqual([(b["count"], b["volume"]) for b in buckets], [(2, 15.0)])
+        self.assertEqual(driver.conn.execute(db.QUERIES["rollup_high_water_mark"]).fetchone(), mark)
+
+        self.assertEqual(driver.refresh_rollups(), 1)
+        self.assertEqual(driver.get_volume("day", "0", "9"), buckets)
+        with driver.write_lock:
+            # Nothing new to fold, so no write lock needed
+            self.assertEqual(driver.refresh_rollups(), 0)
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.driver = db.DatabaseDriver(os.path.join(self.tmp.name, "archive.db"))
+        self.alice = self.driver.create_a_user("Alice", "alice", 100)
+        self.bob = self.driver.create_a_user("Bob", "bob", 100)
+
+    def tearDown(self):
+        self.driver.close()
+        self.tmp.cleanup()
+
+    def transfers(self):
+        ids = []
+        for i in range(4):
+            ids.append(self.driver.send_from_sender_to_receiver(self.alice, 1 + i, self.bob, "old"))
+            request_id = self.driver.add_request_to_transactions(self.alice, self.bob, 2, None, "old")
+            self.driver.accept_transaction_request(request_id, self.alice, self.bob, 2)
+            ids.append(request_id)
+        ids.append(self.driver.add_request_to_transactions(self.bob, self.alice, 3, None, "open"))
+        return ids
+
+    def pages(self, limit=3):
+        pages, before = [], None
+        while True:
+            page = self.driver.search_transactions(user_id=self.alice, before=before, limit=limit)
+            if not page:
+                return pages
+            pages.append([txn["id"] for txn in page])
+            before = (page[-1]["timestamp"], page[-1]["id"])
+
+    def snapshot(self, ids):
+        return (
+            self.driver.get_user_by_id(self.alice)["transactions"],
+            [self.driver.get_transaction_by_id(i) for i in ids],
+            self.pages(),
+            reconcile.reconcile(self.driver, chunk_size=4),
+        )
+
+    def test_archiving_changes_no_reads(self):
+        ids = self.transfers()
+        time.sleep(0.01)
+        cutoff = self.driver.current_timestamp()
+        ids += self.transfers()
+        before = self.snapshot(ids)
+
+        self.assertEqual(self.driver.archive_transactions(cutoff, batch_size=3), 8)
+        archived = self.driver.conn.execute("SELECT COUNT(*) FROM archive.transactions;").fetchone()[0]
+        self.assertEqual(archived, 8)
+        self.assertEqual(self.snapshot(ids), before)
+        self.assertEqual(before[3], ([], 16))
+
+
+class TestBackups(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.driver = db.DatabaseDriver(os.path.join(self.tmp.name, "primary.db"))
+        self.alice = self.driver.create_a_user("Alice", "alice", 100)
+        self.bob = self.driver.create_a_user("Bob", "bob", 0)
+        self.driver.send_from_sender_to_receiver(self.alice, 25, self.bob, "rent")
+
+    def tearDown(self):
+        self.driver.close()
+        self.tmp.cleanup()
+
+    def balances(self, conn):
+        return conn.execute("SELECT id, balance FROM venmo ORDER BY id;").fetchall()
+
+    def test_backup(self):
+        for pages in (-1, 1):
+            target = os.path.join(self.tmp.name, f"backup{pages}.db")
+            self.driver.backup(target, pages=pages)
+            copy = sqlite3.connect(target)
+            self.assertEqual(self.balances(copy), [(self.alice, 75.0), (self.bob, 25.0)])
+            self.assertEqual(copy.execute("SELECT COUNT(*) FROM transactions;").fetchone()[0], 1)
+            copy.close()
+
+    def test_replica_refresh(self):
+        for path in (":memory:", os.path.join(self.tmp.name, "replica.db")):
+            self.driver.start_replica(path, interval=3600)
+            with self.driver.read_replica() as conn:
+                first = conn
+                self.assertEqual(self.balances(conn), [(self.alice, 75.0), (self.bob, 25.0)])
+
+            self.driver.send_from_sender_to_receiver(self.bob, 5, self.alice, "boba")
+            with self.driver.read_replica() as conn:
+                self.assertEqual(self.balances(conn), [(self.alice, 75.0), (self.bob, 25.0)])
+            self.driver.refresh_replica()
+            with self.driver.read_replica() as conn:
+                self.assertIsNot(conn, first)
+                self.assertEqual(self.balances(conn), [(self.alice, 80.0), (self.bob, 20.0)])
+            self.driver.send_from_sender_to_receiver(self.alice, 5, self.bob, "boba")
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "replica.db.standby")))
+
+    def test_replica_readers_run_together(self):
+        self.driver.start_replica(":memory:", interval=3600)
+        inside, done = threading.Event(), threading.Event()
+        seen = []
+
+        def slow_reader():
+            with self.driver.read_replica() as conn:
+                inside.set()
+                done.wait(5)
+                # Still usable after a refresh replaced it
+                seen.append((conn, self.balances(conn)))
+
+        reader = Thread(target=slow_reader)
+        reader.start()
+        inside.wait(5)
+        with self.driver.read_replica() as conn:
+            self.assertEqual(self.balances(conn), [(self.alice, 75.0), (self.bob, 25.0)])
+        self.driver.send_from_sender_to_receiver(self.bob, 5, self.alice, "boba")
+        self.assertEqual(len(self.driver.search_transactions(user_id=self.alice)), 1)
+        self.driver.refresh_replica()
+        self.assertEqual(len(self.driver.search_transactions(user_id=self.alice)), 2)
+        done.set()
+        reader.join()
+        (old, balances), = seen
+        self.assertEqual(balances, [(self.alice, 75.0), (self.bob, 25.0)])
+        # Closed by its last reader
+        with self.assertRaises(sqlite3.ProgrammingError):
+            old.execute("SELECT 1;")
+        self.assertEqual(self.driver.replica_readers, {})
+
+
+class TestDatabasePaths(unittest.TestCase):
+    def test_drivers_per_path_are_isolated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            first = db.DatabaseDriver(os.path.join(tmp, "first.db"))
+            second = db.DatabaseDriver(os.path.join(tmp, "second.db"))
+            first.create_a_user("First", "first", 1)
+            self.assertEqual(len(first.get_all_users()), 1)
+            self.assertEqual(second.get_all_users(), [])
+            self.assertTrue(os.path.exists(os.path.join(tmp, "first_archive.db")))
+            first.conn.close()
+            second.conn.close()
+
+    def test_pool_hands_threads_their_own_connections(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            driver = db.DatabaseDriver(os.path.join(tmp, "pool.db"), pool_size=2)
+            seen = []
+            thread = Thread(target=lambda: seen.append(driver.conn))
+            thread.start()
+            thread.join()
+            self.assertIsNot(seen[0], driver.conn)
+            for conn in driver.pool:
+                conn.close()
+
+    def test_create_app_opens_configured_database_lazily(self):
+        configured = create_app({
+            "VENMO_BACKEND": "sqlite",
+            "VENMO_DB_PATH": ":memory:",
+            "VENMO_PRAGMAS": {"synchronous": "OFF"},
+        })
+        self.assertIsNone(configured.extensions["venmo"]["db"])
+        driver = get_db(configured)
+        self.assertEqual(driver.path, ":memory:")
+        self.assertEqual(driver.conn.execute("PRAGMA synchronous;").fetchone()[0], 0)
+        self.assertEqual(driver.get_all_users(), [])
+        with self.assertRaises(ValueError):
+            db.DatabaseDriver(":memory:", pragmas={"synchronous": "OFF; DROP TABLE venmo"})
+
+
+def run_shard(test_ids, extra_credit):
+    """
+    Run some of the tests in this process and return what happened to them
+    """
+    global EXTRA_CREDIT
+    EXTRA_CREDIT = extra_credit
+    suite = unittest.defaultTestLoader.loadTestsFromNames(test_ids, sys.modules[__name__])
+    result = unittest.TestResult()
+    suite.run(result)
+    return {
+        "run": result.testsRun,
+        "failures": [(str(test), trace) for test, trace in result.failures],
+        "errors": [(str(test), trace) for test, trace in result.errors],
+        "skipped": len(result.skipped),
+    }
+
+
+def run_sharded(workers, extra_credit):
+    """
+    Split the tests round robin across workers processes. Every test has its
+    own in-memory database, so shards can't interfere with each other
+    """
+    start = time.perf_counter()
+    suite = unittest.defaultTestLoader.loadTestsFromModule(sys.modules[__name__])
+    test_ids = [test.id().split(".", 1)[1] for test in iterate_tests(suite)]
+    shards = [test_ids[i::workers] for i in range(workers)]
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(run_shard, shards, [extra_credit] * workers))
+
+    for kind in ("failures", "errors"):
+        for result in results:
+            for test, trace in result[kind]:
+                print("=" * 70)
+                print(f"{kind[:-1].upper()}: {test}")
+                print("-" * 70)
+                print(trace)
+    run = sum(result["run"] for result in results)
+    failed = sum(len(result["failures"]) for result in results)
+    errors = sum(len(result["errors"]) for result in results)
+    skipped = sum(result["skipped"] for result in results)
+    print("-" * 70)
+    print(f"Ran {run} tests in {time.perf_counter() - start:.3f}s on {workers} workers")
+    print()
+    details = [f"{name}={count}" for name, count in (("failures", failed), ("errors", errors), ("skipped", skipped)) if count]
+    status = "FAILED" if failed or errors else "OK"
+    print(f"{status} ({', '.join(details)})" if details else status)
+    return 1 if failed or errors else 0
+
+
+def iterate_tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iterate_tests(test)
+        else:
+            yield test
 
 
 if __name__ == "__main__":
-    argv = sys.argv[1:]
-    EXTRA_CREDIT = len(argv) > 0 and argv[0] == "--extra"
-    thread = Thread(target=run_tests)
-    thread.start()
-    app.run(host="0.0.0.0", port=5000, debug=False)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the venmo test suite")
+    parser.add_argument("--extra", action="store_true", help="also run the extra credit tests")
+    parser.add_argument("--workers", type=int, default=1, help="processes to shard the tests across")
+    args, rest = parser.parse_known_args()
+    EXTRA_CREDIT = args.extra
+    if args.workers > 1:
+        sys.exit(run_sharded(args.workers, args.extra))
+    unittest.main(argv=sys.argv[:1] + rest)
@@ -0,0 +1,94 @@
+"""
+Check that every user's balance (in the base currency) equals their opening
+balance plus the net amount of their accepted transfers.
+
+The transactions table is streamed in chunks of --chunk-size rows, so memory
+stays fixed however large the ledger is. Each chunk becomes NumPy arrays and
+per-user net flows are scatter-summed with bincount, with no per-row Python.
+
+Usage: python reconcile.py [--db PATH] [--chunk-size N] [--tolerance X]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import db
+
+
+def net_flows(conn, size, chunk_size):
+    """
+    Return an array indexed by user id of money received minus money sent
+    in the base currency over all accepted transfers, and the number of
+    transfers read. Legs in other currencies are counted against user 0
+    """
+    net = np.zeros(size)
+    rows = 0
+    cursor = conn.execute(db.QUERIES["accepted_transfers"])
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            return net, rows
+        rows += len(chunk)
+        # A column of NULL ids (a transfer with a missing party) becomes NaN
+        chunk = np.array(chunk, dtype=np.float64)
+        chunk = chunk[~np.isnan(chunk).any(axis=1)]
+        senders = chunk[:, 0].astype(np.int64)
+        receivers = chunk[:, 1].astype(np.int64)
+        # A converted transfer sends one amount and receives another
+        sent = chunk[:, 2]
+        received = chunk[:, 3]
+        # Transfers involving users deleted after the max id was read
+        top = max(senders.max(initial=0), receivers.max(initial=0)) + 1
+        if top > len(net):
+            net = np.concatenate([net, np.zeros(top - len(net))])
+        net += np.bincount(receivers, weights=received, minlength=len(net))
+        net -= np.bincount(senders, weights=sent, minlength=len(net))
+
+
+def reconcile(driver, chunk_size=1_000_000, tolerance=1e-6):
+    """
+    Return a list of (user_id, expected balance, actual balance) for every
+    user whose balance doesn't match the ledger, and the number of transfers
+    read
+    """
+    conn = driver.conn
+    size = conn.execute(db.QUERIES["max_user_id"]).fetchone()[0] + 1
+    net, rows = net_flows(conn, size, chunk_size)
+
+    mismatches = []
+    cursor = conn.execute(db.QUERIES["user_balances"])
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            return mismatches, rows
+        users = np.array(chunk, dtype=np.float64)
+        ids = users[:, 0].astype(np.int64)
+        expected = np.nan_to_num(users[:, 1]) + net[ids]
+        actual = users[:, 2]
+        for i in np.nonzero(np.abs(expected - actual) > tolerance)[0]:
+            mismatches.append((int(ids[i]), float(expected[i]), float(actual[i])))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Reconcile balances against the ledger")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    mismatches, rows = reconcile(db.DatabaseDriver(args.db), args.chunk_size, args.tolerance)
+    elapsed = time.perf_counter() - start
+
+    for user_id, expected, actual in mismatches:
+        print(f"user {user_id}: balance {actual:.2f}, ledger says {expected:.2f}")
+    print(f"Reconciled {rows} transfers in {elapsed:.2f}s "
+          f"({rows / elapsed / 1e6 * 60 if elapsed else 0:.1f}M rows/min), "
+          f"{len(mismatches)} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,191 @@
+"""
+Record live traffic and replay it against another build.
+
+Run the app with VENMO_RECORD=traffic.ndjson to log every request (method,
+path, body, the headers in REPLAYED_HEADERS, status, response and timing) as
+one JSON object per line. Compressed responses are recorded decompressed.
+Then start the build under test on a fresh venmo.db and run
+
+    python replay.py traffic.ndjson [--url URL] [--speed N|max] [--concurrency N]
+
+to send the same requests with the original spacing (divided by --speed, or
+none at all with max). Status codes and JSON bodies are compared against the
+recording, ignoring fields that legitimately differ between runs, and the
+throughput and latency of both runs are reported side by side. With
+--concurrency above 1 requests may commit in a different order than they were
+recorded in, so ids and balances can legitimately differ; compare bodies at
+concurrency 1.
+"""
+import argparse
+import gzip
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, request
+
+from compression import brotli
+
+# Fields whose values depend on when a request ran rather than on the build
+VOLATILE_FIELDS = {"timestamp", "next_cursor", "bucket"}
+
+# Request headers that change the response, recorded and sent again
+REPLAYED_HEADERS = ("Accept-Encoding", "If-None-Match")
+
+
+def decode(data, encoding):
+    """
+    A response body as text, decompressed according to its Content-Encoding
+    """
+    if encoding == "gzip":
+        data = gzip.decompress(data)
+    elif encoding == "br":
+        data = brotli.decompress(data)
+    return data.decode()
+
+
+class TrafficRecorder(object):
+    """
+    Flask hooks that append one NDJSON line per request to path
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a", buffering=1)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def install(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        g.record_start = time.monotonic()
+
+    def after_request(self, response):
+        now = time.monotonic()
+        start = getattr(g, "record_start", now)
+        line = json.dumps({
+            "t": round(start - self.started, 6),
+            "method": request.method,
+            "path": request.full_path if request.query_string else request.path,
+            "body": request.get_data(as_text=True),
+            "content_type": request.content_type,
+            "headers": {name: request.headers[name] for name in REPLAYED_HEADERS if name in request.headers},
+            "status": response.status_code,
+            "response": decode(response.get_data(), response.headers.get("Content-Encoding")),
+            "ms": round((now - start) * 1000, 3),
+        })
+        with self.lock:
+            self.file.write(line + "\n")
+        return response
+
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def normalize(text):
+    """
+    Parse a JSON response and drop volatile fields at every level
+    """
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+        if isinstance(value, list):
+            return [strip(v) for v in value]
+        return value
+    try:
+        return strip(json.loads(text))
+    except ValueError:
+        return text
+
+
+def send(url, entry):
+    data = entry["body"].encode() if entry["body"] else None
+    req = urllib.request.Request(url + entry["path"], data=data, method=entry["method"])
+    if data is not None:
+        # urllib would otherwise label the body as a form, and Flask would
+        # parse it as one instead of leaving it in request.data
+        req.add_header("Content-Type", entry.get("content_type") or "application/json")
+    for name, value in entry.get("headers", {}).items():
+        req.add_header(name, value)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as res:
+            status, body = res.status, decode(res.read(), res.headers.get("Content-Encoding"))
+    except urllib.error.HTTPError as e:
+        status, body = e.code, decode(e.read(), e.headers.get("Content-Encoding"))
+    return status, body, (time.perf_counter() - start) * 1000
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def replay(entries, url, speed, concurrency):
+    """
+    Send entries to url and return a list of (entry, status, body, ms)
+    """
+    results = [None] * len(entries)
+    started = time.monotonic()
+
+    def run(i):
+        entry = entries[i]
+        if speed is not None:
+            delay = (entry["t"] - entries[0]["t"]) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        results[i] = (entry,) + send(url, entry)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, range(len(entries))))
+    return results, time.monotonic() - started
+
+
+def report(results, elapsed, recorded_elapsed):
+    status_mismatches = body_mismatches = 0
+    for entry, status, body, _ in results:
+        if status != entry["status"]:
+            status_mismatches += 1
+            print(f"status {entry['method']} {entry['path']}: recorded {entry['status']}, got {status}")
+        elif normalize(body) != normalize(entry["response"]):
+            body_mismatches += 1
+            print(f"body {entry['method']} {entry['path']}: responses differ")
+
+    recorded = [entry["ms"] for entry, _, _, _ in results]
+    replayed = [ms for _, _, _, ms in results]
+    print(f"\n{len(results)} requests, {status_mismatches} status mismatches, {body_mismatches} body mismatches")
+    print(f"{'':>10} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, latencies, seconds in (("recorded", recorded, recorded_elapsed), ("replayed", replayed, elapsed)):
+        rate = len(latencies) / seconds if seconds else float("inf")
+        print(f"{name:>10} {rate:>9.1f} {percentile(latencies, 0.5):>8.2f} "
+              f"{percentile(latencies, 0.95):>8.2f} {percentile(latencies, 0.99):>8.2f}")
+    return status_mismatches + body_mismatches
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay recorded traffic")
+    parser.add_argument("recording")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--speed", default="1", help="time multiplier, or 'max' for no waiting")
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    entries = load(args.recording)
+    if not entries:
+        print("Recording is empty")
+        return 1
+    speed = None if args.speed == "max" else float(args.speed)
+    recorded_elapsed = entries[-1]["t"] + entries[-1]["ms"] / 1000 - entries[0]["t"]
+    results, elapsed = replay(entries, args.url, speed, args.concurrency)
+    return 1 if report(results, elapsed, recorded_elapsed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,32 @@
+"""
+Serve the app from several pre-forked worker processes with gunicorn.
+
+The app object is built in the master before forking, but nothing in it is
+opened there: each worker opens its own database connections, replica and
+request sweeper on its first request (see app.get_db) and keeps them, along
+with rate limit buckets for its share of the limits, for as long as it runs. Reads run concurrently
+against the WAL database and every balance change is serialized through
+SQLite's write lock (see DatabaseDriver.write_transaction).
+
+Needs the gunicorn package.
+"""
+from gunicorn.app.base import BaseApplication
+
+
+class Server(BaseApplication):
+    """
+    gunicorn serving app with options (bind, workers, ...) set in code
+    rather than read from the command line
+    """
+
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        return self.application
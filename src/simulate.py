@@ -0,0 +1,329 @@
+"""
+Monte-Carlo simulation of a payment network running on the ledger.
+
+Agents are users with their own habits: how active they are (Zipf
+distributed, like generate.py), how much they usually spend, how often they
+request money instead of sending it and how readily they accept or deny the
+requests they receive. Each agent pays and requests from a fixed circle of
+friends, biased towards popular users.
+
+Every step the agents make --events new payments and requests, and answer
+some of the requests still open. The writes go through the driver's unit of
+work in batches of --batch-size, and the step's balance and network metrics
+are recorded. Under the default --overdraft decline, agents only send what
+they have, so a payment or an accepted request that would overdraw is
+declined by the agent; under --overdraft ledger they try anyway and the
+ledger rejects it. After the run the ledger's balances are compared with
+the simulation's own bookkeeping.
+
+Seeds run in parallel in a process pool, each on its own database, and the
+time-series of every seed are written to one CSV file.
+
+Usage: python simulate.py [--seeds N] [--agents N] [--steps N] [--events N] ...
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import db
+import generate
+import memory
+
+SERIES_FIELDS = [
+    "seed", "step", "events", "declined", "rejected", "payments", "requests", "accepted", "denied",
+    "volume", "pending", "total_balance", "gini", "top_1pct_share", "edges", "events_per_second",
+]
+
+
+class Agent(object):
+    """
+    A simulated user and how they behave
+    """
+    __slots__ = ("user_id", "friends", "spend", "request_ratio", "accept_ratio", "deny_ratio")
+
+    def __init__(self, user_id, spend, request_ratio, accept_ratio, deny_ratio):
+        self.user_id = user_id
+        self.friends = []
+        self.spend = spend
+        self.request_ratio = request_ratio
+        self.accept_ratio = accept_ratio
+        self.deny_ratio = deny_ratio
+
+
+class Simulation(object):
+    """
+    A population of agents making payments and requests through driver
+    """
+
+    def __init__(self, driver, seed=0, agents=1000, friends=10, zipf=1.1, opening_balance=100.0,
+                 request_ratio=0.3, accept_ratio=0.7, deny_ratio=0.2, batch_size=1000,
+                 overdraft="decline"):
+        if overdraft not in ("decline", "ledger"):
+            raise ValueError(f"unknown overdraft rule {overdraft!r}")
+        self.driver = driver
+        self.overdraft = overdraft
+        self.rng = rng = random.Random(seed)
+        self.seed = seed
+        self.batch_size = batch_size
+        self.step_number = 0
+
+        self.agents = []
+        self.balances = {}
+        for i in range(agents):
+            user_id = driver.create_a_user(f"Agent {i}", f"agent_{seed}_{i}", opening_balance)
+            self.agents.append(Agent(
+                user_id,
+                spend=rng.lognormvariate(2.5, 0.5),
+                request_ratio=min(1.0, rng.expovariate(1 / request_ratio)),
+                accept_ratio=accept_ratio * rng.uniform(0.8, 1.0),
+                deny_ratio=deny_ratio * rng.uniform(0.8, 1.2),
+            ))
+            self.balances[user_id] = float(opening_balance)
+
+        # Popular agents are everyone's friends and do the most
+        self.activity = generate.zipf_weights(agents, zipf)
+        by_popularity = self.agents[:]
+        rng.shuffle(by_popularity)
+        for agent in self.agents:
+            chosen = {id(agent)}
+            for friend in rng.choices(by_popularity, cum_weights=self.activity, k=friends):
+                if id(friend) not in chosen:
+                    chosen.add(id(friend))
+                    agent.friends.append(friend)
+            if not agent.friends:
+                agent.friends.append(by_popularity[0] if by_popularity[0] is not agent else by_popularity[1])
+        self.by_activity = by_popularity
+
+        self.by_user = {agent.user_id: agent for agent in self.agents}
+        self.pending = []
+        self.edges = set()
+        # Writes the ledger rejected this step, and accepted requests among
+        # them that are therefore still open
+        self.rejected = 0
+        self.reopened = []
+
+    def step(self, events):
+        """
+        Run one step of events new payments and requests plus answers to open
+        requests, and return the step's metrics
+        """
+        rng = self.rng
+        start = time.perf_counter()
+        counts = dict.fromkeys(("events", "declined", "payments", "requests", "accepted", "denied"), 0)
+        volume = 0.0
+        uow = self.driver.unit_of_work()
+        requests = []
+
+        # Answer requests opened in earlier steps
+        still_open = []
+        for txn in self.pending:
+            payer = self.by_user[txn["sender_id"]]
+            roll = rng.random()
+            if roll < payer.accept_ratio:
+                if self._can_pay(txn["sender_id"], txn["amount"]):
+                    self._move(txn)
+                    uow.accept(txn)
+                    counts["accepted"] += 1
+                    volume += txn["amount"]
+                else:
+                    uow.deny(txn)
+                    counts["declined"] += 1
+            elif roll < payer.accept_ratio + payer.deny_ratio:
+                uow.deny(txn)
+                counts["denied"] += 1
+            else:
+                still_open.append(txn)
+                continue
+            counts["events"] += 1
+            uow = self._flush_if_full(uow)
+
+        for agent in rng.choices(self.by_activity, cum_weights=self.activity, k=events):
+            friend = rng.choice(agent.friends)
+            amount = round(rng.expovariate(1 / agent.spend), 2) or 0.01
+            if rng.random() < agent.request_ratio:
+                # The friend is asked to pay the agent
+                requests.append(uow.request(friend.user_id, agent.user_id, amount, "request"))
+                counts["requests"] += 1
+            elif self._can_pay(agent.user_id, amount):
+                txn = uow.send(agent.user_id, friend.user_id, amount, "payment")
+                self._move(txn)
+                counts["payments"] += 1
+                volume += amount
+            else:
+                counts["declined"] += 1
+                continue
+            counts["events"] += 1
+            uow = self._flush_if_full(uow)
+        self._flush(uow)
+
+        self.pending = still_open + self.reopened + [txn for txn in requests if txn["id"] is not None]
+        self.step_number += 1
+        seconds = time.perf_counter() - start
+        rejected, self.rejected, self.reopened = self.rejected, 0, []
+        return dict(
+            counts,
+            rejected=rejected,
+            seed=self.seed,
+            step=self.step_number,
+            volume=round(volume, 2),
+            pending=len(self.pending),
+            events_per_second=round(counts["events"] / seconds) if seconds else 0,
+            **self.network_metrics(),
+        )
+
+    def _can_pay(self, user_id, amount):
+        return self.overdraft == "ledger" or self.balances[user_id] >= amount
+
+    def _move(self, txn):
+        self.balances[txn["sender_id"]] -= txn["amount"]
+        self.balances[txn["receiver_id"]] += txn["amount"]
+        self.edges.add((txn["sender_id"], txn["receiver_id"]))
+
+    def _flush_if_full(self, uow):
+        if len(uow.ops) < self.batch_size:
+            return uow
+        self._flush(uow)
+        return self.driver.unit_of_work()
+
+    def _flush(self, uow):
+        """
+        Apply a batch. If the ledger rejects it (an overdraft under
+        --overdraft ledger, or something else writing to the ledger), the
+        writes are retried one at a time and the agents' balances reread
+        """
+        ops = list(uow.ops)
+        if uow.flush():
+            return
+        for kind, txn in ops:
+            if not self.driver.apply_unit([(kind, txn)]):
+                self.rejected += 1
+                if kind == "accept":
+                    self.reopened.append(dict(txn, accepted=None))
+        for kind, txn in ops:
+            for user_id in (txn["sender_id"], txn["receiver_id"]):
+                self.balances[user_id] = self.driver.get_user_row(user_id)["balance"]
+
+    def network_metrics(self):
+        """
+        Total money, Gini coefficient of balances, the share of money held by
+        the richest 1% and the number of distinct payer -> payee edges
+        """
+        balances = sorted(self.balances.values())
+        n, total = len(balances), sum(balances)
+        weighted = sum(i * balance for i, balance in enumerate(balances, 1))
+        top = max(1, n // 100)
+        return {
+            "total_balance": round(total, 2),
+            "gini": round(2 * weighted / (n * total) - (n + 1) / n, 4) if total else 0.0,
+            "top_1pct_share": round(sum(balances[-top:]) / total, 4) if total else 0.0,
+            "edges": len(self.edges),
+        }
+
+    def run(self, steps, events):
+        return [self.step(events) for _ in range(steps)]
+
+    def drift(self):
+        """
+        Largest difference between the ledger's balance for an agent and the
+        simulation's
+        """
+        return max(
+            abs(self.driver.get_user_row(user_id)["balance"] - balance)
+            for user_id, balance in self.balances.items()
+        )
+
+
+def simulate(seed, backend="memory", steps=100, events=1000, **params):
+    """
+    Run one seed on a fresh database of its own, in memory or in a scratch
+    directory, and return its time-series and summary
+    """
+    start = time.perf_counter()
+    scratch = None
+    if backend == "memory":
+        driver = memory.MemoryDriver()
+    else:
+        scratch = tempfile.mkdtemp()
+        driver = db.DatabaseDriver(os.path.join(scratch, "simulation.db"))
+    try:
+        simulation = Simulation(driver, seed=seed, **params)
+        series = simulation.run(steps, events)
+        return {
+            "seed": seed,
+            "series": series,
+            "events": sum(row["events"] for row in series),
+            "seconds": time.perf_counter() - start,
+            "drift": simulation.drift(),
+        }
+    finally:
+        driver.close()
+        if scratch is not None:
+            shutil.rmtree(scratch)
+
+
+def _simulate(job):
+    seed, kwargs = job
+    return simulate(seed, **kwargs)
+
+
+def run_seeds(seeds, workers, **kwargs):
+    """
+    Run simulate() for every seed across a pool of worker processes
+    """
+    with multiprocessing.Pool(workers) as pool:
+        return sorted(pool.imap_unordered(_simulate, [(seed, kwargs) for seed in seeds]), key=lambda r: r["seed"])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Simulate a payment network on the ledger")
+    parser.add_argument("--seeds", type=int, default=4, help="number of seeds, starting at --first-seed")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--friends", type=int, default=10)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--events", type=int, default=1000, help="new payments and requests per step")
+    parser.add_argument("--batch-size", type=int, default=1000, help="writes per commit")
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--opening-balance", type=float, default=100.0)
+    parser.add_argument("--request-ratio", type=float, default=0.3)
+    parser.add_argument("--accept-ratio", type=float, default=0.7)
+    parser.add_argument("--deny-ratio", type=float, default=0.2)
+    parser.add_argument("--overdraft", choices=["decline", "ledger"], default="decline")
+    parser.add_argument("--out", default="simulation.csv")
+    args = parser.parse_args(argv)
+
+    results = run_seeds(
+        range(args.first_seed, args.first_seed + args.seeds), args.workers,
+        backend=args.backend, steps=args.steps, events=args.events, agents=args.agents,
+        friends=args.friends, zipf=args.zipf, opening_balance=args.opening_balance,
+        request_ratio=args.request_ratio, accept_ratio=args.accept_ratio,
+        deny_ratio=args.deny_ratio, batch_size=args.batch_size, overdraft=args.overdraft,
+    )
+
+    with open(args.out, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SERIES_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerows(result["series"])
+
+    print(f"{'seed':>6} {'events':>10} {'seconds':>9} {'events/s':>10} {'gini':>7} {'drift':>8}")
+    for result in results:
+        print(
+            f"{result['seed']:>6} {result['events']:>10} {result['seconds']:>9.2f} "
+            f"{result['events'] / result['seconds']:>10.0f} {result['series'][-1]['gini']:>7.4f} "
+            f"{result['drift']:>8.2g}"
+        )
+    print(f"Wrote {sum(len(r['series']) for r in results)} rows to {args.out}")
+    return 0 if all(result["drift"] < 0.01 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
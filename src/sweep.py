@@ -0,0 +1,139 @@
+"""
+Run a sweep of simulation scenarios in parallel and compare them.
+
+Every combination of the --agents, --events, --request-ratio and --overdraft
+values given is a scenario, run once per seed. Each (scenario, seed) run is
+one job in a single process pool and gets a database of its own (the
+in-memory driver, or a scratch SQLite file with --backend sqlite), so the
+whole sweep keeps every core busy. The runs are merged into one report with a
+row per scenario, averaged over its seeds, which is printed and written to
+--report; every run's time-series goes to --series, keyed by the scenario's
+number in the report.
+
+Usage: python sweep.py --agents 100,1000 --events 500,2000 --overdraft decline,ledger [--seeds N] ...
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+import simulate
+
+# Scenario parameters a sweep can vary, and how to parse their values
+SWEEP_PARAMS = {
+    "agents": int,
+    "events": int,
+    "request_ratio": float,
+    "overdraft": str,
+}
+
+REPORT_FIELDS = ["scenario"] + list(SWEEP_PARAMS) + [
+    "runs", "events_total", "events_per_second", "declined_pct", "rejected_pct",
+    "final_pending", "final_gini", "final_gini_stdev", "final_top_1pct_share", "edges", "max_drift",
+]
+
+
+def scenarios(grid):
+    """
+    Every combination of the values in grid, a dict of parameter -> values
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _run(job):
+    index, seed, kwargs = job
+    return index, simulate.simulate(seed, **kwargs)
+
+
+def run_sweep(grid, seeds, workers, **fixed):
+    """
+    Run every scenario of grid once per seed across a pool of worker
+    processes. fixed holds the simulate() arguments shared by every scenario.
+    Returns (scenario, results) pairs in scenario order
+    """
+    runs = scenarios(grid)
+    jobs = [(index, seed, dict(fixed, **scenario)) for index, scenario in enumerate(runs) for seed in seeds]
+    results = [[] for _ in runs]
+    with multiprocessing.Pool(workers) as pool:
+        for index, result in pool.imap_unordered(_run, jobs):
+            results[index].append(result)
+    return list(zip(runs, results))
+
+
+def summarize(scenario, results):
+    """
+    One report row for a scenario, from the results of its seeds
+    """
+    events = sum(result["events"] for result in results)
+    finals = [result["series"][-1] for result in results]
+    attempted = events + sum(row["declined"] for result in results for row in result["series"])
+    gini = [final["gini"] for final in finals]
+    return dict(
+        scenario,
+        runs=len(results),
+        events_total=events,
+        events_per_second=round(events / sum(result["seconds"] for result in results)),
+        declined_pct=round(100 * sum(row["declined"] for r in results for row in r["series"]) / attempted, 2),
+        rejected_pct=round(100 * sum(row["rejected"] for r in results for row in r["series"]) / attempted, 2),
+        final_pending=round(statistics.mean(final["pending"] for final in finals)),
+        final_gini=round(statistics.mean(gini), 4),
+        final_gini_stdev=round(statistics.stdev(gini), 4) if len(gini) > 1 else 0.0,
+        final_top_1pct_share=round(statistics.mean(final["top_1pct_share"] for final in finals), 4),
+        edges=round(statistics.mean(final["edges"] for final in finals)),
+        max_drift=max(result["drift"] for result in results),
+    )
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run simulation scenarios in parallel and compare them")
+    parser.add_argument("--agents", default="1000", help="comma-separated values to sweep")
+    parser.add_argument("--events", default="1000", help="comma-separated values to sweep")
+    parser.add_argument("--request-ratio", default="0.3", help="comma-separated values to sweep")
+    parser.add_argument("--overdraft", default="decline", help="comma-separated values to sweep")
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--report", default="sweep.csv")
+    parser.add_argument("--series", default="sweep_series.csv")
+    args = parser.parse_args(argv)
+
+    grid = {
+        name: [parse(value) for value in getattr(args, name).split(",")]
+        for name, parse in SWEEP_PARAMS.items()
+    }
+    start = time.perf_counter()
+    swept = run_sweep(
+        grid, range(args.seeds), args.workers,
+        backend=args.backend, steps=args.steps, batch_size=args.batch_size,
+    )
+    rows = [dict(summarize(scenario, results), scenario=index) for index, (scenario, results) in enumerate(swept)]
+
+    with open(args.report, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(args.series, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["scenario"] + simulate.SERIES_FIELDS)
+        writer.writeheader()
+        for index, (scenario, results) in enumerate(swept):
+            for result in results:
+                writer.writerows(dict(row, scenario=index) for row in result["series"])
+
+    widths = {name: max(len(name), *(len(str(row[name])) for row in rows)) for name in REPORT_FIELDS}
+    print(" ".join(name.rjust(widths[name]) for name in REPORT_FIELDS))
+    for row in rows:
+        print(" ".join(str(row[name]).rjust(widths[name]) for name in REPORT_FIELDS))
+    print(f"Ran {len(rows)} scenarios x {args.seeds} seeds on {args.workers} workers "
+          f"in {time.perf_counter() - start:.1f}s; wrote {args.report} and {args.series}")
+    return 0 if all(row["max_drift"] < 0.01 for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
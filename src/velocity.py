@@ -0,0 +1,175 @@
+"""
+Velocity checks on money leaving a user's account.
+
+A rule caps how much a sender may move, how many transfers they may make, or
+both, within a sliding window of seconds. Every sender has a ring of
+buckets per rule with running totals, so a check only touches the buckets
+that expired since the sender's last transfer; a sender who transfers often
+costs a few additions and comparisons. The window slides a bucket at a time
+(window / buckets seconds), so it covers between window - width and window
+seconds of history.
+
+The counters live in memory and are rebuilt from recent transfers in the
+database at startup. A process only sees the transfers it handles, so the
+app refuses velocity rules when it is served by more than one worker.
+
+Rules are written "window:amount=X:count=Y", comma separated, e.g.
+"3600:amount=500:count=20,86400:amount=2000".
+"""
+import threading
+from datetime import datetime
+
+
+class Rule(object):
+    """
+    At most max_amount moved and max_count transfers (either may be None)
+    per window seconds
+    """
+    __slots__ = ("window", "max_amount", "max_count", "buckets", "width")
+
+    def __init__(self, window, max_amount=None, max_count=None, buckets=60):
+        self.window = window
+        self.max_amount = max_amount
+        self.max_count = max_count
+        self.buckets = buckets
+        self.width = window / buckets
+
+    def describe(self):
+        limits = []
+        if self.max_amount is not None:
+            limits.append(f"${self.max_amount:g}")
+        if self.max_count is not None:
+            limits.append(f"{self.max_count} transfers")
+        return f"more than {' or '.join(limits)} in {self.window:g} seconds"
+
+
+def parse_rules(text):
+    """
+    Parse a comma-separated list of "window:amount=X:count=Y" rules
+    """
+    rules = []
+    for spec in filter(None, (part.strip() for part in text.split(","))):
+        window, *limits = spec.split(":")
+        options = {}
+        for limit in limits:
+            name, _, value = limit.partition("=")
+            if name == "amount":
+                options["max_amount"] = float(value)
+            elif name == "count":
+                options["max_count"] = int(value)
+            elif name == "buckets":
+                options["buckets"] = int(value)
+            else:
+                raise ValueError(f"unknown velocity limit {name!r} in {spec!r}")
+        rules.append(Rule(float(window), **options))
+    return rules
+
+
+class _Window(object):
+    """
+    One sender's buckets for one rule. head is the index of the newest bucket
+    """
+    __slots__ = ("head", "amount", "count", "amounts", "counts")
+
+    def __init__(self, rule, head):
+        self.head = head
+        self.amount = 0.0
+        self.count = 0
+        self.amounts = [0.0] * rule.buckets
+        self.counts = [0] * rule.buckets
+
+    def advance(self, rule, index):
+        """
+        Move the head to bucket index, dropping the buckets that left the
+        window
+        """
+        gap = index - self.head
+        if gap <= 0:
+            return
+        n = rule.buckets
+        if gap >= n:
+            self.amount, self.count = 0.0, 0
+            self.amounts = [0.0] * n
+            self.counts = [0] * n
+        else:
+            for i in range(self.head + 1, index + 1):
+                slot = i % n
+                self.amount -= self.amounts[slot]
+                self.count -= self.counts[slot]
+                self.amounts[slot] = 0.0
+                self.counts[slot] = 0
+        self.head = index
+
+
+class VelocityChecker(object):
+    """
+    Sliding-window counters for every sender, checked against rules
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.senders = {}
+        self.lock = threading.Lock()
+
+    def _windows(self, sender_id, now):
+        windows = self.senders.get(sender_id)
+        if windows is None:
+            windows = self.senders[sender_id] = [_Window(rule, int(now // rule.width)) for rule in self.rules]
+        return windows
+
+    def reserve(self, sender_id, amount, now, count=1):
+        """
+        Count count transfers totalling amount by sender_id at time now
+        (seconds since the epoch) if every rule allows them. Returns None if
+        they were counted, otherwise the first rule they break
+        """
+        with self.lock:
+            windows = self._windows(sender_id, now)
+            for rule, window in zip(self.rules, windows):
+                window.advance(rule, int(now // rule.width))
+                if rule.max_amount is not None and window.amount + amount > rule.max_amount:
+                    return rule
+                if rule.max_count is not None and window.count + count > rule.max_count:
+                    return rule
+            self._count(windows, amount, count)
+            return None
+
+    def _count(self, windows, amount, count=1):
+        for rule, window in zip(self.rules, windows):
+            slot = window.head % rule.buckets
+            window.amounts[slot] += amount
+            window.counts[slot] += count
+            window.amount += amount
+            window.count += count
+
+    def release(self, sender_id, amount, now, count=1):
+        """
+        Take back transfers reserved at time now that didn't go through
+        """
+        with self.lock:
+            for rule, window in zip(self.rules, self.senders.get(sender_id, ())):
+                index = int(now // rule.width)
+                # Only if its bucket is still in the window
+                if window.head - rule.buckets < index <= window.head:
+                    slot = index % rule.buckets
+                    window.amounts[slot] -= amount
+                    window.counts[slot] -= count
+                    window.amount -= amount
+                    window.count -= count
+
+    def longest_window(self):
+        return max((rule.window for rule in self.rules), default=0)
+
+    def rebuild(self, transfers):
+        """
+        Count transfers, (sender_id, amount, timestamp) tuples in timestamp
+        order, as if they had been reserved when they happened
+        """
+        with self.lock:
+            self.senders = {}
+            for sender_id, amount, timestamp in transfers:
+                now = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").timestamp()
+                windows = self._windows(sender_id, now)
+                for rule, window in zip(self.rules, windows):
+                    window.advance(rule, int(now // rule.width))
+                self._count(windows, amount)